@@ -0,0 +1,37 @@
+#!/usr/bin/env python
+
+from __future__ import annotations
+
+import argparse
+import os
+from os import PathLike
+
+from cli_utils import add_default_cli_args, use_default_cli_args
+from geo.rail_index import RailIndex, default_cell_size
+
+
+def build_rail_index(osm_file: PathLike | str,
+                     out_file: PathLike | str,
+                     cell_size: float = default_cell_size) -> RailIndex:
+    rail_index = RailIndex.from_osm(str(osm_file), cell_size=cell_size)
+    rail_index.save(str(out_file))
+    return rail_index
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Erstellt aus einem OSM-Auszug einen lokalen Index der Bahnstrecken, '
+                                                 'der statt der Overpass-API verwendet werden kann')
+    parser.add_argument('osm', metavar='OSM_DATEI', type=str,
+                        help="Der OSM-Auszug (.osm als XML oder .osm.pbf, wofür pyosmium benötigt wird). "
+                             "Es reicht, wenn er nur die Bahnstrecken enthält (z.B. mit osmium tags-filter w/railway=rail)")
+    parser.add_argument('--out-file', metavar='DATEI', type=str,
+                        help="Die Datei, in die der Index gespeichert wird. Standard: <Daten-Verzeichnis>/rail_index.npz")
+    parser.add_argument('--cell-size', type=float, default=default_cell_size,
+                        help="Die Größe der Zellen des Index in Grad")
+    add_default_cli_args(parser, tc_directory=False)
+    args = parser.parse_args()
+    use_default_cli_args(args)
+
+    if args.out_file is None:
+        args.out_file = os.path.join(args.data_directory, "rail_index.npz")
+    build_rail_index(args.osm, args.out_file, args.cell_size)
@@ -1,6 +1,8 @@
 from __future__ import annotations
 
 import argparse
+import atexit
+import glob
 import logging
 import os
 from argparse import ArgumentParser, Namespace
@@ -8,8 +10,10 @@ from os import PathLike
 from os.path import isfile
 from typing import List, Tuple, Generator, Optional
 
+from geo.cache import ResponseCache, set_default_cache_factory
 from structures import DataSet
 from structures.country import CodeParser, iso_3166_to_country, tld_to_country
+from tc_utils import profiling
 
 
 def check_files(tc_directory: PathLike | str, data_directory: PathLike | str):
@@ -26,6 +30,24 @@ def check_files(tc_directory: PathLike | str, data_directory: PathLike | str):
         exit(1)
 
 
+def expand_file_patterns(patterns: List[str], extension: str) -> List[str]:
+    """Expands glob patterns (also on systems where the shell doesn't do it) and directories.
+    From directories, all files with the given extension (e.g., '.gpx') are used."""
+    files = []
+    for pattern in patterns:
+        if glob.has_magic(pattern):
+            matches = sorted(glob.glob(pattern, recursive=True))
+        elif os.path.isdir(pattern):
+            matches = sorted(os.path.join(pattern, file_name) for file_name in os.listdir(pattern)
+                             if file_name.lower().endswith(extension.lower()))
+        else:
+            matches = [pattern]
+        if not matches:
+            logging.error(f"Keine Dateien gefunden: {pattern}")
+        files.extend(match for match in matches if match not in files)
+    return files
+
+
 def parse_station_input(stations: List[str], case_sensitive: bool = False) -> Generator[Tuple[str], None, None]:
     current_country = None
     for station in stations:
@@ -56,7 +78,9 @@ def process_station_input(stations: List[str],
 def add_default_cli_args(parser: ArgumentParser,
                          tc_directory: bool = True,
                          data_directory: bool = True,
-                         default_logging_level: int = logging.WARNING):
+                         default_logging_level: int = logging.WARNING,
+                         online_services: bool = False):
+    """online_services: Whether the tool uses Photon or the Overpass API (adds the arguments for their cache)"""
     script_path = os.path.realpath(__file__)
     script_dir = os.path.dirname(script_path)
 
@@ -94,10 +118,27 @@ def add_default_cli_args(parser: ArgumentParser,
         logging_args.add_argument("-e", "--error", "--quiet", action="store_const", dest="loglevel",
                                   const=logging.ERROR,
                                   help="Gibt nur schwerwiegende Fehler aus")
+    if online_services:
+        ResponseCache.add_cli_args(parser)
+    parser.add_argument('--profile', action='store_true',
+                        help="Gibt am Ende aus, wie lange die einzelnen Schritte gedauert und wie viel Speicher sie "
+                             "gebraucht haben (das Messen des Speichers verlangsamt die Ausführung)")
+    parser.add_argument('--trace', metavar='DATEI', type=str, default=None,
+                        help="Schreibt die Schritte als Chrome-Trace (chrome://tracing, ui.perfetto.dev) in die Datei")
 
 
 def use_default_cli_args(args: Namespace):
     logging.basicConfig(level=args.loglevel)
+    if 'cache' in args:
+        # The cache is only opened when the first request is about to be sent
+        set_default_cache_factory(ResponseCache.factory_from_cli_args(args))
+    if getattr(args, 'profile', False) or getattr(args, 'trace', None):
+        # The memory is only measured for the summary, so the times in the trace aren't distorted by it
+        profiling.enable(print_summary=args.profile, trace_file=args.trace, trace_memory=args.profile)
+        # Only once, even if the arguments are used several times (e.g., in the daemon, which also calls
+        # profiling.finish after every command itself)
+        atexit.unregister(profiling.finish)
+        atexit.register(profiling.finish)
 
 
 def add_station_cli_args(parser: ArgumentParser,
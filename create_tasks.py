@@ -3,30 +3,59 @@
 from __future__ import annotations
 
 import argparse
+import csv
+import json
+import logging
 import os
 import sys
+from argparse import Namespace
+from dataclasses import dataclass, field
 from os import PathLike
 from typing import Type
 
 from cli_utils import check_files, add_default_cli_args, add_station_cli_args, parse_station_args, use_default_cli_args
+from cli_utils import process_station_input
+from structures import DataSet
 from structures.country import parse_codes_with_countries
 from structures.task import *
-from tc_utils import TcFile
+from tc_utils import TcFile, warm_cache
 from validation import build_tc_graph
+from validation.graph import RouteMemo
 
 
-def create_tasks(Gattung: Type,
-                 line_number: Optional[int],
-                 stations: List[List[str]],
-                 path_suggestion_config: PathSuggestionConfig,
-                 name: Optional[str] = None,
-                 tc_directory: PathLike | str = '..',
-                 pronouns: Optional[Pronouns] = None,
-                 add_path_suggestion: bool = False
-                 ) -> TcFile:
+gattungen: Dict[str, Type[GattungTask]] = {task.gattung: task for task in (SbahnTask, RbTask, ReTask, IreTask,
+                                                                           TerTask, IcTask, IrTask, EcTask, OtcTask,
+                                                                           OgvTask, IceTask, IceSprinterTask, EceTask,
+                                                                           TgvTask, FrTask, NjTask, AmtrakTask)}
+
+article_to_pronoun = {
+    'der': ErIhmPronouns(),
+    'die': SieIhrPronouns(),
+    None: None
+}
+
+
+@dataclass
+class TaskSpec:
+    """The tasks of one line, i.e. the arguments of create_tasks"""
+    Gattung: Type[GattungTask]
+    line_number: Optional[str]
+    stations: List[List[str]]
+    path_suggestion_config: PathSuggestionConfig = field(default_factory=PathSuggestionConfig)
+    name: Optional[str] = None
+    pronouns: Optional[Pronouns] = None
+
+
+def load_task_graph(tc_directory: PathLike | str = '..') -> nx.Graph:
+    """In the daemon, the graph is only built again if Station.json or Path.json have changed"""
+    files = [os.path.join(tc_directory, name) + '.json' for name in ('Station', 'Path')]
+    return warm_cache.cached(('task graph', os.path.abspath(tc_directory)), lambda: files,
+                             lambda: _build_task_graph(tc_directory))
+
+
+def _build_task_graph(tc_directory: PathLike | str) -> nx.Graph:
     path_json = TcFile('Path', tc_directory)
     station_json = TcFile('Station', tc_directory)
-    task_model_json = TcFile('TaskModel', tc_directory)
 
     selected_codes = [station['ril100'] for station in station_json.data]
 
@@ -44,15 +73,25 @@ def create_tasks(Gattung: Type,
     path_edges = [(path['start'], path['end'], path) for path in paths
                   if path['start'] in selected_codes and path['end'] in selected_codes]
 
-    graph = build_tc_graph(selected_codes, path_edges)
+    return build_tc_graph(selected_codes, path_edges)
 
-    tasks: List[GattungTask] = [Gattung(
-        line=line_number,
+
+def create_task_dicts(spec: TaskSpec,
+                      graph: nx.Graph,
+                      route_memo: Optional[RouteMemo] = None,
+                      add_path_suggestion: bool = False) -> List[Dict[str, Any]]:
+    """returns: The merged tasks of the line"""
+    if route_memo is None:
+        route_memo = RouteMemo(graph)
+    tasks: List[GattungTask] = [spec.Gattung(
+        line=spec.line_number,
         stations=stations_task,
-        line_name=name,
-        name_pronouns=pronouns,
-        graph=graph
-    ) for stations_task in stations]
+        line_name=spec.name,
+        name_pronouns=spec.pronouns,
+        graph=graph,
+        path_suggestion_config=spec.path_suggestion_config,
+        route_memo=route_memo
+    ) for stations_task in spec.stations]
     for task in tasks:
         task.add_sfs_description(graph=graph)
     tasks_dicts = [task.to_dict(add_suggestion=add_path_suggestion) for task in tasks]
@@ -60,6 +99,10 @@ def create_tasks(Gattung: Type,
     for merged_task in tasks_merged:
         extract_remaining_subtask_from_task(merged_task)
         cleanup_task(merged_task)
+    return tasks_merged
+
+
+def insert_tasks(task_model_json: TcFile, tasks_merged: List[Dict[str, Any]]):
     task_groups = [task['group'] if 'group' in task else -1 for task in task_model_json.data]
     assert -1 not in task_groups
     # Insert before the first 0 group entry
@@ -71,17 +114,103 @@ def create_tasks(Gattung: Type,
         else:
             task_model_json.data.append(task)
 
+
+def create_tasks(Gattung: Type,
+                 line_number: Optional[int],
+                 stations: List[List[str]],
+                 path_suggestion_config: PathSuggestionConfig,
+                 name: Optional[str] = None,
+                 tc_directory: PathLike | str = '..',
+                 pronouns: Optional[Pronouns] = None,
+                 add_path_suggestion: bool = False
+                 ) -> TcFile:
+    return create_tasks_bulk([TaskSpec(
+        Gattung=Gattung,
+        line_number=line_number,
+        stations=stations,
+        path_suggestion_config=path_suggestion_config,
+        name=name,
+        pronouns=pronouns
+    )], tc_directory=tc_directory, add_path_suggestion=add_path_suggestion)
+
+
+def create_tasks_bulk(specs: List[TaskSpec],
+                      tc_directory: PathLike | str = '..',
+                      add_path_suggestion: bool = False
+                      ) -> TcFile:
+    """Creates the tasks of many lines at once.
+    The graph is only built once and every route is only computed once (see RouteMemo)"""
+    task_model_json = TcFile('TaskModel', tc_directory)
+    graph = load_task_graph(tc_directory)
+    route_memo = RouteMemo(graph)
+    for spec in specs:
+        insert_tasks(task_model_json, create_task_dicts(spec, graph, route_memo, add_path_suggestion))
+    logging.info(f"{sum(len(spec.stations) for spec in specs)} Aufgaben erstellt, {len(route_memo)} Pfade berechnet")
     return task_model_json
 
 
-if __name__ == '__main__':
-    gattungen = {task.gattung: task for task in (SbahnTask, RbTask, ReTask, IreTask, TerTask,
-                                                 IcTask, IrTask, EcTask, OtcTask, OgvTask,
-                                                 IceTask, IceSprinterTask, EceTask, TgvTask, FrTask,
-                                                 NjTask, AmtrakTask)}
+def load_task_specs(file_name: str,
+                    data_set: DataSet,
+                    defaults: Optional[Namespace] = None,
+                    case_sensitive: bool = False) -> List[TaskSpec]:
+    """Reads the lines from a CSV or JSON file.
+    JSON: A list of objects with gattung, number, name, article, stations (a list of station lists) and config.
+    CSV: The columns gattung, number, name, article and stations (station lists separated by |), all other columns
+    are config options. The config options are the PathSuggestion CLI options (e.g., avoid_sfs, max_speed).
+    defaults: The parsed CLI arguments that are used if a line doesn't set an option"""
+    if file_name.lower().endswith('.json'):
+        with open(file_name, encoding='utf-8') as spec_file:
+            entries = json.load(spec_file)
+        if isinstance(entries, dict):
+            entries = entries['lines']
+    else:
+        with open(file_name, encoding='utf-8', newline='') as spec_file:
+            entries = [_entry_from_csv_row(row) for row in csv.DictReader(spec_file)]
+    if defaults is not None:
+        case_sensitive = defaults.case_sensitive
+    return [_task_spec_from_entry(entry, data_set, defaults, case_sensitive) for entry in entries]
+
+
+def _entry_from_csv_row(row: Dict[str, str]) -> Dict[str, Any]:
+    row = {key.strip(): value.strip() for key, value in row.items() if key and value and value.strip()}
+    return {
+        'gattung': row.pop('gattung', None),
+        'number': row.pop('number', None),
+        'name': row.pop('name', None),
+        'article': row.pop('article', None),
+        'stations': [group.split() for group in row.pop('stations', '').split('|') if group.strip()],
+        'config': row
+    }
+
 
+def _task_spec_from_entry(entry: Dict[str, Any],
+                          data_set: DataSet,
+                          defaults: Optional[Namespace],
+                          case_sensitive: bool) -> TaskSpec:
+    gattung = entry.get('gattung')
+    if gattung not in gattungen:
+        raise ValueError(f"Unbekannte Zuggattung: {gattung}")
+    if entry.get('name') and entry.get('article') not in ('der', 'die'):
+        raise ValueError(f"Für den Liniennamen {entry['name']} muss ein Artikel (der/die) angegeben werden")
+    if not entry.get('stations'):
+        raise ValueError(f"Keine Stationen für {gattung} {entry.get('number') or ''} angegeben")
+
+    number = entry.get('number')
+    return TaskSpec(
+        Gattung=gattungen[gattung],
+        line_number=str(number) if number is not None else None,
+        stations=[process_station_input(stations, dataset=data_set, case_sensitive=case_sensitive)
+                  for stations in entry['stations']],
+        path_suggestion_config=PathSuggestionConfig.from_options(entry.get('config') or {}, defaults),
+        name=entry.get('name'),
+        pronouns=article_to_pronoun[entry.get('article')]
+    )
+
+
+if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Erstelle neue Ausschreibungen')
-    parser.add_argument('task_type', choices=list(gattungen), type=str, help="Die Zuggattung")
+    parser.add_argument('task_type', choices=list(gattungen), type=str, nargs='?',
+                        help="Die Zuggattung (nicht mit --spec)")
     add_default_cli_args(parser)
     add_station_cli_args(parser,
                          help="Die (RIL100-)Codes der angefahrenen Haltestellen, die hinzugefügt werden sollen",
@@ -96,28 +225,37 @@ if __name__ == '__main__':
                         required='--name' in sys.argv)
     parser.add_argument('--no_add_suggestion', action='store_true',
                         help="Fügt der Task keinen Hinweis auf den kürzesten Pfad hinzu.")
+    parser.add_argument('--spec', type=str, metavar='DATEI',
+                        help="Eine CSV- oder JSON-Datei mit vielen Linien, die alle auf einmal erstellt werden "
+                             "(siehe README). Die PathSuggestion-Optionen gelten als Standard für alle Linien.")
     args = parser.parse_args()
     use_default_cli_args(args)
 
     check_files(args.tc_directory, args.data_directory)
-    stations = parse_station_args(args, required=True)
-    path_suggestion_config = PathSuggestionConfig.from_cli_args(args)
 
-    article_to_pronoun = {
-        'der': ErIhmPronouns(),
-        'die': SieIhrPronouns(),
-        None: None
-    }
+    if args.spec:
+        data_set = DataSet.load_data(args.data_directory)
+        specs = load_task_specs(args.spec, data_set, defaults=args)
+        tasks_json = create_tasks_bulk(
+            specs,
+            tc_directory=args.tc_directory,
+            add_path_suggestion=not args.no_add_suggestion
+        )
+    else:
+        if args.task_type is None:
+            parser.error("Es muss eine Zuggattung oder --spec angegeben werden.")
+        stations = parse_station_args(args, required=True)
+        path_suggestion_config = PathSuggestionConfig.from_cli_args(args)
 
-    tasks_json = create_tasks(
-                     gattungen[args.task_type],
-                     line_number=args.number,
-                     stations=stations,
-                     tc_directory=args.tc_directory,
-                     name=args.name,
-                     pronouns=article_to_pronoun[args.article],
-                     add_path_suggestion=not args.no_add_suggestion,
-                     path_suggestion_config=path_suggestion_config
-                 )
+        tasks_json = create_tasks(
+                         gattungen[args.task_type],
+                         line_number=args.number,
+                         stations=stations,
+                         tc_directory=args.tc_directory,
+                         name=args.name,
+                         pronouns=article_to_pronoun[args.article],
+                         add_path_suggestion=not args.no_add_suggestion,
+                         path_suggestion_config=path_suggestion_config
+                     )
 
     tasks_json.save_formatted()
@@ -0,0 +1,263 @@
+#!/usr/bin/env python
+"""Runs the tools in a long-running process, so the DataSet, the TC files and the graph stay loaded.
+
+    python daemon.py start                                  # Starts the server (in the foreground)
+    python daemon.py run print_path_suggestion.py --stations AH HH
+    python daemon.py stop
+
+The client only uses the standard library, so it starts quickly.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import socket
+import struct
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+default_socket_path = os.path.join(os.path.expanduser('~'), '.cache', 'traincompany-tools', 'daemon.sock')
+tools_directory = os.path.dirname(os.path.realpath(__file__))
+# The environment variables that are passed from the client to the commands
+forwarded_environment = ('TRAINCOMPANY_DATA', 'TRAINCOMPANY_TOOLS_DATA')
+
+
+def send_message(connection: socket.socket, message: Dict[str, Any]):
+    data = json.dumps(message, ensure_ascii=False).encode('utf-8')
+    connection.sendall(struct.pack('>I', len(data)) + data)
+
+
+def receive_message(connection: socket.socket) -> Optional[Dict[str, Any]]:
+    header = _receive_exactly(connection, 4)
+    if header is None:
+        return None
+    data = _receive_exactly(connection, struct.unpack('>I', header)[0])
+    return json.loads(data.decode('utf-8')) if data is not None else None
+
+
+def _receive_exactly(connection: socket.socket, size: int) -> Optional[bytes]:
+    chunks = []
+    while size > 0:
+        chunk = connection.recv(min(size, 1 << 20))
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+# --- Client ---
+
+def request(message: Dict[str, Any], socket_path: str = default_socket_path) -> Dict[str, Any]:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.connect(socket_path)
+        send_message(connection, message)
+        response = receive_message(connection)
+    if response is None:
+        raise ConnectionError("Der Server hat die Verbindung ohne Antwort beendet")
+    return response
+
+
+def run_command(script: str, arguments: List[str], socket_path: str = default_socket_path,
+                stdin: Optional[str] = None) -> int:
+    response = request({
+        'command': 'run',
+        'script': script,
+        'argv': arguments,
+        'cwd': os.getcwd(),
+        'environment': {name: os.environ[name] for name in forwarded_environment if name in os.environ},
+        'stdin': stdin
+    }, socket_path)
+    sys.stdout.write(response['stdout'])
+    sys.stderr.write(response['stderr'])
+    return response['exit_code']
+
+
+# --- Server ---
+
+def serve(socket_path: str = default_socket_path, preload: bool = True):
+    # Only the server needs the tools themselves
+    import contextlib
+    import io
+    import logging
+    import runpy
+    import traceback
+
+    from geo import overpass
+    from geo.cache import set_default_cache_factory
+    from geo.photon_advanced_reverse import shared_photon
+    from tc_utils import profiling, warm_cache
+
+    warm_cache.enable()
+    if tools_directory not in sys.path:
+        sys.path.insert(0, tools_directory)
+    if preload:
+        _preload()
+
+    os.makedirs(os.path.dirname(socket_path), exist_ok=True)
+    if os.path.exists(socket_path):
+        if _is_running(socket_path):
+            logging.error(f"Der Server läuft bereits ({socket_path})")
+            return
+        os.remove(socket_path)
+
+    def run(message: Dict[str, Any]) -> Dict[str, Any]:
+        try:
+            script = _script_path(message['script'])
+        except ValueError as e:
+            return {'stdout': '', 'stderr': f"{e}\n", 'exit_code': 2, 'duration': 0}
+        arguments = list(message.get('argv') or [])
+        stdout, stderr = io.StringIO(), io.StringIO()
+        exit_code = 0
+        start = time.perf_counter()
+        # The commands use the global state of the process (working directory, sys.argv, logging, ...),
+        # so they are run one after another and the state is restored afterwards
+        old_cwd, old_argv, old_stdin = os.getcwd(), sys.argv, sys.stdin
+        old_environment = {name: os.environ.get(name) for name in forwarded_environment}
+        root_logger = logging.getLogger()
+        old_handlers, old_level = root_logger.handlers[:], root_logger.level
+        # The online services are configured by the commands as well (--offline, --photon-rate, ...)
+        old_photon_rate_limiter = shared_photon().rate_limiter
+        old_next_overpass_request_time = overpass._next_request_time
+        try:
+            os.chdir(message.get('cwd') or old_cwd)
+            for name in forwarded_environment:
+                os.environ.pop(name, None)
+            os.environ.update(message.get('environment') or {})
+            sys.argv = [script] + arguments
+            sys.stdin = io.StringIO(message.get('stdin') or '')
+            # use_default_cli_args configures logging again for every command
+            root_logger.handlers = []
+            with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+                try:
+                    runpy.run_path(script, run_name='__main__')
+                except SystemExit as e:
+                    exit_code = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+                    if e.code is not None and not isinstance(e.code, int):
+                        print(e.code, file=sys.stderr)
+                except Exception:
+                    traceback.print_exc()
+                    exit_code = 1
+                finally:
+                    # --profile and --trace of this command
+                    profiling.finish()
+        finally:
+            root_logger.handlers, root_logger.level = old_handlers, old_level
+            # The cache of the command is closed, the next one opens the default cache again when it needs it
+            set_default_cache_factory()
+            shared_photon().rate_limiter = old_photon_rate_limiter
+            overpass._next_request_time = old_next_overpass_request_time
+            sys.argv, sys.stdin = old_argv, old_stdin
+            for name, value in old_environment.items():
+                if value is None:
+                    os.environ.pop(name, None)
+                else:
+                    os.environ[name] = value
+            os.chdir(old_cwd)
+        duration = time.perf_counter() - start
+        logging.info(f"{os.path.basename(script)} {' '.join(arguments)}: {exit_code} ({duration * 1000:.0f} ms)")
+        return {'stdout': stdout.getvalue(), 'stderr': stderr.getvalue(), 'exit_code': exit_code,
+                'duration': duration}
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as server:
+        server.bind(socket_path)
+        # Only the current user may run commands
+        os.chmod(socket_path, 0o600)
+        server.listen()
+        logging.warning(f"Server läuft ({socket_path})")
+        try:
+            while True:
+                connection, _ = server.accept()
+                with connection:
+                    message = receive_message(connection)
+                    if message is None:
+                        continue
+                    if message['command'] == 'run':
+                        send_message(connection, run(message))
+                    elif message['command'] == 'status':
+                        send_message(connection, {'pid': os.getpid()})
+                    elif message['command'] == 'stop':
+                        send_message(connection, {})
+                        break
+        except KeyboardInterrupt:
+            pass
+        finally:
+            os.remove(socket_path)
+
+
+def _script_path(script: str) -> str:
+    """Only the tools themselves can be run"""
+    name = os.path.basename(script)
+    if not name.endswith('.py'):
+        name += '.py'
+    path = os.path.join(tools_directory, name)
+    if not os.path.isfile(path) or name == os.path.basename(__file__):
+        raise ValueError(f"Unbekanntes Werkzeug: {script}")
+    return path
+
+
+def _preload():
+    """Loads the DataSet and the graph for the default directories (see add_default_cli_args)"""
+    import logging
+
+    from cli_utils import add_default_cli_args
+    from structures import DataSet
+    from validation.graph import load_graph
+
+    parser = argparse.ArgumentParser()
+    add_default_cli_args(parser)
+    args = parser.parse_args([])
+    start = time.perf_counter()
+    try:
+        DataSet.load_data(args.data_directory)
+        load_graph(args.tc_directory)
+    except (OSError, ValueError, KeyError) as e:
+        logging.warning(f"Konnte die Daten nicht vorladen: {e}")
+    logging.info(f"Daten vorgeladen ({time.perf_counter() - start:.1f} s)")
+
+
+def _is_running(socket_path: str) -> bool:
+    try:
+        request({'command': 'status'}, socket_path)
+        return True
+    except OSError:
+        return False
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Hält die Daten zwischen mehreren Aufrufen der Werkzeuge geladen')
+    parser.add_argument('--socket', type=str, default=default_socket_path, help="Der Pfad des Sockets")
+    subparsers = parser.add_subparsers(dest='action', required=True)
+    start_parser = subparsers.add_parser('start', help="Startet den Server (im Vordergrund)")
+    start_parser.add_argument('--no-preload', action='store_true',
+                              help="Lädt die Daten erst beim ersten Aufruf, der sie braucht")
+    start_parser.add_argument('-v', '--verbose', action='store_true', help="Gibt jeden Aufruf aus")
+    run_parser = subparsers.add_parser('run', help="Führt ein Werkzeug im Server aus")
+    run_parser.add_argument('--stdin', action='store_true', help="Leitet die Standardeingabe an das Werkzeug weiter")
+    run_parser.add_argument('script', type=str, help="Das Werkzeug, z.B. print_path_suggestion.py")
+    run_parser.add_argument('arguments', nargs=argparse.REMAINDER, help="Die Argumente für das Werkzeug")
+    subparsers.add_parser('stop', help="Beendet den Server")
+    subparsers.add_parser('status', help="Prüft, ob der Server läuft")
+    args = parser.parse_args()
+
+    if args.action == 'start':
+        import logging
+        logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+        serve(args.socket, preload=not args.no_preload)
+    elif args.action == 'run':
+        try:
+            sys.exit(run_command(args.script, args.arguments, args.socket,
+                                 stdin=sys.stdin.read() if args.stdin else None))
+        except (FileNotFoundError, ConnectionRefusedError):
+            print(f"Der Server läuft nicht ({args.socket}), starte ihn mit: python daemon.py start", file=sys.stderr)
+            sys.exit(2)
+    elif args.action == 'stop':
+        request({'command': 'stop'}, args.socket)
+    elif args.action == 'status':
+        if _is_running(args.socket):
+            print(f"Der Server läuft ({args.socket})")
+        else:
+            print("Der Server läuft nicht")
+            sys.exit(1)
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+"""Compares the distance kernels of geo.distance with geopy.distance.geodesic (accuracy and speed).
+
+    python distance_benchmark.py                    # A GPX track with 50000 points and 60 stops
+    python distance_benchmark.py --points 200000 --pairs 2000
+
+The track is synthetic (a random walk around Frankfurt), so no files are needed.
+"""
+from __future__ import annotations
+
+import argparse
+import time
+from typing import Callable, List, Tuple
+
+import numpy as np
+from geopy.distance import geodesic
+
+from geo.distance import distances_to, distance, path_length
+
+# (name, range of the latitudes, range of the longitudes, maximum difference in degrees or None for independent points)
+accuracy_regions: List[Tuple[str, Tuple[float, float], Tuple[float, float], float | None]] = [
+    ('Europa/Nordamerika, < 1 km', (25, 65), (-125, 30), 0.01),
+    ('Europa/Nordamerika, < 100 km', (25, 65), (-125, 30), 1),
+    ('Europa/Nordamerika, < 1000 km', (25, 65), (-125, 30), 10),
+    ('Europa/Nordamerika, beliebig', (25, 65), (-125, 30), None),
+    ('Weltweit, beliebig', (-90, 90), (-180, 180), None),
+]
+
+
+def random_pairs(rng: np.random.Generator, count: int, latitudes: Tuple[float, float],
+                 longitudes: Tuple[float, float], max_difference: float | None) \
+        -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    def random_latitudes() -> np.ndarray:
+        # Uniformly distributed on the sphere
+        sin_range = np.sin(np.radians(latitudes))
+        return np.degrees(np.arcsin(rng.uniform(*sin_range, count)))
+
+    latitudes_a, longitudes_a = random_latitudes(), rng.uniform(*longitudes, count)
+    if max_difference is None:
+        latitudes_b, longitudes_b = random_latitudes(), rng.uniform(*longitudes, count)
+    else:
+        latitudes_b = np.clip(latitudes_a + rng.uniform(-max_difference, max_difference, count), -89, 89)
+        longitudes_b = longitudes_a + rng.uniform(-max_difference, max_difference, count)
+    return latitudes_a, longitudes_a, latitudes_b, longitudes_b
+
+
+def accuracy(rng: np.random.Generator, pairs: int):
+    print(f"{'Paare':<32} {'Max. rel. Fehler':>16} {'Max. Fehler (m)':>16} {'Max. Distanz (km)':>18}")
+    for name, latitudes, longitudes, max_difference in accuracy_regions:
+        latitudes_a, longitudes_a, latitudes_b, longitudes_b = random_pairs(rng, pairs, latitudes, longitudes,
+                                                                            max_difference)
+        ours = distance(latitudes_a, longitudes_a, latitudes_b, longitudes_b)
+        reference = np.array([geodesic(a, b).km for a, b in zip(zip(latitudes_a, longitudes_a),
+                                                                 zip(latitudes_b, longitudes_b))])
+        error = np.abs(ours - reference)
+        relative_error = error / np.maximum(reference, 1e-12)
+        print(f"{name:<32} {relative_error.max():>16.1e} {error.max() * 1000:>16.3f} {reference.max():>18.0f}")
+
+
+def synthetic_track(rng: np.random.Generator, points: int) -> Tuple[np.ndarray, np.ndarray]:
+    latitudes = 50 + np.cumsum(rng.normal(0, 0.0003, points))
+    longitudes = 8 + np.cumsum(np.abs(rng.normal(0.0004, 0.0002, points)))
+    return latitudes, longitudes
+
+
+def timed(function: Callable[[], float]) -> Tuple[float, float]:
+    """returns: The time (s) and the result"""
+    start = time.perf_counter()
+    result = function()
+    return time.perf_counter() - start, result
+
+
+def track(rng: np.random.Generator, points: int, stops: int):
+    latitudes, longitudes = synthetic_track(rng, points)
+    coordinates = list(zip(latitudes.tolist(), longitudes.tolist()))
+    stop_indices = np.linspace(0, points - 1, stops).astype(int)
+
+    # tc_path_from_gpx: The length of the track
+    geopy_time, geopy_length = timed(lambda: sum(geodesic(a, b).km for a, b in zip(coordinates, coordinates[1:])))
+    kernel_time, kernel_length = timed(lambda: path_length(latitudes, longitudes))
+    print(f"Länge der Strecke ({points} Punkte): geopy {geopy_time:.2f} s, geo.distance {kernel_time * 1000:.1f} ms "
+          f"({geopy_time / kernel_time:.0f}x), {geopy_length:.3f} km / {kernel_length:.3f} km")
+
+    # collect_path_segments: Every trackpoint to every stop. geopy is only measured for one stop, otherwise it takes
+    # minutes, and extrapolated to all of them
+    geopy_time, _ = timed(lambda: min(geodesic(coordinates[stop_indices[0]], point).km for point in coordinates))
+    geopy_time *= stops
+    kernel_time, _ = timed(lambda: sum(distances_to(latitudes[i], longitudes[i], latitudes, longitudes).min()
+                                       for i in stop_indices))
+    print(f"Alle Punkte zu {stops} Halten: geopy {geopy_time:.1f} s (hochgerechnet), "
+          f"geo.distance {kernel_time * 1000:.1f} ms ({geopy_time / kernel_time:.0f}x)")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Vergleicht geo.distance mit geopy (Genauigkeit und Laufzeit)')
+    parser.add_argument('--points', type=int, default=50000, help="Die Anzahl der Punkte der GPX-Strecke")
+    parser.add_argument('--stops', type=int, default=60, help="Die Anzahl der Halte auf der Strecke")
+    parser.add_argument('--pairs', type=int, default=5000,
+                        help="Die Anzahl der zufälligen Paare für jede Zeile der Genauigkeit")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    accuracy(rng, args.pairs)
+    print()
+    track(rng, args.points, args.stops)
@@ -1,22 +1,95 @@
 from __future__ import annotations
 from dataclasses import dataclass
-from functools import lru_cache
-from typing import Callable, Tuple
+from functools import lru_cache, partial
+from typing import TYPE_CHECKING, Callable, Tuple, Dict
 
-import geopy.distance
-import pyproj
-from pyproj.enums import TransformDirection
+if TYPE_CHECKING:
+    import numpy as np
+    import pyproj
 
 default_projection_version = 3
 
-crs_wgs84 = pyproj.CRS('WGS84')
-crs_proj = pyproj.CRS('epsg:3035')
-# The map is centered at longitude 10
-crs_robinson = pyproj.CRS('+proj=robin +lon_0=10 +x_0=0 +y_0=0 +ellps=WGS84 +datum=WGS84 +units=m +no_defs')
+# Creating the pyproj objects takes a while, so they are only created when they are first used
+# (most tools never project anything). The old module attributes are still available, see __getattr__.
+_crs_definitions: Dict[str, str] = {
+    'crs_wgs84': 'WGS84',
+    'crs_proj': 'epsg:3035',
+    # The map is centered at longitude 10
+    'crs_robinson': '+proj=robin +lon_0=10 +x_0=0 +y_0=0 +ellps=WGS84 +datum=WGS84 +units=m +no_defs',
+}
 
-transformer = pyproj.Transformer.from_crs(crs_wgs84, crs_proj, always_xy=True)
-transformer_robinson = pyproj.Transformer.from_crs(crs_wgs84, crs_robinson, always_xy=True)
-projection = pyproj.Proj('epsg:3035')
+
+@lru_cache
+def get_crs(name: str) -> pyproj.CRS:
+    import pyproj
+    return pyproj.CRS(_crs_definitions[name])
+
+
+@lru_cache
+def get_transformer(target_crs: str = 'crs_proj') -> pyproj.Transformer:
+    import pyproj
+    return pyproj.Transformer.from_crs(get_crs('crs_wgs84'), get_crs(target_crs), always_xy=True)
+
+
+@lru_cache
+def get_projection() -> pyproj.Proj:
+    import pyproj
+    return pyproj.Proj('epsg:3035')
+
+
+_lazy_attributes: Dict[str, Callable] = {
+    **{name: partial(get_crs, name) for name in _crs_definitions},
+    'transformer': partial(get_transformer, 'crs_proj'),
+    'transformer_robinson': partial(get_transformer, 'crs_robinson'),
+    'projection': get_projection,
+    # version -> (origin_x, origin_y, scale_x, scale_y)
+    'origin_scales': lambda: {version: get_origin_scales(version) for version in projection_functions},
+}
+
+
+def __getattr__(name: str):
+    if name in _lazy_attributes:
+        return _lazy_attributes[name]()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def _inverse():
+    from pyproj.enums import TransformDirection
+    return TransformDirection.INVERSE
+
+
+# The projection functions need to be the same objects on every call, otherwise get_origin_scale can't cache them.
+# All of them also accept NumPy arrays.
+def _project_v1(lon, lat):
+    return get_projection()(longitude=lon, latitude=lat, errcheck=True)
+
+
+def _project_reverse_v1(x, y):
+    return get_projection()(x, y, inverse=True, errcheck=True)
+
+
+def _project_v2(lon, lat):
+    return get_transformer('crs_proj').transform(xx=lon, yy=lat, errcheck=True)
+
+
+def _project_reverse_v2(x, y):
+    return get_transformer('crs_proj').transform(xx=x, yy=y, direction=_inverse(), errcheck=True)
+
+
+def _project_v3(lon, lat):
+    return get_transformer('crs_robinson').transform(xx=lon, yy=lat, errcheck=True)
+
+
+def _project_reverse_v3(x, y):
+    return get_transformer('crs_robinson').transform(xx=x, yy=y, direction=_inverse(), errcheck=True)
+
+
+# version -> (projection_fun, projection_fun_reverse)
+projection_functions: Dict[int, Tuple[Callable, Callable]] = {
+    1: (_project_v1, _project_reverse_v1),
+    2: (_project_v2, _project_reverse_v2),
+    3: (_project_v3, _project_reverse_v3),
+}
 
 
 @dataclass(frozen=True)
@@ -25,6 +98,10 @@ class Location:
     latitude: float
     longitude: float
 
+    def __reduce__(self):
+        # Frozen dataclasses with __slots__ can't be unpickled with the default protocol
+        return Location, (self.latitude, self.longitude)
+
     def to_tc(self) -> Tuple[int, int]:
         x = int((self.longitude - origin_x_tc) * scale_x_tc)
         y = int((self.latitude - origin_y_tc) * scale_y_tc)
@@ -50,24 +127,11 @@ class Location:
     def from_projection(cls, x: int, y: int, version: int = default_projection_version) -> Location:
         if version == 0:
             return Location.from_tc(x, y)
-        if version == 1:
-            return cls.from_projection_with_fun(
-                projection_fun=lambda lon, lat: projection(longitude=lon, latitude=lat, errcheck=True),
-                projection_fun_reverse=lambda x, y: projection(x, y, inverse=True, errcheck=True),
-                x=x, y=y)
-        elif version == 2:
-            return cls.from_projection_with_fun(
-                projection_fun=lambda lon, lat: transformer.transform(xx=lon, yy=lat, errcheck=True),
-                projection_fun_reverse=lambda x, y: transformer.transform(xx=x, yy=y,
-                                                                          direction=TransformDirection.INVERSE,
-                                                                          errcheck=True),
-                x=x, y=y)
-        elif version == 3:
+        if version in projection_functions:
+            projection_fun, projection_fun_reverse = projection_functions[version]
             return cls.from_projection_with_fun(
-                projection_fun=lambda lon, lat: transformer_robinson.transform(xx=lon, yy=lat, errcheck=True),
-                projection_fun_reverse=lambda x, y: transformer_robinson.transform(xx=x, yy=y,
-                                                                                   direction=TransformDirection.INVERSE,
-                                                                                   errcheck=True),
+                projection_fun=projection_fun,
+                projection_fun_reverse=projection_fun_reverse,
                 x=x, y=y)
 
     @classmethod
@@ -105,18 +169,11 @@ class Location:
             return int(self.longitude), int(self.latitude)
         elif version == 0:
             return self.to_tc()
+        elif version in projection_functions:
+            projection_fun, _ = projection_functions[version]
+            return self.to_projection_with_fun(projection_fun)
         else:
-            if version == 1:
-                return self.to_projection_with_fun(
-                    lambda lon, lat: projection(longitude=lon, latitude=lat, errcheck=True))
-            elif version == 2:
-                return self.to_projection_with_fun(
-                    lambda lon, lat: transformer.transform(xx=lon, yy=lat, errcheck=True))
-            elif version == 3:
-                return self.to_projection_with_fun(
-                    lambda lon, lat: transformer_robinson.transform(xx=lon, yy=lat, errcheck=True))
-            else:
-                raise ValueError("Projection version is not supported")
+            raise ValueError("Projection version is not supported")
 
     def to_projection_with_fun(self, projection_fun: Callable[[float, float], Tuple[float, float]]) -> Tuple[int, int]:
         x, y = projection_fun(self.longitude, self.latitude)
@@ -127,12 +184,14 @@ class Location:
         return int(x * scale_x), int(-y * scale_y)
 
     def distance(self, other: Location) -> int:
+        import geopy.distance
         return geopy.distance.geodesic(
             (self.latitude, self.longitude),
             (other.latitude, other.longitude)
         ).kilometers
 
     def distance_float(self, other: Location) -> float:
+        import geopy.distance
         return geopy.distance.geodesic(
             (self.latitude, self.longitude),
             (other.latitude, other.longitude)
@@ -174,3 +233,62 @@ def get_origin_scale(projection_fun: Callable[[float, float], Tuple[float, float
     scale_x = 625.0 / x_distance_kdn_nn
     scale_y = 385.0 / y_distance_ha_nn
     return x_kdn, y_ha, scale_x, scale_y
+
+
+def get_origin_scales(version: int) -> Tuple[float, float, float, float]:
+    """The calibration only depends on the projection, so it is only done once (on first use).
+    returns: origin_x, origin_y, scale_x, scale_y"""
+    projection_fun, _ = projection_functions[version]
+    return get_origin_scale(projection_fun)
+
+
+def project_many(latitude: np.ndarray, longitude: np.ndarray,
+                 version: int = default_projection_version) -> Tuple[np.ndarray, np.ndarray]:
+    """Like Location.to_projection, but for many locations at once.
+    returns: x, y (as integer arrays)"""
+    import numpy as np
+    latitude = np.asarray(latitude, dtype=float)
+    longitude = np.asarray(longitude, dtype=float)
+    assert np.all((-180.0 <= longitude) & (longitude <= 180.0))
+    assert np.all((-90.0 <= latitude) & (latitude <= 90.0))
+    if version == -1:
+        return longitude.astype(int), latitude.astype(int)
+    elif version == 0:
+        x = (longitude - origin_x_tc) * scale_x_tc
+        y = (latitude - origin_y_tc) * scale_y_tc
+        return x.astype(int), y.astype(int)
+    elif version in projection_functions:
+        projection_fun, _ = projection_functions[version]
+        origin_x, origin_y, scale_x, scale_y = get_origin_scales(version)
+        x, y = projection_fun(longitude, latitude)
+        x = np.asarray(x) - origin_x
+        y = np.asarray(y) - origin_y
+        # Note that we negate y here, as we want y to face southwards
+        return (x * scale_x).astype(int), (-y * scale_y).astype(int)
+    else:
+        raise ValueError("Projection version is not supported")
+
+
+def unproject_many(x: np.ndarray, y: np.ndarray,
+                   version: int = default_projection_version) -> Tuple[np.ndarray, np.ndarray]:
+    """Like Location.from_projection, but for many locations at once.
+    returns: latitude, longitude"""
+    import numpy as np
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    if version == -1:
+        longitude, latitude = x, y
+    elif version == 0:
+        longitude = (x / scale_x_tc) + origin_x_tc
+        latitude = (y / scale_y_tc) + origin_y_tc
+    elif version in projection_functions:
+        _, projection_fun_reverse = projection_functions[version]
+        origin_x, origin_y, scale_x, scale_y = get_origin_scales(version)
+        longitude, latitude = projection_fun_reverse(x / scale_x + origin_x, -y / scale_y + origin_y)
+        longitude = np.asarray(longitude)
+        latitude = np.asarray(latitude)
+    else:
+        raise ValueError("Projection version is not supported")
+    assert np.all((-180.0 <= longitude) & (longitude <= 180.0)), "invalid longitude"
+    assert np.all((-90.0 <= latitude) & (latitude <= 90.0)), "invalid latitude"
+    return latitude, longitude
@@ -0,0 +1,246 @@
+from __future__ import annotations
+
+import functools
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from argparse import ArgumentParser, Namespace
+from typing import Any, Callable, Optional
+from urllib.parse import urlsplit, parse_qsl, urlencode
+
+default_cache_path = os.path.join(os.path.expanduser('~'), '.cache', 'traincompany-tools', 'responses.sqlite')
+# 30 days
+default_ttl = 30 * 24 * 60 * 60
+default_max_size_mb = 512
+# Expired entries are removed (and the size is counted again) after this many new entries
+expire_interval = 1000
+
+# The number of decimals coordinates are rounded to for the keys (5 decimals are roughly 1 m)
+coordinate_decimals = 5
+coordinate_parameters = ('lat', 'lon')
+_whitespace = re.compile(r'\s+')
+
+
+class OfflineCacheMiss(ConnectionError):
+    """Raised in offline mode when a response is not in the cache"""
+    pass
+
+
+class ResponseCache:
+    """A persistent cache for responses of online services (Photon, Overpass).
+    Entries expire after ttl seconds. If the cache gets larger than max_size_mb,
+    the least recently used entries are removed.
+    In offline mode, a cache miss raises OfflineCacheMiss instead of sending a request.
+
+    The size is counted as the entries are added, so a new entry doesn't need to scan the whole table.
+    Other processes may use the same file, so it is counted again whenever expired entries are removed."""
+    path: str
+    ttl: float | None
+    max_size: int
+    offline: bool
+    # The size of all entries (as far as this instance knows)
+    _total_size: int
+    # New entries since expired entries were removed for the last time
+    _puts_since_expiry: int
+
+    def __init__(self, path: str = default_cache_path,
+                 ttl: float | None = default_ttl,
+                 max_size_mb: float = default_max_size_mb,
+                 offline: bool = False):
+        self.path = path
+        self.ttl = ttl
+        self.max_size = int(max_size_mb * 1024 * 1024)
+        self.offline = offline
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # The cache might be used from multiple threads, so we use one connection with a lock
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        with self._lock:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("""CREATE TABLE IF NOT EXISTS responses (
+                                            namespace TEXT NOT NULL,
+                                            key TEXT NOT NULL,
+                                            value TEXT NOT NULL,
+                                            size INTEGER NOT NULL,
+                                            created REAL NOT NULL,
+                                            accessed REAL NOT NULL,
+                                            PRIMARY KEY (namespace, key))""")
+            self._connection.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+            self._expire()
+
+    def get(self, namespace: str, key: str) -> Optional[Any]:
+        """returns: The cached (JSON) value or None if there is no valid entry"""
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute("SELECT value, size, created FROM responses "
+                                           "WHERE namespace = ? AND key = ?", (namespace, key)).fetchone()
+            if row is None:
+                return None
+            value, size, created = row
+            if self.ttl is not None and created + self.ttl < now:
+                self._connection.execute("DELETE FROM responses WHERE namespace = ? AND key = ?", (namespace, key))
+                self._total_size -= size
+                return None
+            self._connection.execute("UPDATE responses SET accessed = ? WHERE namespace = ? AND key = ?",
+                                     (now, namespace, key))
+        logging.debug(f"Cache-Treffer ({namespace}): {key[:200]}")
+        return json.loads(value)
+
+    def put(self, namespace: str, key: str, value: Any):
+        value = json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute("SELECT size FROM responses WHERE namespace = ? AND key = ?",
+                                           (namespace, key)).fetchone()
+            self._connection.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                                     (namespace, key, value, len(value), now, now))
+            self._total_size += len(value) - (row[0] if row is not None else 0)
+            self._puts_since_expiry += 1
+            if self._puts_since_expiry >= expire_interval or self._total_size > self.max_size:
+                self._expire()
+            self._evict()
+
+    def miss(self, namespace: str, key: str):
+        """To be called before sending a request for something that was not in the cache"""
+        if self.offline:
+            raise OfflineCacheMiss(f"Offline-Modus: Keine Antwort im Cache für {namespace}: {key[:200]}")
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    def clear(self):
+        with self._lock:
+            self._connection.execute("DELETE FROM responses")
+            self._total_size = 0
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def _expire(self):
+        """Removes the expired entries and counts the size again (both scan the whole table)"""
+        if self.ttl is not None:
+            self._connection.execute("DELETE FROM responses WHERE created < ?", (time.time() - self.ttl,))
+        self._total_size = self._connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        self._puts_since_expiry = 0
+
+    def _evict(self):
+        if self._total_size <= self.max_size:
+            return
+        # Remove the least recently used entries until we are well below the limit
+        to_free = self._total_size - int(self.max_size * 0.9)
+        freed = 0
+        keys = []
+        for namespace, key, size in self._connection.execute(
+                "SELECT namespace, key, size FROM responses ORDER BY accessed"):
+            if freed >= to_free:
+                break
+            keys.append((namespace, key))
+            freed += size
+        self._connection.executemany("DELETE FROM responses WHERE namespace = ? AND key = ?", keys)
+        self._total_size -= freed
+        logging.debug(f"{len(keys)} Einträge aus dem Cache entfernt")
+
+    @staticmethod
+    def add_cli_args(parser: ArgumentParser):
+        cache_args = parser.add_argument_group("Cache für Online-Abfragen")
+        cache_args.add_argument('--cache', metavar='DATEI', type=str,
+                                default=os.environ.get('TRAINCOMPANY_CACHE', default_cache_path),
+                                help="Die SQLite-Datei, in der Antworten von Photon und Overpass gespeichert werden")
+        cache_args.add_argument('--no-cache', action='store_true',
+                                help="Speichert keine Antworten von Photon und Overpass")
+        cache_args.add_argument('--cache-ttl', metavar='TAGE', type=float, default=default_ttl / (24 * 60 * 60),
+                                help="Nach wie vielen Tagen gespeicherte Antworten verfallen")
+        cache_args.add_argument('--offline', action='store_true',
+                                help="Verwendet nur gespeicherte Antworten und bricht ab, wenn eine fehlt")
+
+    @staticmethod
+    def factory_from_cli_args(args: Namespace) -> Callable[[], Optional[ResponseCache]]:
+        """The arguments are checked immediately, but the cache is only opened by the factory (see open_cache)"""
+        if args.no_cache:
+            if args.offline:
+                raise ValueError("--offline benötigt den Cache")
+            return lambda: None
+        return functools.partial(open_cache, args.cache, ttl=args.cache_ttl * 24 * 60 * 60, offline=args.offline)
+
+
+def url_key(url: str) -> str:
+    """A normalized key for a GET request: the parameters are sorted and coordinates are rounded"""
+    split_url = urlsplit(url)
+    parameters = []
+    for name, value in parse_qsl(split_url.query, keep_blank_values=True):
+        if name in coordinate_parameters:
+            try:
+                value = f"{round(float(value), coordinate_decimals):.{coordinate_decimals}f}"
+            except ValueError:
+                pass
+        parameters.append((name, value))
+    parameters.sort()
+    return f"{split_url.netloc}{split_url.path}?{urlencode(parameters)}"
+
+
+def query_key(url: str, query: str) -> str:
+    """A normalized key for an Overpass query"""
+    return f"{url} {_whitespace.sub(' ', query).strip()}"
+
+
+def open_cache(path: str = default_cache_path,
+               ttl: float | None = default_ttl,
+               offline: bool = False) -> Optional[ResponseCache]:
+    """Opens the cache or returns None if that is not possible (e.g., without a writable home directory).
+    In offline mode, the error is raised, as nothing could be looked up without the cache."""
+    try:
+        return ResponseCache(path, ttl=ttl, offline=offline)
+    except (OSError, sqlite3.Error) as e:
+        if offline:
+            raise
+        logging.warning(f"Konnte den Cache nicht öffnen: {e}")
+        return None
+
+
+def _open_cache_from_environment() -> Optional[ResponseCache]:
+    return open_cache(os.environ.get('TRAINCOMPANY_CACHE', default_cache_path))
+
+
+_default_cache: Optional[ResponseCache] = None
+# Opens the default cache when it is used for the first time (None if it is already open or has been set)
+_default_cache_factory: Optional[Callable[[], Optional[ResponseCache]]] = _open_cache_from_environment
+_default_cache_lock = threading.Lock()
+
+
+def get_default_cache() -> Optional[ResponseCache]:
+    """The cache used by the online services. It is only opened when it is used for the first time,
+    so tools that don't send any requests never touch it"""
+    global _default_cache, _default_cache_factory
+    with _default_cache_lock:
+        if _default_cache_factory is not None:
+            # If it can't be opened in offline mode, it is tried again next time instead of using no cache
+            _default_cache = _default_cache_factory()
+            _default_cache_factory = None
+        return _default_cache
+
+
+def set_default_cache(cache: Optional[ResponseCache]):
+    """Replaces the default cache, the previous one is closed"""
+    _replace_default_cache(cache, None)
+
+
+def set_default_cache_factory(factory: Callable[[], Optional[ResponseCache]] = _open_cache_from_environment):
+    """The default cache is opened with the factory when it is used for the first time, the previous one is closed.
+    Without a factory, it is opened from the environment again (as at the start)"""
+    _replace_default_cache(None, factory)
+
+
+def _replace_default_cache(cache: Optional[ResponseCache], factory: Optional[Callable[[], Optional[ResponseCache]]]):
+    global _default_cache, _default_cache_factory
+    with _default_cache_lock:
+        previous = _default_cache
+        _default_cache, _default_cache_factory = cache, factory
+    if previous is not None and previous is not cache:
+        previous.close()
@@ -0,0 +1,91 @@
+"""Vectorized distances on the WGS84 ellipsoid.
+
+geopy.distance.geodesic is exact, but it is pure Python and therefore far too slow in loops over
+(thousands of) trackpoints. These kernels use Lambert's formula for long lines instead,
+i.e. a spherical distance on the reduced latitudes with a first-order flattening correction.
+
+Compared to geopy.distance.geodesic (measured on random pairs within Europe/North America),
+the relative error is below 2e-6, e.g.:
+- up to 1 km: < 3 mm
+- up to 150 km: < 25 cm
+- up to 7000 km: < 10 m
+This bound only holds for such regional distances. For pairs anywhere on earth, the relative error reaches 1e-4
+and for (nearly) antipodal points, the distance may be off by more than 20 km.
+See distance_benchmark.py for the measurement.
+
+All distances are in km, like Location.distance.
+"""
+from __future__ import annotations
+
+from typing import Tuple
+
+import numpy as np
+
+# WGS84
+_a_km = 6378.137
+_f = 1 / 298.257223563
+# For the (local) spherical approximations
+mean_earth_radius_km = 6371.0088
+
+
+def _reduced_latitude(latitude: np.ndarray) -> np.ndarray:
+    return np.arctan((1 - _f) * np.tan(np.radians(latitude)))
+
+
+def distance(latitude_a: np.ndarray | float, longitude_a: np.ndarray | float,
+             latitude_b: np.ndarray | float, longitude_b: np.ndarray | float) -> np.ndarray:
+    """Element-wise distance between a and b (with NumPy broadcasting)"""
+    beta_a = _reduced_latitude(np.asarray(latitude_a, dtype=float))
+    beta_b = _reduced_latitude(np.asarray(latitude_b, dtype=float))
+    delta_lambda = np.radians(np.asarray(longitude_b, dtype=float) - np.asarray(longitude_a, dtype=float))
+
+    # The central angle (haversine on the reduced latitudes)
+    h = np.sin((beta_b - beta_a) / 2) ** 2 + np.cos(beta_a) * np.cos(beta_b) * np.sin(delta_lambda / 2) ** 2
+    sigma = 2 * np.arcsin(np.sqrt(np.clip(h, 0.0, 1.0)))
+
+    p = (beta_a + beta_b) / 2
+    q = (beta_b - beta_a) / 2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x = (sigma - np.sin(sigma)) * np.sin(p) ** 2 * np.cos(q) ** 2 / np.cos(sigma / 2) ** 2
+        y = (sigma + np.sin(sigma)) * np.cos(p) ** 2 * np.sin(q) ** 2 / np.sin(sigma / 2) ** 2
+        result = _a_km * (sigma - _f / 2 * (x + y))
+    # Identical points
+    return np.where(sigma > 0, result, 0.0)
+
+
+def distances_to(latitude: float, longitude: float,
+                 latitudes: np.ndarray, longitudes: np.ndarray) -> np.ndarray:
+    """Distances from one point to many points"""
+    return distance(latitude, longitude, latitudes, longitudes)
+
+
+def distance_matrix(latitudes_a: np.ndarray, longitudes_a: np.ndarray,
+                    latitudes_b: np.ndarray, longitudes_b: np.ndarray) -> np.ndarray:
+    """Pairwise distances; the result has the shape (len(a), len(b))"""
+    latitudes_a = np.asarray(latitudes_a, dtype=float)[:, np.newaxis]
+    longitudes_a = np.asarray(longitudes_a, dtype=float)[:, np.newaxis]
+    return distance(latitudes_a, longitudes_a, latitudes_b, longitudes_b)
+
+
+def segment_lengths(latitudes: np.ndarray, longitudes: np.ndarray) -> np.ndarray:
+    """Distances between consecutive points, i.e. one entry less than there are points"""
+    latitudes = np.asarray(latitudes, dtype=float)
+    longitudes = np.asarray(longitudes, dtype=float)
+    return distance(latitudes[:-1], longitudes[:-1], latitudes[1:], longitudes[1:])
+
+
+def path_length(latitudes: np.ndarray, longitudes: np.ndarray) -> float:
+    """The total length of a polyline"""
+    if len(latitudes) < 2:
+        return 0.0
+    return float(segment_lengths(latitudes, longitudes).sum())
+
+
+def lat_lon_arrays(points) -> Tuple[np.ndarray, np.ndarray]:
+    """Converts anything with latitude and longitude attributes (e.g., GPXTrackPoint, Location)"""
+    if isinstance(getattr(points, 'latitudes', None), np.ndarray):
+        # geo.gpx.TrackPoints already stores the arrays
+        return points.latitudes, points.longitudes
+    latitudes = np.fromiter((point.latitude for point in points), dtype=float)
+    longitudes = np.fromiter((point.longitude for point in points), dtype=float)
+    return latitudes, longitudes
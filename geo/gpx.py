@@ -0,0 +1,145 @@
+"""A streaming GPX reader that stores the points in NumPy arrays.
+
+gpxpy builds an object for every trackpoint (with time, elevation, extensions, ...),
+which takes a lot of memory and time for long exports from brouter, while we only need the coordinates.
+"""
+from __future__ import annotations
+
+import xml.etree.ElementTree as ElementTree
+from dataclasses import dataclass, field
+from typing import Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+
+class TrackPoint(NamedTuple):
+    latitude: float
+    longitude: float
+
+
+class TrackPoints:
+    """A sequence of points, stored as two arrays.
+    Slicing (or indexing with an index array/mask) returns TrackPoints again, iterating yields TrackPoint"""
+    latitudes: np.ndarray
+    longitudes: np.ndarray
+
+    def __init__(self, latitudes: np.ndarray, longitudes: np.ndarray):
+        assert latitudes.shape == longitudes.shape
+        self.latitudes = latitudes
+        self.longitudes = longitudes
+
+    @staticmethod
+    def from_points(points: Iterable) -> TrackPoints:
+        """Converts anything with latitude and longitude attributes (e.g., GPXTrackPoint, Location)"""
+        if isinstance(points, TrackPoints):
+            return points
+        points = list(points)
+        return TrackPoints(np.fromiter((point.latitude for point in points), dtype=float, count=len(points)),
+                           np.fromiter((point.longitude for point in points), dtype=float, count=len(points)))
+
+    @staticmethod
+    def concatenate(parts: Iterable[TrackPoints]) -> TrackPoints:
+        parts = list(parts)
+        if not parts:
+            return TrackPoints(np.empty(0), np.empty(0))
+        return TrackPoints(np.concatenate([part.latitudes for part in parts]),
+                           np.concatenate([part.longitudes for part in parts]))
+
+    def __len__(self) -> int:
+        return len(self.latitudes)
+
+    def __getitem__(self, item) -> TrackPoint | TrackPoints:
+        if isinstance(item, (int, np.integer)):
+            return TrackPoint(float(self.latitudes[item]), float(self.longitudes[item]))
+        return TrackPoints(self.latitudes[item], self.longitudes[item])
+
+    def __iter__(self) -> Iterator[TrackPoint]:
+        return map(TrackPoint, self.latitudes.tolist(), self.longitudes.tolist())
+
+    def __repr__(self) -> str:
+        return f"TrackPoints({len(self)} Punkte)"
+
+
+class _PointBuffer:
+    """Preallocated arrays that grow (by doubling) while a file is read"""
+
+    def __init__(self, capacity: int = 1024):
+        self._coordinates = np.empty((capacity, 2), dtype=float)
+        self._size = 0
+
+    def append(self, latitude: float, longitude: float):
+        if self._size == len(self._coordinates):
+            self._coordinates = np.resize(self._coordinates, (2 * len(self._coordinates), 2))
+        self._coordinates[self._size] = latitude, longitude
+        self._size += 1
+
+    def __len__(self) -> int:
+        return self._size
+
+    def to_track_points(self) -> TrackPoints:
+        # Copying releases the unused capacity
+        coordinates = self._coordinates[:self._size]
+        return TrackPoints(coordinates[:, 0].copy(), coordinates[:, 1].copy())
+
+
+@dataclass
+class GpxData:
+    waypoints: TrackPoints
+    waypoint_names: List[Optional[str]]
+    # The segments of each track
+    tracks: List[List[TrackPoints]] = field(default_factory=list)
+
+    @property
+    def points(self) -> TrackPoints:
+        """The points of the first segment of the first track (the only one in brouter exports)"""
+        if not self.tracks or not self.tracks[0]:
+            return TrackPoints(np.empty(0), np.empty(0))
+        return self.tracks[0][0]
+
+
+def _local_name(tag: str) -> str:
+    # GPX 1.0 and 1.1 use different namespaces
+    return tag.rpartition('}')[2]
+
+
+def _coordinates(element: ElementTree.Element) -> Tuple[float, float]:
+    return float(element.get('lat')), float(element.get('lon'))
+
+
+def read_gpx(file_name: str) -> GpxData:
+    """Reads the waypoints and trackpoints (only their coordinates and the waypoint names)
+    without keeping the whole document in memory"""
+    waypoints = _PointBuffer(capacity=64)
+    waypoint_names: List[Optional[str]] = []
+    tracks: List[List[TrackPoints]] = []
+    segment: Optional[_PointBuffer] = None
+    root: Optional[ElementTree.Element] = None
+    parent: Optional[ElementTree.Element] = None
+
+    for event, element in ElementTree.iterparse(file_name, events=('start', 'end')):
+        name = _local_name(element.tag)
+        if event == 'start':
+            if root is None:
+                root = element
+            elif name == 'trk':
+                tracks.append([])
+            elif name == 'trkseg':
+                segment = _PointBuffer()
+                parent = element
+            continue
+
+        if name == 'trkpt':
+            segment.append(*_coordinates(element))
+            # The points have been read, so they don't need to be kept in the tree
+            parent.clear()
+        elif name == 'wpt':
+            waypoints.append(*_coordinates(element))
+            waypoint_names.append(next((child.text for child in element if _local_name(child.tag) == 'name'), None))
+            root.clear()
+        elif name == 'trkseg':
+            tracks[-1].append(segment.to_track_points())
+            segment = None
+        elif name == 'trk':
+            root.clear()
+
+    return GpxData(waypoints=waypoints.to_track_points(), waypoint_names=waypoint_names, tracks=tracks)
@@ -6,18 +6,21 @@ import os.path
 from functools import lru_cache
 
 import geopy
-from geopy import GoogleV3, Photon
+from geopy import GoogleV3
 from geopy.exc import GeopyError
 
 # https://adamj.eu/tech/2021/05/13/python-type-hints-how-to-fix-circular-imports/
-from typing import TYPE_CHECKING, Any
+from typing import TYPE_CHECKING, Any, Tuple
 
 from structures.country import *
 
 if TYPE_CHECKING:
     from structures import Station
+    from geo.gazetteer import Gazetteer
 
 from geo import Location
+from geo.cache import OfflineCacheMiss
+from geo.photon_advanced_reverse import shared_photon
 
 
 @lru_cache
@@ -29,10 +32,14 @@ def load_api_key() -> str:
         return api_key.read()
 
 
-def with_location_data(station: Station, use_google: bool = False) -> Station:
+def with_location_data(station: Station, use_google: bool = False, gazetteer: Gazetteer | None = None) -> Station:
     from structures import Station
     if not station.location:
-        if use_google:
+        # The gazetteer works offline, so we try it first
+        location = gazetteer.lookup(station.name, country_for_station(station)) if gazetteer is not None else None
+        if location is not None:
+            logging.debug("Using location data from the gazetteer")
+        elif use_google:
             geolocator = GoogleV3(api_key=load_api_key())
             logging.debug("Using location data from Google")
 
@@ -43,22 +50,11 @@ def with_location_data(station: Station, use_google: bool = False) -> Station:
                 logging.warning("Couldn't find station {}. Trying without \" Bahnhof\" suffix".format(station.name))
                 location = geolocator.geocode(station.name, region=country_for_station(station).tld)
         else:
-            geolocator = Photon()
+            geolocator = shared_photon()
             logging.debug("Using location data from Photon")
 
-            country_location: geopy.Location = geolocator.geocode(
-                country_for_station(station).name,
-                osm_tag="place:country"
-            )
-            bbox = country_location.raw['properties']['extent']
-            bbox_start = geopy.Point(
-                longitude=bbox[0],
-                latitude=bbox[1]
-            )
-            bbox_end = geopy.Point(
-                longitude=bbox[2],
-                latitude=bbox[3]
-            )
+            # Not the gazetteer's bounding box, as it only covers the known stations of the country
+            bbox_start, bbox_end = country_bbox_from_photon(country_for_station(station).name)
 
             location: geopy.Location = geolocator.geocode(station.name,
                                                           osm_tag=['railway:station', 'railway:halt', 'railway:stop',
@@ -108,6 +104,24 @@ def with_location_data(station: Station, use_google: bool = False) -> Station:
         return station
 
 
+@lru_cache
+def country_bbox_from_photon(country_name: str) -> Tuple[geopy.Point, geopy.Point]:
+    country_location: geopy.Location = shared_photon().geocode(
+        country_name,
+        osm_tag="place:country"
+    )
+    bbox = country_location.raw['properties']['extent']
+    bbox_start = geopy.Point(
+        longitude=bbox[0],
+        latitude=bbox[1]
+    )
+    bbox_end = geopy.Point(
+        longitude=bbox[2],
+        latitude=bbox[3]
+    )
+    return bbox_start, bbox_end
+
+
 def create_search_query(station: Station) -> str:
     if station.country in (countries['DE'], countries['AT'], countries['CH'], countries['LU']):
         return station.name + " Bahnhof"
@@ -126,13 +140,15 @@ def query_language(station: Station) -> str:
         return "EN"
 
 
-def add_location_data_to_list(stations: List[Station], use_google: bool = False):
+def add_location_data_to_list(stations: List[Station], use_google: bool = False, gazetteer: Gazetteer | None = None):
     for index, station in enumerate(stations):
         try:
-            stations[index] = with_location_data(station, use_google=use_google)
+            stations[index] = with_location_data(station, use_google=use_google, gazetteer=gazetteer)
         except TimeoutError:
             logging.warning("Konnte Standortdaten für {} nicht abrufen.".format(station.name))
         except GeopyError:
             logging.warning("Konnte Standortdaten für {} nicht abrufen.".format(station.name))
+        except OfflineCacheMiss:
+            logging.warning("Keine gespeicherten Standortdaten für {} (Offline-Modus).".format(station.name))
         except FileNotFoundError:
             logging.warning("Couldn't find google_api_key.secret")
@@ -0,0 +1,31 @@
+from __future__ import annotations
+
+import xml.etree.ElementTree as ElementTree
+from typing import Iterator
+from xml.etree.ElementTree import Element
+
+# The root is cleared after this many elements
+_clear_interval = 1000
+
+
+def iter_elements(file_name: str) -> Iterator[Element]:
+    """The top-level elements (node, way, relation, ...) of an OSM XML file, each one after it has been read completely.
+    The elements are cleared after they have been used and regularly removed from the root,
+    so the memory doesn't grow with the size of the file."""
+    context = ElementTree.iterparse(file_name, events=('start', 'end'))
+    _, root = next(context)
+    depth = 0
+    count = 0
+    for event, element in context:
+        if event == 'start':
+            depth += 1
+            continue
+        depth -= 1
+        if depth != 0:
+            # A child (tag, nd, member) or the end of the root
+            continue
+        yield element
+        element.clear()
+        count += 1
+        if count % _clear_interval == 0:
+            root.clear()
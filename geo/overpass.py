@@ -1,34 +1,57 @@
 from __future__ import annotations
 
+import asyncio
 import itertools
 import logging
+import re
+import threading
 import time
-from typing import Any, Dict, List, Iterator
+from functools import lru_cache
+from typing import TYPE_CHECKING, Any, Dict, List, Iterator, Iterable, Tuple
 
 # https://towardsdatascience.com/loading-data-from-openstreetmap-with-python-and-the-overpass-api-513882a27fd0
 from urllib.parse import urlencode, quote
 
-import geopy.distance
 import numpy as np
-import rdp
 import requests
-from gpxpy.gpx import GPXTrackPoint
 from requests import Response
 
+import geo.distance
+from geo.gpx import TrackPoints
+from geo.cache import get_default_cache, query_key
+from geo.rate_limit import TokenBucket
+from tc_utils import profiling
+
+if TYPE_CHECKING:
+    from gpxpy.gpx import GPXTrackPoint
+
 
 def request_overpass(query: str,
                      overpass_api: str = "https://overpass-api.de/api/interpreter",
                      sleep_time: float = 2.0,
                      max_num_retries: int = 4) -> List[Dict[str, Any]]:
+    """Sends the query unless its response is in the default ResponseCache.
+    sleep_time is the minimum time until the next request may be sent, so cached responses don't need to wait."""
+    cache = get_default_cache()
+    key = query_key(overpass_api, query)
+    if cache is not None:
+        response = cache.get('overpass', key)
+        if response is not None:
+            return response
+        cache.miss('overpass', key)
     for i in range(max_num_retries):
+        _wait_for_next_request()
         try:
             response = _request_overpass(query, overpass_api)
-            time.sleep(sleep_time)
+            _delay_next_request(sleep_time)
+            if cache is not None:
+                cache.put('overpass', key, response)
             return response
         except requests.exceptions.Timeout:
-            # Exponential waiting time
-            sleep_time *= 2 ** (i + 1)
-            logging.info(f"Got too many requests. Waiting for {sleep_time} s.")
+            # Exponential waiting time (only for the retries, the next query waits sleep_time again)
+            waiting_time = sleep_time * 2 ** (i + 1)
+            logging.info(f"Got too many requests. Waiting for {waiting_time} s.")
+            _delay_next_request(waiting_time)
         except requests.exceptions.HTTPError as e:
             if e.response.status_code != 400:
                 raise
@@ -40,6 +63,23 @@ def request_overpass(query: str,
         raise TimeoutError("Too many requests")
 
 
+# The earliest time (time.monotonic) at which the next request may be sent
+_next_request_time: float = 0.0
+
+
+def _wait_for_next_request():
+    waiting_time = _next_request_time - time.monotonic()
+    if waiting_time > 0:
+        with profiling.span('overpass.wait', 'network'):
+            time.sleep(waiting_time)
+
+
+def _delay_next_request(sleep_time: float):
+    global _next_request_time
+    _next_request_time = max(_next_request_time, time.monotonic() + sleep_time)
+
+
+@profiling.profiled('overpass.request', 'network')
 def _request_overpass(query: str,
                       overpass_api: str = "https://overpass-api.de/api/interpreter") -> List[Dict[str, Any]]:
     response = requests.post(overpass_api,
@@ -52,14 +92,220 @@ def _request_overpass(query: str,
         raise requests.exceptions.Timeout
 
 
+def _request_overpass_in_slot(query: str, overpass_api: str,
+                              server_slots: threading.BoundedSemaphore | None) -> List[Dict[str, Any]]:
+    if server_slots is None:
+        return _request_overpass(query, overpass_api)
+    with server_slots:
+        return _request_overpass(query, overpass_api)
+
+
+# Requests from all threads (e.g., concurrent imports) share the slots and the rate limit of a server
+_shared_lock = threading.Lock()
+_shared_slots: Dict[str, threading.BoundedSemaphore] = {}
+_shared_limiters: Dict[Tuple[str, float], TokenBucket] = {}
+
+
+def _server_slots(overpass_api: str, slots: int) -> threading.BoundedSemaphore:
+    with _shared_lock:
+        if overpass_api not in _shared_slots:
+            _shared_slots[overpass_api] = threading.BoundedSemaphore(slots)
+        return _shared_slots[overpass_api]
+
+
+def _shared_limiter(overpass_api: str, sleep_time: float, slots: int) -> TokenBucket:
+    with _shared_lock:
+        key = (overpass_api, sleep_time)
+        if key not in _shared_limiters:
+            _shared_limiters[key] = TokenBucket(rate=1 / sleep_time, capacity=slots)
+        return _shared_limiters[key]
+
+
 def query_multiple(queries: Iterator[str],
                    overpass_api: str = "https://overpass-api.de/api/interpreter",
                    sleep_time: float = 2.0,
                    max_num_retries: int = 2,
                    timeout: int | None = None,
                    maxsize: int | None = None,
-                   out: str = "tags") -> List[List[Dict[str, Any]]]:
+                   out: str = "tags",
+                   **kwargs) -> List[List[Dict[str, Any]]]:
+    """Runs the queries (in as few requests as reasonable) and returns the responses for each of them.
+    See query_multiple_async for the additional arguments."""
+    return asyncio.run(query_multiple_async(queries, overpass_api, sleep_time, max_num_retries, timeout, maxsize, out,
+                                            **kwargs))
+
+
+async def query_multiple_async(queries: Iterable[str],
+                               overpass_api: str = "https://overpass-api.de/api/interpreter",
+                               sleep_time: float = 2.0,
+                               max_num_retries: int = 2,
+                               timeout: int | None = None,
+                               maxsize: int | None = None,
+                               out: str = "tags",
+                               max_queries_per_request: int = 25,
+                               max_query_length: int = 50000,
+                               max_extent: float = 2.0,
+                               slots: int | None = None,
+                               limiter: TokenBucket | None = None) -> List[List[Dict[str, Any]]]:
+    """The queries are combined into as few requests as possible,
+    each with at most max_queries_per_request queries, max_query_length characters and a bounding box of
+    max_extent degrees (in latitude and longitude).
+    These requests are sent concurrently, but never more than the server allows at once (slots).
+    slots: The number of concurrent requests; if None, it is taken from the status of the Overpass API
+        (only if some of the requests are not in the cache, and never in offline mode)
+    limiter: Limits the rate of requests; by default, there is one request every sleep_time seconds"""
     assert out != "count"
+    queries = list(queries)
+    if not queries:
+        return []
+    shards = shard_queries(queries, max_queries_per_request, max_query_length, max_extent)
+    combined_queries = [combine_queries([queries[index] for index in shard], timeout=timeout, maxsize=maxsize,
+                                              out=out)
+                              for shard in shards]
+    # The server (and its status) is only asked if some of the requests are not in the cache
+    cache = get_default_cache()
+    responses = [cache.get('overpass', query_key(overpass_api, query)) if cache is not None else None
+                 for query in combined_queries]
+    missing = [index for index, response in enumerate(responses) if response is None]
+    logging.debug(f"{len(queries)} Overpass-Abfragen in {len(shards)} Anfragen, {len(missing)} nicht im Cache")
+    if missing:
+        if slots is None:
+            if cache is not None and cache.offline:
+                slots = default_slots
+            else:
+                slots = await asyncio.to_thread(get_slots, overpass_api)
+        if limiter is None:
+            limiter = _shared_limiter(overpass_api, sleep_time, slots)
+        semaphore = asyncio.Semaphore(slots)
+        server_slots = _server_slots(overpass_api, slots)
+        missing_responses = await asyncio.gather(*(
+            request_overpass_async(combined_queries[index], overpass_api, limiter, semaphore, sleep_time,
+                                   max_num_retries, server_slots)
+            for index in missing))
+        for index, response in zip(missing, missing_responses):
+            responses[index] = response
+    return [split_response
+            for shard, response in zip(shards, responses)
+            for split_response in split_responses(response, len(shard))]
+
+
+async def request_overpass_async(query: str,
+                                 overpass_api: str,
+                                 limiter: TokenBucket,
+                                 semaphore: asyncio.Semaphore,
+                                 sleep_time: float = 2.0,
+                                 max_num_retries: int = 4,
+                                 server_slots: threading.BoundedSemaphore | None = None) -> List[Dict[str, Any]]:
+    """Like request_overpass, but the waiting is done by the limiter and the semaphore.
+    server_slots: Limits the concurrent requests to the server from all threads (see _server_slots)"""
+    cache = get_default_cache()
+    key = query_key(overpass_api, query)
+    if cache is not None:
+        response = cache.get('overpass', key)
+        if response is not None:
+            return response
+        cache.miss('overpass', key)
+    for i in range(max_num_retries):
+        await limiter.acquire_async()
+        async with semaphore:
+            try:
+                response = await asyncio.to_thread(_request_overpass_in_slot, query, overpass_api, server_slots)
+            except requests.exceptions.Timeout:
+                # Exponential waiting time
+                waiting_time = sleep_time * 2 ** (i + 1)
+                logging.info(f"Got too many requests. Waiting for {waiting_time} s.")
+            except requests.exceptions.HTTPError as e:
+                if e.response.status_code == 400:
+                    logging.error(e.response.text)
+                raise
+            else:
+                if cache is not None:
+                    cache.put('overpass', key, response)
+                return response
+        await asyncio.sleep(waiting_time)
+    else:
+        raise TimeoutError("Too many requests")
+
+
+# The number of concurrent requests if the status of the Overpass API doesn't tell
+default_slots = 2
+
+
+@lru_cache
+def get_slots(overpass_api: str = "https://overpass-api.de/api/interpreter", default: int = default_slots) -> int:
+    """returns: The number of requests the Overpass API allows at the same time (from its status page)"""
+    status_url = overpass_api.rsplit('/', 1)[0] + '/status'
+    try:
+        response = requests.get(status_url, timeout=10)
+        response.raise_for_status()
+    except requests.exceptions.RequestException as e:
+        logging.debug(f"Overpass-Status nicht verfügbar: {e}")
+        return default
+    match = _rate_limit_re.search(response.text)
+    if match is None or int(match.group(1)) <= 0:
+        # 0 means that there is no limit, but we still don't want to overload the server
+        return default
+    return int(match.group(1))
+
+
+_rate_limit_re = re.compile(r"Rate limit: (\d+)")
+_around_re = re.compile(r"around:[\d.]+,([-\d.,]+)\)")
+
+
+def shard_queries(queries: List[str],
+                  max_queries_per_request: int = 25,
+                  max_query_length: int = 50000,
+                  max_extent: float = 2.0) -> List[List[int]]:
+    """Splits the queries into consecutive groups that can be sent in one request each.
+    returns: The indices of the queries for each request"""
+    shards = []
+    current_shard = []
+    current_length = 0
+    current_bbox = None
+    for index, query in enumerate(queries):
+        query_bbox = _query_bbox(query)
+        bbox = _union_bbox(current_bbox, query_bbox)
+        # The query is wrapped in some additional statements
+        length = len(query) + 40
+        if current_shard and (len(current_shard) >= max_queries_per_request or
+                              current_length + length > max_query_length or
+                              bbox is not None and max(bbox[2] - bbox[0], bbox[3] - bbox[1]) > max_extent):
+            shards.append(current_shard)
+            current_shard = []
+            current_length = 0
+            bbox = query_bbox
+        current_shard.append(index)
+        current_length += length
+        current_bbox = bbox
+    if current_shard:
+        shards.append(current_shard)
+    return shards
+
+
+def _query_bbox(query: str) -> Tuple[float, float, float, float] | None:
+    """returns: min_latitude, min_longitude, max_latitude, max_longitude of all around-filters (if there are any)"""
+    coordinates = [float(value) for match in _around_re.finditer(query) for value in match.group(1).split(',')]
+    if not coordinates:
+        return None
+    latitudes = coordinates[0::2]
+    longitudes = coordinates[1::2]
+    return min(latitudes), min(longitudes), max(latitudes), max(longitudes)
+
+
+def _union_bbox(a: Tuple[float, float, float, float] | None,
+                b: Tuple[float, float, float, float] | None) -> Tuple[float, float, float, float] | None:
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3])
+
+
+def combine_queries(queries: List[str],
+                    timeout: int | None = None,
+                    maxsize: int | None = None,
+                    out: str = "tags") -> str:
+    """Combines the queries into one. Each result is preceded by a count element (see split_responses)."""
     timeout = f"[timeout:{timeout}]" if timeout is not None else ""
     maxsize = f"[maxsize:{maxsize}]" if maxsize is not None else ""
     header = f"[out:json];{timeout}{maxsize}"
@@ -71,18 +317,17 @@ def query_multiple(queries: Iterator[str],
     logging.debug(query)
     if len(query) > 100000:
         logging.warning(f"Very long query: {len(query)}")
+    return query
+
 
-    response = request_overpass(query, overpass_api, sleep_time, max_num_retries)
+def split_responses(response: List[Dict[str, Any]], number_of_queries: int) -> List[List[Dict[str, Any]]]:
     responses = []
-    current_response = []
     for element in response:
         if element["type"] == "count":
-            if current_response:
-                responses.append(current_response)
-            current_response = []
+            responses.append([])
         else:
-            current_response.append(element)
-    responses.append(current_response)
+            responses[-1].append(element)
+    assert len(responses) == number_of_queries, f"Expected {number_of_queries} responses, got {len(responses)}"
     return responses
 
 
@@ -95,16 +340,18 @@ def create_query(query: str,
     return f"[out:json];{timeout}{maxsize}{query};out {out};"
 
 
-def query_around_gpx(distance: float, path: List[GPXTrackPoint], ndigits=4) -> str:
+def query_around_gpx(distance: float, path: TrackPoints | List[GPXTrackPoint], ndigits=4) -> str:
     lat_lons = (f"{round(trackpoint.latitude, ndigits)},{round(trackpoint.longitude, ndigits)}" for trackpoint in path)
     lat_lons = ','.join(lat_lons)
     return f"(around:{int(distance * 1000)},{lat_lons})"
 
 
 def query_rail_around_gpx(distance: float,
-                          segment: List[GPXTrackPoint],
-                          only_maxspeed: bool = False) -> str:
-    segment = list(douglas_peucker(segment, distance))
+                          segment: TrackPoints | List[GPXTrackPoint],
+                          only_maxspeed: bool = False,
+                          simplify: bool = True) -> str:
+    if simplify:
+        segment = douglas_peucker(segment, distance)
     only_maxspeed = '["maxspeed"]' if only_maxspeed else ""
     around = query_around_gpx(distance, segment)
     query = f'way["railway"="rail"]{only_maxspeed}{around}'
@@ -112,27 +359,78 @@ def query_rail_around_gpx(distance: float,
 
 
 def query_stations_around_gpx(distance: float,
-                              path: List[GPXTrackPoint]) -> str:
-    path = list(douglas_peucker(path, min(0.01, distance - 0.03)))
+                              path: TrackPoints | List[GPXTrackPoint]) -> str:
+    path = douglas_peucker(path, min(0.01, distance - 0.03))
     around = query_around_gpx(distance, path, ndigits=5)
     query = f'node["railway"="station"]{around}'
     return query
 
 
 # Based on https://towardsdatascience.com/simplify-polylines-with-the-douglas-peucker-algorithm-ac8ed487a4a1
-def douglas_peucker(points: List[GPXTrackPoint], max_radius: float) -> Iterator[GPXTrackPoint]:
-    points_array = np.ndarray((len(points), 2), dtype=float)
-    for index, point in enumerate(points):
-        # We use lat, lon here, because geopy.distance.geodesic uses this format.
-        # For the geometric stuff it doesn't matter, as we only care about distances and not directions, etc.
-        points_array[index] = (point.latitude, point.longitude)
-    selected_points = rdp.rdp(points_array, dist=approximate_distance_to_line, epsilon=max_radius, return_mask=True)
-    return itertools.compress(points, selected_points)
-
-
-def approximate_distance_to_line(point: np.ndarray, start: np.ndarray, end: np.ndarray) -> float:
-    # NOTE: We assume here that distances are roughly linear to the longitude and latitude difference
-    # Step 1: Get the "scale" - i.e., distance_km / distance_lon_lat.
-    km_per_lon_lat = geopy.distance.geodesic(start, end).km / np.linalg.norm(start - end)
-    distance_lon_lat = rdp.pldist(point, start, end)
-    return distance_lon_lat * km_per_lon_lat
+def douglas_peucker(points: TrackPoints | List[GPXTrackPoint],
+                    max_radius: float) -> TrackPoints | List[GPXTrackPoint]:
+    selected_points = douglas_peucker_mask(*geo.distance.lat_lon_arrays(points), max_radius)
+    if isinstance(points, TrackPoints):
+        return points[selected_points]
+    return list(itertools.compress(points, selected_points))
+
+
+def douglas_peucker_mask(latitudes: np.ndarray, longitudes: np.ndarray, max_radius: float) -> np.ndarray:
+    """Ramer-Douglas-Peucker without recursion.
+    Instead of handling one sub-line after another, all sub-lines of the same depth are handled at once.
+    max_radius is given in km.
+    returns: A boolean mask of the points to keep"""
+    latitudes = np.asarray(latitudes, dtype=float)
+    longitudes = np.asarray(longitudes, dtype=float)
+    mask = np.zeros(len(latitudes), dtype=bool)
+    if len(latitudes) < 3:
+        mask[:] = True
+        return mask
+    mask[0] = mask[-1] = True
+    starts = np.array([0])
+    ends = np.array([len(latitudes) - 1])
+    while starts.size:
+        # The number of points between start and end
+        lengths = ends - starts - 1
+        has_points = lengths > 0
+        starts, ends, lengths = starts[has_points], ends[has_points], lengths[has_points]
+        if not starts.size:
+            break
+        offsets = np.cumsum(lengths) - lengths
+        sub_line = np.repeat(np.arange(len(starts)), lengths)
+        indices = np.arange(lengths.sum()) - offsets[sub_line] + starts[sub_line] + 1
+        distances = _distances_to_lines(latitudes[indices], longitudes[indices],
+                                        latitudes[starts][sub_line], longitudes[starts][sub_line],
+                                        latitudes[ends][sub_line], longitudes[ends][sub_line])
+        max_distances = np.maximum.reduceat(distances, offsets)
+        # Like in the recursive version, we split at the first point with the largest distance
+        is_max = np.flatnonzero(distances == max_distances[sub_line])
+        _, first_max = np.unique(sub_line[is_max], return_index=True)
+        splits = indices[is_max[first_max]]
+        split = max_distances > max_radius
+        splits = splits[split]
+        mask[splits] = True
+        starts, ends = np.concatenate((starts[split], splits)), np.concatenate((splits, ends[split]))
+    return mask
+
+
+def _distances_to_lines(latitudes: np.ndarray, longitudes: np.ndarray,
+                        latitudes_start: np.ndarray, longitudes_start: np.ndarray,
+                        latitudes_end: np.ndarray, longitudes_end: np.ndarray) -> np.ndarray:
+    """The distances (in km) of the points to the (infinite) lines through start and end.
+    Each line gets its own equirectangular projection centered on it, so this is accurate for short lines anywhere."""
+    km_per_degree = np.pi / 180 * geo.distance.mean_earth_radius_km
+    km_per_degree_longitude = km_per_degree * np.cos(np.radians((latitudes_start + latitudes_end) / 2))
+    x_end = _longitude_difference(longitudes_end, longitudes_start) * km_per_degree_longitude
+    y_end = (latitudes_end - latitudes_start) * km_per_degree
+    x = _longitude_difference(longitudes, longitudes_start) * km_per_degree_longitude
+    y = (latitudes - latitudes_start) * km_per_degree
+    line_lengths = np.hypot(x_end, y_end)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        distances = np.abs(x_end * y - y_end * x) / line_lengths
+    # If start and end are the same, we use the distance to that point instead
+    return np.where(line_lengths > 0, distances, np.hypot(x, y))
+
+
+def _longitude_difference(longitudes: np.ndarray, longitudes_reference: np.ndarray) -> np.ndarray:
+    return (longitudes - longitudes_reference + 180) % 360 - 180
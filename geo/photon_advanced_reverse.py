@@ -1,7 +1,7 @@
 from __future__ import annotations
 
 import collections.abc
-from functools import partial
+from functools import partial, lru_cache
 from typing import List
 from urllib.parse import urlencode
 
@@ -9,8 +9,43 @@ import geopy
 from geopy import Photon
 from geopy.geocoders.base import DEFAULT_SENTINEL
 
+from geo.cache import get_default_cache, url_key
+from geo.rate_limit import TokenBucket
+from tc_utils import profiling
+
 
 class PhotonAdvancedReverse(Photon):
+    """Photon with additional reverse parameters.
+    Responses are stored in the default ResponseCache, and only actual requests are rate-limited (by rate_limiter).
+    It may be used from multiple threads."""
+    rate_limiter: TokenBucket | None
+
+    def __init__(self, *, rate_limiter: TokenBucket | None = None, **kwargs):
+        super().__init__(**kwargs)
+        self.rate_limiter = rate_limiter
+
+    def _call_geocoder(self, url, callback, *, timeout=DEFAULT_SENTINEL, is_json=True, headers=None):
+        cache = get_default_cache()
+        if cache is None or not is_json:
+            self._wait_for_rate_limit()
+            with profiling.span('photon.request', 'network'):
+                return super()._call_geocoder(url, callback, timeout=timeout, is_json=is_json, headers=headers)
+        key = url_key(url)
+        response = cache.get('photon', key)
+        if response is None:
+            cache.miss('photon', key)
+            self._wait_for_rate_limit()
+            # We store the plain JSON response and parse it afterwards
+            with profiling.span('photon.request', 'network'):
+                response = super()._call_geocoder(url, lambda result: result, timeout=timeout, is_json=is_json,
+                                                  headers=headers)
+            cache.put('photon', key, response)
+        return callback(response)
+
+    def _wait_for_rate_limit(self):
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire()
+
     def reverse(
             self,
             query,
@@ -80,3 +115,9 @@ class PhotonAdvancedReverse(Photon):
         geopy.util.logger.debug("%s.reverse: %s", self.__class__.__name__, url)
         callback = partial(self._parse_json, exactly_one=exactly_one)
         return self._call_geocoder(url, callback, timeout=timeout)
+
+
+@lru_cache
+def shared_photon() -> PhotonAdvancedReverse:
+    """One geocoder for all Photon requests, so that the rate limit applies to all of them"""
+    return PhotonAdvancedReverse(rate_limiter=TokenBucket(rate=2.0), timeout=10)
@@ -0,0 +1,356 @@
+"""A local replacement for the Overpass rail queries (query_rail_around_gpx).
+
+The rail ways of an OSM extract are stored as line segments in a grid (by latitude and longitude),
+together with the tags that are used for the paths. The index is saved as a compressed .npz file.
+
+Segments that cross the antimeridian are split there, so they are stored in the right cells. The search itself does
+not wrap around, though: A route that crosses the antimeridian only finds the ways on the same side as its points.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import math
+from functools import cached_property
+from typing import TYPE_CHECKING, Any, Dict, List, Tuple, Iterable, Set
+
+import numpy as np
+
+import geo.distance
+from geo import overpass
+from geo.gpx import TrackPoints
+from geo.osm_xml import iter_elements
+from geo.overpass import douglas_peucker_mask, query_rail_around_gpx
+
+if TYPE_CHECKING:
+    from gpxpy.gpx import GPXTrackPoint
+
+# Only these tags are needed for the paths
+rail_tags = ('name', 'railway', 'maxspeed', 'electrified', 'usage', 'service', 'gauge')
+# In degrees
+default_cell_size = 0.05
+# Coordinates are stored as integers in 1e-7 degrees, like in OSM itself
+_coordinate_scale = 10_000_000
+
+
+class RailIndex:
+    way_ids: np.ndarray
+    way_tags: List[Dict[str, str]]
+    # The segments of all ways, sorted by their grid cell
+    # Shape: (n, 4) with latitude_a, longitude_a, latitude_b, longitude_b in 1e-7 degrees
+    segments: np.ndarray
+    # The index in way_ids for each segment
+    segment_ways: np.ndarray
+    # The (sorted) grid cells that contain segments and the index of their first segment
+    cell_keys: np.ndarray
+    cell_starts: np.ndarray
+    cell_size: float
+    # Half the extent of the largest segment (in degrees), i.e., how far a segment can reach out of its cell
+    max_overhang: float
+
+    def __init__(self, way_ids: np.ndarray, way_tags: List[Dict[str, str]],
+                 segments: np.ndarray, segment_ways: np.ndarray, cell_size: float = default_cell_size):
+        self.way_ids = np.asarray(way_ids, dtype=np.int64)
+        self.way_tags = way_tags
+        self.cell_size = cell_size
+        segments = np.asarray(segments, dtype=np.int32).reshape(-1, 4)
+        segment_ways = np.asarray(segment_ways, dtype=np.int32)
+        # Sort the segments by the cell of their center
+        keys = self._cell_key(*self._segment_centers(segments))
+        order = np.argsort(keys, kind='stable')
+        self.segments = segments[order]
+        self.segment_ways = segment_ways[order]
+        keys = keys[order]
+        self.cell_keys, self.cell_starts = np.unique(keys, return_index=True)
+        if len(self.segments):
+            extents = np.abs(self.segments[:, 2:] - self.segments[:, :2]) / _coordinate_scale
+            self.max_overhang = float(extents.max()) / 2
+        else:
+            self.max_overhang = 0.0
+
+    def __len__(self) -> int:
+        return len(self.way_ids)
+
+    @cached_property
+    def fingerprint(self) -> str:
+        """A hash of the content, e.g., to tell whether checkpoints have been created with the same index"""
+        content_hash = hashlib.sha256()
+        for array in (self.way_ids, self.segments, self.segment_ways):
+            content_hash.update(np.ascontiguousarray(array).tobytes())
+        content_hash.update(json.dumps(self.way_tags, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+        content_hash.update(repr(self.cell_size).encode('utf-8'))
+        return content_hash.hexdigest()[:16]
+
+    @staticmethod
+    def _segment_centers(segments: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        segments = segments.astype(np.int64)
+        return ((segments[:, 0] + segments[:, 2]) / (2 * _coordinate_scale),
+                (segments[:, 1] + segments[:, 3]) / (2 * _coordinate_scale))
+
+    def _cell_key(self, latitudes: np.ndarray, longitudes: np.ndarray) -> np.ndarray:
+        rows = np.floor((np.asarray(latitudes) + 90) / self.cell_size).astype(np.int64)
+        columns = np.floor((np.asarray(longitudes) + 180) / self.cell_size).astype(np.int64)
+        return rows * int(math.ceil(360 / self.cell_size)) + columns
+
+    @staticmethod
+    def from_ways(ways: Iterable[Tuple[int, Dict[str, str], List[Tuple[float, float]]]],
+                  cell_size: float = default_cell_size) -> RailIndex:
+        """ways: (osm_id, tags, [(latitude, longitude), ...])"""
+        way_ids = []
+        way_tags = []
+        segments = []
+        segment_ways = []
+        for osm_id, tags, coordinates in ways:
+            if len(coordinates) < 2:
+                continue
+            way_index = len(way_ids)
+            way_ids.append(osm_id)
+            way_tags.append({key: value for key, value in tags.items() if key in rail_tags})
+            coordinates = np.asarray(coordinates, dtype=float)
+            starts, ends = _split_at_antimeridian(coordinates[:-1], coordinates[1:])
+            segments.append(np.rint(np.hstack((starts, ends)) * _coordinate_scale).astype(np.int32))
+            segment_ways.append(np.full(len(starts), way_index, dtype=np.int32))
+        if segments:
+            segments = np.concatenate(segments)
+            segment_ways = np.concatenate(segment_ways)
+        else:
+            segments = np.empty((0, 4), dtype=np.int32)
+            segment_ways = np.empty(0, dtype=np.int32)
+        return RailIndex(np.array(way_ids, dtype=np.int64), way_tags, segments, segment_ways, cell_size=cell_size)
+
+    @staticmethod
+    def from_overpass(elements: Iterable[Dict[str, Any]], cell_size: float = default_cell_size) -> RailIndex:
+        """Uses the ways of an Overpass response with geometry (out geom). Duplicate ways are only added once."""
+        ways = {}
+        for element in elements:
+            if element["type"] == "way" and "geometry" in element:
+                ways[element["id"]] = (element["id"], element.get("tags", {}),
+                                       [(node["lat"], node["lon"]) for node in element["geometry"] if node])
+        return RailIndex.from_ways(ways.values(), cell_size=cell_size)
+
+    @staticmethod
+    def from_osm(file_name: str, railway_values: Tuple[str, ...] = ('rail',),
+                 cell_size: float = default_cell_size) -> RailIndex:
+        """Reads an OSM extract; .pbf files need pyosmium, everything else is read as OSM XML"""
+        if file_name.endswith('.pbf'):
+            ways = _read_ways_pbf(file_name, railway_values)
+        else:
+            ways = _read_ways_xml(file_name, railway_values)
+        rail_index = RailIndex.from_ways(ways, cell_size=cell_size)
+        logging.info(f"{len(rail_index)} Strecken mit {len(rail_index.segments)} Abschnitten aus {file_name} geladen")
+        return rail_index
+
+    def save(self, file_name: str):
+        tags = json.dumps(self.way_tags, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        np.savez_compressed(file_name,
+                            way_ids=self.way_ids,
+                            way_tags=np.frombuffer(tags, dtype=np.uint8),
+                            segments=self.segments,
+                            segment_ways=self.segment_ways,
+                            cell_size=np.array(self.cell_size))
+
+    @staticmethod
+    def load(file_name: str) -> RailIndex:
+        with np.load(file_name) as data:
+            return RailIndex(data['way_ids'],
+                             json.loads(data['way_tags'].tobytes().decode('utf-8')),
+                             data['segments'],
+                             data['segment_ways'],
+                             cell_size=float(data['cell_size']))
+
+    def ways_around(self, latitudes: np.ndarray, longitudes: np.ndarray, distance: float) -> np.ndarray:
+        """The ways that are within distance (in km) of the polyline (like Overpass' around-filter)
+        returns: The indices of the ways, sorted by their OSM id"""
+        latitudes = np.asarray(latitudes, dtype=float)
+        longitudes = np.asarray(longitudes, dtype=float)
+        if not len(latitudes) or not len(self.segments):
+            return np.empty(0, dtype=np.int64)
+        candidates = self._candidate_segments(latitudes, longitudes, distance)
+        if not candidates.size:
+            return np.empty(0, dtype=np.int64)
+        segments = self.segments[candidates] / _coordinate_scale
+
+        # Everything is projected to a plane around the center of the polyline (in km)
+        center_latitude = float(np.mean(latitudes))
+        km_per_degree = np.pi / 180 * geo.distance.mean_earth_radius_km
+        km_per_degree_longitude = km_per_degree * math.cos(math.radians(center_latitude))
+
+        def project(segment_latitudes, segment_longitudes) -> np.ndarray:
+            return np.stack(((segment_longitudes - longitudes[0]) * km_per_degree_longitude,
+                             (segment_latitudes - latitudes[0]) * km_per_degree), axis=-1)
+
+        rail_a = project(segments[:, 0], segments[:, 1])
+        rail_b = project(segments[:, 2], segments[:, 3])
+        line = project(latitudes, longitudes)
+        if len(line) == 1:
+            line = np.vstack((line, line))
+        line_a = line[:-1]
+        line_b = line[1:]
+
+        close = np.zeros(len(candidates), dtype=bool)
+        # Limit the size of the (rail segments x polyline segments) matrices
+        chunk_size = max(1, 2_000_000 // len(candidates))
+        for start in range(0, len(line_a), chunk_size):
+            distances = _segment_distances(rail_a[:, np.newaxis], rail_b[:, np.newaxis],
+                                           line_a[np.newaxis, start:start + chunk_size],
+                                           line_b[np.newaxis, start:start + chunk_size])
+            close |= np.any(distances <= distance, axis=1)
+        ways = np.unique(self.segment_ways[candidates[close]])
+        return ways[np.argsort(self.way_ids[ways], kind='stable')]
+
+    def _candidate_segments(self, latitudes: np.ndarray, longitudes: np.ndarray, distance: float) -> np.ndarray:
+        """All segments in the cells that are close to the polyline"""
+        # The distance in degrees (latitude and longitude)
+        margin_latitude = distance / (np.pi / 180 * geo.distance.mean_earth_radius_km)
+        max_latitude = min(89.0, float(np.max(np.abs(latitudes))) + margin_latitude)
+        margin_longitude = margin_latitude / math.cos(math.radians(max_latitude))
+        margin_latitude += self.max_overhang
+        margin_longitude += self.max_overhang
+        # The cells around each polyline segment (using its bounding box)
+        rows = np.floor((latitudes + 90) / self.cell_size).astype(np.int64)
+        columns = np.floor((longitudes + 180) / self.cell_size).astype(np.int64)
+        margin_rows = int(math.ceil(margin_latitude / self.cell_size))
+        margin_columns = int(math.ceil(margin_longitude / self.cell_size))
+        if len(rows) > 1:
+            row_ranges = np.stack((np.minimum(rows[:-1], rows[1:]), np.maximum(rows[:-1], rows[1:])), axis=-1)
+            column_ranges = np.stack((np.minimum(columns[:-1], columns[1:]), np.maximum(columns[:-1], columns[1:])),
+                                     axis=-1)
+        else:
+            row_ranges = np.stack((rows, rows), axis=-1)
+            column_ranges = np.stack((columns, columns), axis=-1)
+        columns_per_row = int(math.ceil(360 / self.cell_size))
+        keys: Set[int] = set()
+        for (row_min, row_max), (column_min, column_max) in zip(row_ranges.tolist(), column_ranges.tolist()):
+            for row in range(row_min - margin_rows, row_max + margin_rows + 1):
+                keys.update(range(row * columns_per_row + column_min - margin_columns,
+                                  row * columns_per_row + column_max + margin_columns + 1))
+        keys = np.fromiter(keys, dtype=np.int64, count=len(keys))
+        positions = np.searchsorted(self.cell_keys, keys)
+        found = positions < len(self.cell_keys)
+        found[found] = self.cell_keys[positions[found]] == keys[found]
+        positions = positions[found]
+        if not positions.size:
+            return np.empty(0, dtype=np.int64)
+        ends = np.append(self.cell_starts[1:], len(self.segments))
+        return np.concatenate([np.arange(self.cell_starts[position], ends[position]) for position in positions])
+
+    def query_around_gpx(self, distance: float, segment: TrackPoints | List[GPXTrackPoint]) -> List[Dict[str, Any]]:
+        """Like query_rail_around_gpx with request_overpass, but locally.
+        returns: The ways in the same format as the Overpass API (with tags)"""
+        latitudes, longitudes = geo.distance.lat_lon_arrays(segment)
+        selected = douglas_peucker_mask(latitudes, longitudes, distance)
+        ways = self.ways_around(latitudes[selected], longitudes[selected], distance)
+        return [{"type": "way", "id": int(self.way_ids[way]), "tags": dict(self.way_tags[way])} for way in ways]
+
+
+def query_rail_index_around_gpx(distance: float,
+                                points: TrackPoints | List[GPXTrackPoint],
+                                max_points_per_query: int = 500) -> RailIndex:
+    """Fetches the rail ways (with geometry) around a whole route from the Overpass API,
+    so that they can be assigned to the segments of the route locally.
+    The route is split into a few overlapping parts to keep the queries reasonably short.
+    The route is simplified differently than its segments will be, so we use twice the distance here
+    to get everything the queries for the single segments would return."""
+    points = TrackPoints.from_points(points)
+    simplified = points[douglas_peucker_mask(points.latitudes, points.longitudes, distance)]
+    parts = [simplified[start:start + max_points_per_query + 1]
+             for start in range(0, max(1, len(simplified) - 1), max_points_per_query)]
+    queries = [query_rail_around_gpx(2 * distance, part, simplify=False) for part in parts]
+    responses = overpass.query_multiple(queries, out="geom")
+    elements = [element for response in responses for element in response]
+    rail_index = RailIndex.from_overpass(elements)
+    logging.info(f"{len(rail_index)} Strecken für die gesamte Route geladen ({len(elements)} mit Duplikaten)")
+    return rail_index
+
+
+def _split_at_antimeridian(starts: np.ndarray, ends: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Splits the segments (latitude, longitude) that cross the antimeridian into two segments ending at ±180°.
+    Otherwise, they would span the whole earth, and so would the overhang of every cell."""
+    crossing = np.abs(ends[:, 1] - starts[:, 1]) > 180
+    if not np.any(crossing):
+        return starts, ends
+    crossing_starts, crossing_ends = starts[crossing], ends[crossing]
+    # +1 if the segment starts in the east (and continues to the west of the antimeridian), -1 otherwise
+    side = np.sign(crossing_starts[:, 1])
+    end_longitudes = crossing_ends[:, 1] + 360 * side
+    t = (180 * side - crossing_starts[:, 1]) / (end_longitudes - crossing_starts[:, 1])
+    latitudes = crossing_starts[:, 0] + t * (crossing_ends[:, 0] - crossing_starts[:, 0])
+    return (np.concatenate((starts[~crossing], crossing_starts, np.stack((latitudes, -180 * side), axis=-1))),
+            np.concatenate((ends[~crossing], np.stack((latitudes, 180 * side), axis=-1), crossing_ends)))
+
+
+def _segment_distances(a: np.ndarray, b: np.ndarray, c: np.ndarray, d: np.ndarray) -> np.ndarray:
+    """The (planar) distances between the segments a-b and c-d (with broadcasting)"""
+    return np.where(_segments_intersect(a, b, c, d), 0.0,
+                    np.minimum(np.minimum(_point_segment_distance(a, c, d), _point_segment_distance(b, c, d)),
+                               np.minimum(_point_segment_distance(c, a, b), _point_segment_distance(d, a, b))))
+
+
+def _point_segment_distance(point: np.ndarray, start: np.ndarray, end: np.ndarray) -> np.ndarray:
+    direction = end - start
+    length_squared = np.sum(direction ** 2, axis=-1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = np.sum((point - start) * direction, axis=-1) / length_squared
+    t = np.clip(np.nan_to_num(t), 0.0, 1.0)
+    closest = start + t[..., np.newaxis] * direction
+    return np.linalg.norm(point - closest, axis=-1)
+
+
+def _cross(o: np.ndarray, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    return (a[..., 0] - o[..., 0]) * (b[..., 1] - o[..., 1]) - (a[..., 1] - o[..., 1]) * (b[..., 0] - o[..., 0])
+
+
+def _segments_intersect(a: np.ndarray, b: np.ndarray, c: np.ndarray, d: np.ndarray) -> np.ndarray:
+    # Touching segments have a distance of 0 anyway, so we only need proper intersections here
+    return ((_cross(a, b, c) * _cross(a, b, d) < 0) &
+            (_cross(c, d, a) * _cross(c, d, b) < 0))
+
+
+def _read_ways_xml(file_name: str,
+                   railway_values: Tuple[str, ...]) -> List[Tuple[int, Dict[str, str], List[Tuple[float, float]]]]:
+    # Pass 1: Find the rail ways and the nodes they need
+    ways: List[Tuple[int, Dict[str, str], List[int]]] = []
+    needed_nodes: Set[int] = set()
+    for element in iter_elements(file_name):
+        if element.tag == 'way':
+            tags = {tag.get('k'): tag.get('v') for tag in element.iter('tag')}
+            if tags.get('railway') in railway_values:
+                node_ids = [int(node.get('ref')) for node in element.iter('nd')]
+                ways.append((int(element.get('id')), tags, node_ids))
+                needed_nodes.update(node_ids)
+    # Pass 2: Get the locations of these nodes
+    node_locations: Dict[int, Tuple[float, float]] = {}
+    for element in iter_elements(file_name):
+        if element.tag == 'node':
+            node_id = int(element.get('id'))
+            if node_id in needed_nodes:
+                node_locations[node_id] = (float(element.get('lat')), float(element.get('lon')))
+    result = []
+    for way_id, tags, node_ids in ways:
+        # Nodes might be missing at the border of an extract
+        coordinates = [node_locations[node_id] for node_id in node_ids if node_id in node_locations]
+        result.append((way_id, tags, coordinates))
+    return result
+
+
+def _read_ways_pbf(file_name: str,
+                   railway_values: Tuple[str, ...]) -> List[Tuple[int, Dict[str, str], List[Tuple[float, float]]]]:
+    try:
+        import osmium
+    except ImportError as e:
+        raise ImportError("Für PBF-Dateien wird pyosmium benötigt (pip install osmium)") from e
+
+    class RailHandler(osmium.SimpleHandler):
+        def __init__(self):
+            super().__init__()
+            self.ways = []
+
+        def way(self, way):
+            if way.tags.get('railway') in railway_values:
+                coordinates = [(node.lat, node.lon) for node in way.nodes if node.location.valid()]
+                self.ways.append((way.id, {tag.k: tag.v for tag in way.tags}, coordinates))
+
+    handler = RailHandler()
+    handler.apply_file(file_name, locations=True)
+    return handler.ways
@@ -0,0 +1,46 @@
+from __future__ import annotations
+
+import asyncio
+import threading
+import time
+
+from tc_utils import profiling
+
+
+class TokenBucket:
+    """A rate limiter that allows bursts of up to capacity requests and rate requests per second on average.
+    It can be shared between threads and asyncio tasks."""
+    rate: float
+    capacity: float
+
+    def __init__(self, rate: float, capacity: float = 1.0):
+        assert rate > 0 and capacity >= 1
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self) -> float:
+        """Takes a token, even if it is not available yet.
+        returns: The time to wait until the token is available"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    def acquire(self):
+        waiting_time = self._reserve()
+        if waiting_time > 0:
+            with profiling.span('rate_limit.wait', 'network'):
+                time.sleep(waiting_time)
+
+    async def acquire_async(self):
+        waiting_time = self._reserve()
+        if waiting_time > 0:
+            with profiling.span('rate_limit.wait', 'network'):
+                await asyncio.sleep(waiting_time)
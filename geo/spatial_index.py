@@ -0,0 +1,189 @@
+from __future__ import annotations
+
+import itertools
+import math
+from typing import Generic, TypeVar, List, Dict, Tuple, Iterable, Any, TYPE_CHECKING
+
+import numpy as np
+
+import geo.distance
+from geo import Location, unproject_many
+
+if TYPE_CHECKING:
+    from structures import Station
+
+T = TypeVar('T')
+
+# We use a sphere here, the actual distances are computed on the ellipsoid later on
+_earth_radius_km = 6371.0
+# The difference between spherical and ellipsoidal distances is always below 0.5 %
+_sphere_tolerance = 0.99
+
+
+class SpatialIndex(Generic[T]):
+    """A grid index for nearest-neighbour and radius queries.
+    The points are projected onto a sphere in 3D space (in km) and then sorted into cubic cells,
+    which works everywhere on the world, in contrast to a 2D projection."""
+    items: List[T]
+    latitudes: np.ndarray
+    longitudes: np.ndarray
+    cell_size: float
+    _xyz: np.ndarray
+    _cells: Dict[Tuple[int, int, int], np.ndarray]
+    _cell_keys: np.ndarray
+
+    def __init__(self, items: List[T], latitudes: Iterable[float], longitudes: Iterable[float],
+                 cell_size: float = 5.0):
+        """cell_size is given in km; it should be roughly the radius of typical queries"""
+        self.items = items
+        self.latitudes = np.asarray(latitudes, dtype=float)
+        self.longitudes = np.asarray(longitudes, dtype=float)
+        assert len(self.items) == len(self.latitudes) == len(self.longitudes)
+        self.cell_size = cell_size
+        self._xyz = _to_xyz(self.latitudes, self.longitudes)
+        self._cells = {}
+        self._cell_keys = np.empty((0, 3), dtype=np.int64)
+        if len(self.items):
+            keys = np.floor(self._xyz / cell_size).astype(np.int64)
+            self._cell_keys, inverse = np.unique(keys, axis=0, return_inverse=True)
+            # Indices are sorted by cell, and within the cells by their original order
+            order = np.argsort(inverse.reshape(-1), kind='stable')
+            boundaries = np.cumsum(np.bincount(inverse.reshape(-1), minlength=len(self._cell_keys)))[:-1]
+            for key, indices in zip(self._cell_keys.tolist(), np.split(order, boundaries)):
+                self._cells[tuple(key)] = indices
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    @classmethod
+    def from_locations(cls, items: List[T], locations: Iterable[Location], cell_size: float = 5.0) -> SpatialIndex[T]:
+        locations = list(locations)
+        return cls(items,
+                   [location.latitude for location in locations],
+                   [location.longitude for location in locations],
+                   cell_size=cell_size)
+
+    @classmethod
+    def from_stations(cls, stations: Iterable[Station], cell_size: float = 5.0) -> SpatialIndex[Station]:
+        """Only the stations with a known location are added. The order of the stations is preserved."""
+        stations = [station for station in stations if station.location is not None]
+        return cls.from_locations(stations, (station.location for station in stations), cell_size=cell_size)
+
+    @classmethod
+    def from_tc_stations(cls, stations: List[Dict[str, Any]],
+                         cell_size: float = 5.0) -> SpatialIndex[Dict[str, Any]]:
+        """Creates an index for the (projected) stations of Station.json"""
+        stations_by_projection: Dict[int, List[Dict[str, Any]]] = {}
+        for station in stations:
+            stations_by_projection.setdefault(station.get('proj', 0), []).append(station)
+        items = []
+        latitudes = []
+        longitudes = []
+        for projection_version, stations_in_projection in stations_by_projection.items():
+            latitudes_projection, longitudes_projection = unproject_many(
+                [station['x'] for station in stations_in_projection],
+                [station['y'] for station in stations_in_projection],
+                version=projection_version
+            )
+            items.extend(stations_in_projection)
+            latitudes.append(latitudes_projection)
+            longitudes.append(longitudes_projection)
+        if not items:
+            return cls([], [], [], cell_size=cell_size)
+        return cls(items, np.concatenate(latitudes), np.concatenate(longitudes), cell_size=cell_size)
+
+    def within(self, location: Location, radius: float) -> List[T]:
+        """All items within radius km, sorted by their distance"""
+        indices, _ = self.within_indices(location.latitude, location.longitude, radius)
+        return [self.items[index] for index in indices]
+
+    def nearest(self, location: Location, k: int = 1) -> List[T]:
+        """The k nearest items, sorted by their distance"""
+        indices, _ = self.nearest_indices(location.latitude, location.longitude, k)
+        return [self.items[index] for index in indices]
+
+    def within_indices(self, latitude: float, longitude: float, radius: float) -> Tuple[np.ndarray, np.ndarray]:
+        """returns: The indices of all items within radius km and their distances, sorted by distance"""
+        query = _to_xyz_scalar(latitude, longitude)
+        candidates = self._candidates(query, radius / _sphere_tolerance)
+        if not candidates.size:
+            return candidates, np.empty(0)
+        distances = geo.distance.distances_to(latitude, longitude,
+                                              self.latitudes[candidates], self.longitudes[candidates])
+        selected = distances <= radius
+        candidates = candidates[selected]
+        distances = distances[selected]
+        order = np.argsort(distances, kind='stable')
+        return candidates[order], distances[order]
+
+    def nearest_indices(self, latitude: float, longitude: float, k: int = 1) -> Tuple[np.ndarray, np.ndarray]:
+        """returns: The indices of the k nearest items and their distances, sorted by distance"""
+        k = min(k, len(self.items))
+        if k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        query = _to_xyz_scalar(latitude, longitude)
+        search_radius = self.cell_size
+        while True:
+            candidates = self._candidates(query, search_radius)
+            if len(candidates) >= k or len(candidates) == len(self.items):
+                distances = geo.distance.distances_to(latitude, longitude,
+                                                      self.latitudes[candidates], self.longitudes[candidates])
+                order = np.argsort(distances, kind='stable')[:k]
+                # Everything within the search radius is guaranteed to be in the candidates,
+                # but there might be something closer just outside of it
+                if distances[order[-1]] <= search_radius * _sphere_tolerance or len(candidates) == len(self.items):
+                    return candidates[order], distances[order]
+            search_radius *= 2
+
+    def thin_out(self, min_distance: float) -> np.ndarray:
+        """Selects items (greedily, in their original order) so that no two selected items are closer
+        than min_distance km. Every item that is left out is closer than that to a selected one.
+        returns: A boolean mask of the selected items"""
+        selected = np.zeros(len(self.items), dtype=bool)
+        covered = np.zeros(len(self.items), dtype=bool)
+        for index, (latitude, longitude) in enumerate(zip(self.latitudes.tolist(), self.longitudes.tolist())):
+            if covered[index]:
+                continue
+            selected[index] = True
+            close_indices, distances = self.within_indices(latitude, longitude, min_distance)
+            covered[close_indices[distances < min_distance]] = True
+        return selected
+
+    def _candidates(self, query: Tuple[float, float, float], radius: float) -> np.ndarray:
+        """All indices in the cells that may contain points within the (chord) radius of query"""
+        # The chord is always shorter than the arc
+        lower = tuple(math.floor((coordinate - radius) / self.cell_size) for coordinate in query)
+        upper = tuple(math.floor((coordinate + radius) / self.cell_size) for coordinate in query)
+        num_cells = math.prod(high - low + 1 for low, high in zip(lower, upper))
+        if num_cells <= min(len(self._cells), 4096):
+            cells = (self._cells.get(key) for key in itertools.product(
+                *(range(low, high + 1) for low, high in zip(lower, upper))))
+            cells = [indices for indices in cells if indices is not None]
+        else:
+            # It's cheaper to look at all cells
+            in_range = np.all((self._cell_keys >= lower) & (self._cell_keys <= upper), axis=1)
+            cells = [self._cells[key] for key in map(tuple, self._cell_keys[in_range].tolist())]
+        if not cells:
+            return np.empty(0, dtype=np.int64)
+        if len(cells) == 1:
+            return cells[0]
+        return np.sort(np.concatenate(cells))
+
+
+def _to_xyz(latitudes: np.ndarray, longitudes: np.ndarray) -> np.ndarray:
+    latitudes = np.radians(latitudes)
+    longitudes = np.radians(longitudes)
+    return _earth_radius_km * np.stack((
+        np.cos(latitudes) * np.cos(longitudes),
+        np.cos(latitudes) * np.sin(longitudes),
+        np.sin(latitudes)
+    ), axis=-1).reshape(-1, 3)
+
+
+def _to_xyz_scalar(latitude: float, longitude: float) -> Tuple[float, float, float]:
+    # NumPy has a large overhead for single values
+    latitude = math.radians(latitude)
+    longitude = math.radians(longitude)
+    return (_earth_radius_km * math.cos(latitude) * math.cos(longitude),
+            _earth_radius_km * math.cos(latitude) * math.sin(longitude),
+            _earth_radius_km * math.sin(latitude))
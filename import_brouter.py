@@ -3,15 +3,23 @@
 from __future__ import annotations
 
 import argparse
+import logging
+from concurrent.futures import ThreadPoolExecutor
 from os import PathLike
-from typing import Tuple
+from typing import List, Tuple
 
-from cli_utils import check_files, add_default_cli_args, use_default_cli_args
+from cli_utils import check_files, add_default_cli_args, use_default_cli_args, expand_file_patterns
 from geo.location_data import add_location_data_to_list
+from geo.photon_advanced_reverse import shared_photon
+from geo.rail_index import RailIndex
+from geo.rate_limit import TokenBucket
 from importers.brouter_new import BrouterImporterNew
+from importers.checkpoints import Checkpoints, default_checkpoint_directory
 from structures import DataSet
 from structures.route import TcPath
+from structures.station import Station
 from tc_utils import TcFile
+from tc_utils.loading import Loader
 from tc_utils.paths import add_path_to_file
 from tc_utils.stations import add_stations_to_file
 
@@ -26,23 +34,109 @@ def import_gpx_into_tc(gpx: PathLike | str,
                        use_overpass: bool = True,
                        use_waypoint_location: bool = False,
                        raw_waypoint_prefix: str | None = None,
-                       check_country: bool = True
+                       check_country: bool = True,
+                       match_radius: float | None = None,
+                       photon_rate: float = 2.0,
+                       rail_index: PathLike | str | None = None,
+                       single_rail_query: bool = False,
+                       checkpoint_directory: PathLike | str | None = default_checkpoint_directory,
+                       restart: bool = False
                        ) -> Tuple[TcFile, TcFile]:
-    data_set = DataSet.load_data(data_directory)
-    importer = BrouterImporterNew(data_set.station_data, language=language, fallback_town=fallback_town,
-                                  path_tolerance=tolerance, use_overpass=use_overpass,
-                                  use_waypoint_locations=use_waypoint_location, prefix_raw=raw_waypoint_prefix,
-                                  raw=raw_waypoint_prefix is not None,
-                                  check_country=check_country)
-    stations, paths = importer.import_data(gpx)
+    station_json, path_json, _ = import_gpx_files_into_tc(
+        [gpx], tc_directory, data_directory, override_stations,
+        language=language, fallback_town=fallback_town, tolerance=tolerance, use_overpass=use_overpass,
+        use_waypoint_location=use_waypoint_location, raw_waypoint_prefix=raw_waypoint_prefix,
+        check_country=check_country, match_radius=match_radius, photon_rate=photon_rate, rail_index=rail_index,
+        single_rail_query=single_rail_query, checkpoint_directory=checkpoint_directory, restart=restart,
+        ignore_errors=False
+    )
+    return station_json, path_json
 
-    path = TcPath.merge(paths)
 
-    station_json = TcFile('Station', tc_directory)
-    path_json = TcFile('Path', tc_directory)
+def import_gpx_files_into_tc(gpx_files: List[PathLike | str],
+                             tc_directory: PathLike | str = '..',
+                             data_directory: PathLike | str = 'data',
+                             override_stations: bool = False,
+                             language: str | bool = False,
+                             fallback_town: bool = False,
+                             tolerance: float = 0.4,
+                             use_overpass: bool = True,
+                             use_waypoint_location: bool = False,
+                             raw_waypoint_prefix: str | None = None,
+                             check_country: bool = True,
+                             match_radius: float | None = None,
+                             photon_rate: float = 2.0,
+                             rail_index: PathLike | str | None = None,
+                             single_rail_query: bool = False,
+                             checkpoint_directory: PathLike | str | None = default_checkpoint_directory,
+                             restart: bool = False,
+                             workers: int = 4,
+                             ignore_errors: bool = True
+                             ) -> Tuple[TcFile, TcFile, List[str]]:
+    """Imports multiple routes with one data set. Up to workers routes are imported concurrently,
+    sharing the rate limits of Photon and Overpass, but they are added to the files in the given order.
+    Each route is imported as if it were the only one, except that stations are only added once.
+    ignore_errors: If a route can't be imported, continue with the others (otherwise, the error is raised)
+    returns: The station and path file (which have not been saved yet) and the files that could not be imported"""
+    # Station.json and Path.json are loaded while the DataSet is built (and the rail index is loaded)
+    with Loader(tc_directory, ('Station', 'Path'), data_directory) as loader:
+        data_set = loader.data_set
+        if rail_index is not None:
+            rail_index = RailIndex.load(str(rail_index))
+        station_json = loader.tc_file('Station')
+        path_json = loader.tc_file('Path')
+    station_index = data_set.station_index if match_radius is not None else None
+    # All imports and the location data for their stations share the rate limit
+    photon_limiter = TokenBucket(rate=photon_rate)
+    shared_photon().rate_limiter = photon_limiter
+
+    def import_file(gpx: str) -> Tuple[BrouterImporterNew, List[Station], List[TcPath]]:
+        # New stations are added to the station list, which must not affect the other routes
+        importer = BrouterImporterNew(list(data_set.station_data), language=language, fallback_town=fallback_town,
+                                      path_tolerance=tolerance, use_overpass=use_overpass,
+                                      use_waypoint_locations=use_waypoint_location, prefix_raw=raw_waypoint_prefix,
+                                      raw=raw_waypoint_prefix is not None,
+                                      check_country=check_country,
+                                      station_match_radius=match_radius,
+                                      station_index=station_index,
+                                      photon_limiter=photon_limiter,
+                                      rail_index=rail_index,
+                                      single_rail_query=single_rail_query,
+                                      checkpoint_directory=str(checkpoint_directory) if checkpoint_directory else None)
+        if restart:
+            Checkpoints.for_file(gpx, importer.checkpoint_parameters(), importer.checkpoint_directory).clear()
+        stations, paths = importer.import_data(gpx)
+        return importer, stations, paths
+
+    failed = []
+
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(gpx_files)))) as executor:
+        imports = [executor.submit(import_file, str(gpx)) for gpx in gpx_files]
+        for gpx, route_import in zip(gpx_files, imports):
+            try:
+                importer, stations, paths = route_import.result()
+                add_route_to_tc_files(stations, paths, data_set, station_json, path_json, override_stations)
+            except Exception as e:
+                if not ignore_errors:
+                    for other_import in imports:
+                        other_import.cancel()
+                    raise
+                logging.error(f"Konnte {gpx} nicht importieren", exc_info=e)
+                failed.append(str(gpx))
+                continue
+            # The import is complete, so it doesn't need to be resumed anymore
+            importer.checkpoints.clear()
+            logging.info(f"{gpx}: {len(stations)} Stationen, {len(paths)} Abschnitte")
+
+    return station_json, path_json, failed
+
+
+def add_route_to_tc_files(stations: List[Station], paths: List[TcPath], data_set: DataSet,
+                          station_json: TcFile, path_json: TcFile, override_stations: bool = False):
+    path = TcPath.merge(paths)
 
     # Add location data, if necessary
-    add_location_data_to_list(stations)
+    add_location_data_to_list(stations, gazetteer=data_set.gazetteer)
 
     add_stations_to_file(stations, station_json, override_stations=override_stations)
 
@@ -52,15 +146,14 @@ def import_gpx_into_tc(gpx: PathLike | str,
 
     add_path_to_file(path, path_json, clean=True)
 
-    return station_json, path_json
-
 
 if __name__ == '__main__':
 
     parser = argparse.ArgumentParser(description='Importiere neue Routen von brouter.de in TrainCompany')
-    parser.add_argument('brouter', metavar='GPX', type=str,
-                        help="Die aus brouter MIT WAYPOINTS exportierte GPX-Datei")
-    add_default_cli_args(parser)
+    parser.add_argument('brouter', metavar='GPX', type=str, nargs='+',
+                        help="Die aus brouter MIT WAYPOINTS exportierten GPX-Dateien "
+                             "(auch Verzeichnisse oder Muster wie routen/*.gpx)")
+    add_default_cli_args(parser, online_services=True)
     parser.add_argument('--stations_only', action='store_true', help="Fügt nur Stationen ein")
     parser.add_argument('--override_stations', action='store_true',
                         help="Überschreibt Haltestellen, bzw. fügt spezifischere hinzu")
@@ -79,13 +172,32 @@ if __name__ == '__main__':
                         help="Fügt nicht existierende Stationen mit dem Präfix hinzu (nur für Fähren empfohlen)")
     parser.add_argument("--no-check-country", action="store_true",
                         help="Prüft beim Abgleich mit den Datensätzen nicht, ob das Land übereinstimmt")
+    parser.add_argument("--match-radius", type=float,
+                        help="Ordnet Wegpunkte direkt der nächsten bekannten Haltestelle in diesem Umkreis (in km) zu, "
+                             "ohne Photon zu fragen")
+    parser.add_argument("--photon-rate", type=float, default=2.0,
+                        help="Wie viele Anfragen pro Sekunde höchstens an Photon geschickt werden")
+    parser.add_argument("--rail-index", metavar="DATEI",
+                        help="Verwendet den mit build_rail_index.py erstellten Index statt der Overpass-API")
+    parser.add_argument("--single-query", action="store_true",
+                        help="Fragt die Strecken für die gesamte Route nur einmal bei der Overpass-API ab")
+    parser.add_argument("--no-checkpoints", action="store_true",
+                        help="Speichert keine Zwischenstände, um einen abgebrochenen Import fortzusetzen")
+    parser.add_argument("--restart", action="store_true",
+                        help="Verwirft die Zwischenstände eines früheren Imports und beginnt von vorne")
+    parser.add_argument("--workers", type=int, default=4,
+                        help="Wie viele Routen gleichzeitig importiert werden")
     args = parser.parse_args()
     use_default_cli_args(args)
 
     check_files(args.tc_directory, args.data_directory)
 
-    path_json, station_json = import_gpx_into_tc(
-        args.brouter,
+    gpx_files = expand_file_patterns(args.brouter, '.gpx')
+    if not gpx_files:
+        exit(1)
+
+    station_json, path_json, failed_files = import_gpx_files_into_tc(
+        gpx_files,
         args.tc_directory,
         args.data_directory,
         args.override_stations,
@@ -95,9 +207,22 @@ if __name__ == '__main__':
         use_overpass=not args.no_overpass,
         use_waypoint_location=args.waypoint_location,
         raw_waypoint_prefix=args.raw_waypoints,
-        check_country=not args.no_check_country
+        check_country=not args.no_check_country,
+        match_radius=args.match_radius,
+        photon_rate=args.photon_rate,
+        rail_index=args.rail_index,
+        single_rail_query=args.single_query,
+        checkpoint_directory=None if args.no_checkpoints else default_checkpoint_directory,
+        restart=args.restart,
+        workers=args.workers,
+        # A single file should fail loudly, like before
+        ignore_errors=len(gpx_files) > 1
     )
 
     station_json.save()
     if not args.stations_only:
         path_json.save()
+    if failed_files:
+        logging.error(f"{len(failed_files)} von {len(gpx_files)} Dateien konnten nicht importiert werden "
+                      f"(der Import kann fortgesetzt werden): {', '.join(failed_files)}")
+        exit(1)
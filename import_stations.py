@@ -18,6 +18,7 @@ from structures import DataSet
 from structures.country import split_country, CountryRepresentation, iso_3166_to_country, tld_to_country
 from structures.station import iter_stations_by_codes_reverse, Station
 from tc_utils import TcFile
+from tc_utils.loading import Loader
 from tc_utils.stations import add_stations_to_file
 
 
@@ -41,7 +42,7 @@ def import_stations_into_tc(station_codes: List[str],
     stations = [code_to_station[code.upper() if not case_sensitive else code] for code in
                 station_codes]
 
-    add_location_data_to_list(stations, use_google=use_google)
+    add_location_data_to_list(stations, use_google=use_google, gazetteer=data_set.gazetteer)
 
     for station in stations:
         if not station.platform_count or not station.platform_length and station.group != 4:
@@ -121,7 +122,7 @@ def create_gpx(stations: List[Station], tc_directory: PathLike | str = '..'):
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Importiere neue Betriebsstellen in TrainCompany')
-    add_default_cli_args(parser)
+    add_default_cli_args(parser, online_services=True)
     add_station_cli_args(parser,
                          help="Die (RIL100-)Codes der Haltestellen, die hinzugefügt werden sollen",
                          help_countries="Die Länder, deren Haltestellen hinzugefügt werden sollen",
@@ -148,9 +149,11 @@ if __name__ == '__main__':
     use_default_cli_args(args)
 
     check_files(args.tc_directory, args.data_directory)
-    stations = parse_station_args(args, required=True, inplace=False)
-    station_json = TcFile("Station", args.tc_directory)
-    data_set = DataSet.load_data(args.data_directory)
+    with Loader(args.tc_directory, ('Station',), args.data_directory) as loader:
+        data_set = loader.data_set
+        # Stations merged with --stations A=B are imported with the data of both
+        stations = parse_station_args(args, data_set=data_set, required=True, inplace=False)
+        station_json = loader.tc_file('Station')
     for station_codes in stations:
         station_json = import_stations_into_tc(**args.__dict__, data_set=data_set, station_json=station_json,
                                                station_codes=station_codes)
@@ -7,15 +7,16 @@ import logging
 import os.path
 import pathlib
 from os import PathLike
-from typing import Tuple
+from typing import List, Tuple
 
-from cli_utils import check_files, add_default_cli_args, use_default_cli_args
+from cli_utils import check_files, add_default_cli_args, use_default_cli_args, expand_file_patterns
 from geo.location_data import add_location_data_to_list
 from import_brouter import import_gpx_into_tc
 from importers.db_trassenfinder import DbTrassenfinderImporter, convert_waypoints_to_route
 from structures import DataSet
 from structures.route import TcRoute
 from tc_utils import TcFile
+from tc_utils.loading import Loader
 from tc_utils.paths import add_route_to_files
 
 
@@ -32,30 +33,70 @@ def import_trasse_into_tc(trasse: PathLike | str,
             import_gpx_into_tc(trasse, tc_directory, data_directory, override_stations, add_annotation)
         except Exception as e:
             logging.error("Fehlgeschlagen.  Versuche als Trassenfinder-Export.", exc_info=e)
-    data_set = DataSet.load_data(data_directory)
-    waypoints = DbTrassenfinderImporter().import_data(trasse)
+    station_json, path_json, _ = import_trassen_into_tc([trasse], tc_directory, data_directory, override_stations,
+                                                        add_annotation=add_annotation, use_google=use_google,
+                                                        ignore_errors=False)
+    return station_json, path_json
+
+
+def import_trassen_into_tc(trassen: List[PathLike | str],
+                           tc_directory: PathLike | str = '..',
+                           data_directory: PathLike | str = 'data',
+                           override_stations: bool = False,
+                           add_annotation: bool = False,
+                           use_google: bool = False,
+                           ignore_errors: bool = True
+                           ) -> Tuple[TcFile, TcFile, List[str]]:
+    """Imports multiple routes with one data set, in the given order.
+    ignore_errors: If a route can't be imported, continue with the others (otherwise, the error is raised)
+    returns: The station and path file (which have not been saved yet) and the files that could not be imported"""
+    # The files are independent of each other, so they are loaded at the same time
+    with Loader(tc_directory, ('Station', 'Path'), data_directory) as loader:
+        station_json = loader.tc_file('Station')
+        path_json = loader.tc_file('Path')
+        data_set = loader.data_set
+    failed = []
+
+    for trasse in trassen:
+        try:
+            add_trasse_to_tc_files(trasse, data_set, station_json, path_json,
+                                   override_stations=override_stations,
+                                   add_annotation=add_annotation,
+                                   use_google=use_google)
+        except Exception as e:
+            if not ignore_errors:
+                raise
+            logging.error(f"Konnte {trasse} nicht importieren", exc_info=e)
+            failed.append(str(trasse))
 
-    station_json = TcFile('Station', tc_directory)
-    path_json = TcFile('Path', tc_directory)
+    return station_json, path_json, failed
 
-    route = convert_waypoints_to_route(waypoints, data_set.station_data, data_set.path_data)
+
+def add_trasse_to_tc_files(trasse: PathLike | str, data_set: DataSet, station_json: TcFile, path_json: TcFile,
+                           override_stations: bool = False,
+                           add_annotation: bool = False,
+                           use_google: bool = False):
+    waypoints = DbTrassenfinderImporter().import_data(trasse)
+
+    route = convert_waypoints_to_route(waypoints, data_set.station_data, data_set.path_data,
+                                       track_index=data_set.track_index,
+                                       codes_to_station=data_set.codes_to_stations)
     tc_route = TcRoute.from_route(route, data_set.station_data, add_annotations=add_annotation)
 
     # Add location data from Google, if necessary
-    add_location_data_to_list(tc_route.stations, use_google=use_google)
+    add_location_data_to_list(tc_route.stations, use_google=use_google, gazetteer=data_set.gazetteer)
 
     add_route_to_files(tc_route, station_json, path_json,
                        override_stations=override_stations)
 
-    return station_json, path_json
-
 
 if __name__ == '__main__':
 
     parser = argparse.ArgumentParser(description='Importiere neue Routen vom Trassenfinder in TrainCompany')
-    parser.add_argument('trasse', metavar='TRASSENFINDER_DATEI', type=str,
-                        help="Die CSV-Datei, die aus Trassenfinder exportiert wurde")
-    add_default_cli_args(parser)
+    parser.add_argument('trasse', metavar='TRASSENFINDER_DATEI', type=str, nargs='+',
+                        help="Die CSV-Dateien, die aus Trassenfinder exportiert wurden "
+                             "(auch Verzeichnisse oder Muster wie trassen/*.csv)")
+    add_default_cli_args(parser, online_services=True)
     parser.add_argument('--stations_only', action='store_true', help="Fügt nur Stationen ein")
     parser.add_argument('--override_stations', action='store_true',
                         help="Überschreibt Haltestellen, bzw. fügt spezifischere hinzu")
@@ -68,14 +109,24 @@ if __name__ == '__main__':
 
     check_files(args.tc_directory, args.data_directory)
 
-    path_json, station_json = import_trasse_into_tc(
-        args.trasse,
+    trassen = expand_file_patterns(args.trasse, '.csv')
+    if not trassen:
+        exit(1)
+
+    station_json, path_json, failed_files = import_trassen_into_tc(
+        trassen,
         args.tc_directory,
         args.data_directory,
         args.override_stations,
-        add_annotation=args.annotate
+        add_annotation=args.annotate,
+        # A single file should fail loudly, like before
+        ignore_errors=len(trassen) > 1
     )
 
     station_json.save()
     if not args.stations_only:
         path_json.save()
+    if failed_files:
+        logging.error(f"{len(failed_files)} von {len(trassen)} Dateien konnten nicht importiert werden: "
+                      f"{', '.join(failed_files)}")
+        exit(1)
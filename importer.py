@@ -6,6 +6,8 @@ import logging
 from abc import ABCMeta, abstractmethod
 from typing import TypeVar, Generic, List, Optional, Any, TextIO, Generator, Iterator
 
+from tc_utils import profiling
+
 T = TypeVar('T')
 
 
@@ -31,7 +33,8 @@ class CsvImporter(Importer[T], metaclass=ABCMeta):
 
     def import_data(self, file_name: str) -> List[T]:
         try:
-            with open(file_name, encoding=self.encoding) as csv_file:
+            with profiling.span(f"{type(self).__name__}.import_data", 'import'), \
+                    open(file_name, encoding=self.encoding) as csv_file:
                 reader = csv.reader(csv_file, delimiter=self.delimiter)
                 if self.skip_first_line:
                     first_line = reader.__next__()
@@ -74,7 +77,8 @@ class JsonImporter(Importer[T], metaclass=ABCMeta):
         pass
 
     def import_data(self, file_name: str) -> List[T]:
-        with open(file_name, encoding=self.encoding) as json_file:
+        with profiling.span(f"{type(self).__name__}.import_data", 'import'), \
+                open(file_name, encoding=self.encoding) as json_file:
             content = json.load(json_file)
             for entry in self.top_level_entry:
                 content = content[entry]
@@ -96,7 +100,8 @@ class WikipediaImporter(Importer[T], metaclass=ABCMeta):
         pass
 
     def import_data(self, file_name: str) -> List[T]:
-        with open(file_name, encoding="utf-8") as input_file:
+        with profiling.span(f"{type(self).__name__}.import_data", 'import'), \
+                open(file_name, encoding="utf-8") as input_file:
             entries = self.iter_table_entries(input_file)
             # We might want to discard a table header
             if self.skip_first_entry:
@@ -2,10 +2,12 @@ import logging
 from dataclasses import dataclass
 from typing import List, Optional, Tuple, Dict, Set
 
-import geopy.distance
-import gpxpy
+import numpy as np
 
 from geo import Location
+from geo.distance import distances_to, lat_lon_arrays
+from geo.gpx import read_gpx
+from geo.spatial_index import SpatialIndex
 from importer import Importer
 from structures.route import CodeWaypoint
 from structures.station import Station
@@ -13,34 +15,39 @@ from structures.station import Station
 
 class BrouterImporter(Importer[CodeWaypoint]):
     stations: List[Station]
+    station_index: SpatialIndex[Station]
 
-    def __init__(self, station_data: List[Station]):
+    def __init__(self, station_data: List[Station], station_index: Optional[SpatialIndex[Station]] = None):
         self.stations = station_data
+        self.station_index = station_index if station_index is not None else SpatialIndex.from_stations(station_data)
 
     def import_data(self, file_name: str) -> List[CodeWaypoint]:
-        with open(file_name, encoding='utf-8') as input_file:
-            gpx = gpxpy.parse(input_file)
+        gpx = read_gpx(file_name)
         waypoint_locations = [(waypoint, Location(
             longitude=waypoint.longitude,
             latitude=waypoint.latitude)) for waypoint in gpx.waypoints]
         stops: List[Station] = [None for _ in range(len(waypoint_locations))]
         # First, we need to figure out the codes for the waypoints
-        for station in self.stations:
-            for index, waypoint, location in enumerate(waypoint_locations):
-                if station.location.distance(location) < 0.08:
-                    if stops[index]:
-                        logging.warning("Multiple stations in the same location: {}, {}".format(
-                            stops[index].codes[0],
-                            station.codes[0]
-                        ))
-                    else:
-                        stops[index] = station
+        for index, (waypoint, location) in enumerate(waypoint_locations):
+            # The stations are indexed in their original order
+            close_stations, _ = self.station_index.within_indices(location.latitude, location.longitude, 0.08)
+            for station_index in np.sort(close_stations):
+                station = self.station_index.items[station_index]
+                if stops[index]:
+                    logging.warning("Multiple stations in the same location: {}, {}".format(
+                        stops[index].codes[0],
+                        station.codes[0]
+                    ))
+                else:
+                    stops[index] = station
+        stops = [stop for stop in stops if stop is not None]
+        stop_latitudes, stop_longitudes = lat_lon_arrays((stop.location for stop in stops))
 
         # Now we go through the file, accumulate distances and create the new waypoints
         distance_total = 0
         code_waypoints = []
         last_location: Optional[Location] = None
-        for trackpoint in gpx.tracks[0].segments[0].points:
+        for trackpoint in gpx.points:
             location = Location(
                 latitude=trackpoint.latitude,
                 longitude=trackpoint.longitude
@@ -48,13 +55,13 @@ class BrouterImporter(Importer[CodeWaypoint]):
             if last_location:
                 distance_total += location.distance(last_location)
             # Check if we have a stop here
-            for stop in stops:
-                if stop.location.distance(location) < 0.08:
-                    # We have a stop here - add the CodeWaypoint
-                    code_waypoints.append(CodeWaypoint(
-                        code=stop.codes[0],
-                        distance_from_start=distance_total,
-                        is_stop=True,
-                        next_route_number=0
-                    ))
+            stop_distances = distances_to(location.latitude, location.longitude, stop_latitudes, stop_longitudes)
+            for stop_index in np.flatnonzero(stop_distances < 0.08):
+                # We have a stop here - add the CodeWaypoint
+                code_waypoints.append(CodeWaypoint(
+                    code=stops[stop_index].codes[0],
+                    distance_from_start=distance_total,
+                    is_stop=True,
+                    next_route_number=0
+                ))
         return code_waypoints
@@ -1,28 +1,32 @@
 from __future__ import annotations
 
-import itertools
+import dataclasses
+import heapq
 import logging
 import random
-import re
 from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, Future
 from functools import lru_cache
 
 import statistics
-from time import sleep
 from typing import List, Tuple, Dict, Any, Callable
 
 import geopy.distance
-import gpxpy
-import unidecode
+import numpy as np
 from geopy.extra.rate_limiter import RateLimiter
-from gpxpy.gpx import GPXTrackPoint, GPXWaypoint
-from networkx.utils import pairwise
 
 import geo
 from geo import Location, overpass
+from geo.distance import distances_to, distance, path_length, lat_lon_arrays
+from geo.gazetteer import normalize_name
+from geo.gpx import GpxData, TrackPoint, TrackPoints, read_gpx
+from geo.spatial_index import SpatialIndex
 from geo.overpass import query_rail_around_gpx, request_overpass, douglas_peucker, create_query, \
     query_stations_around_gpx
-from geo.photon_advanced_reverse import PhotonAdvancedReverse
+from geo.rail_index import RailIndex, query_rail_index_around_gpx
+from geo.photon_advanced_reverse import PhotonAdvancedReverse, shared_photon
+from geo.rate_limit import TokenBucket
+from importers.checkpoints import Checkpoints
 from structures.country import countries
 from structures.route import TcPath, TrackKind, sinousity_to_twisting_factor
 from structures.station import Station, CodeTuple, Platform
@@ -41,6 +45,17 @@ class BrouterImporterNew:
     raw: bool
     prefix_raw: str
     check_country: bool = True
+    station_match_radius: float | None
+    station_index: SpatialIndex[Station] | None
+    photon_rate: float
+    photon_limiter: TokenBucket
+    photon_workers: int
+    rail_index: RailIndex | None
+    single_rail_query: bool
+    checkpoint_directory: str | None
+    # The checkpoints of the last import
+    checkpoints: Checkpoints | None
+    raw_stations: int
 
     def __init__(self, station_data: List[Station],
                  language: str | bool = False,
@@ -52,7 +67,23 @@ class BrouterImporterNew:
                  use_waypoint_locations: bool = True,
                  raw: bool = False,
                  prefix_raw: str = "STATION",
-                 check_country: bool = True):
+                 check_country: bool = True,
+                 station_match_radius: float | None = None,
+                 station_index: SpatialIndex[Station] | None = None,
+                 photon_rate: float = 2.0,
+                 photon_limiter: TokenBucket | None = None,
+                 photon_workers: int = 4,
+                 rail_index: RailIndex | None = None,
+                 single_rail_query: bool = False,
+                 checkpoint_directory: str | None = None):
+        """station_match_radius: If given, waypoints are matched to the closest (unused) station of the data set
+        within this radius (in km) without asking Photon first
+        photon_rate: The maximum number of Photon requests per second
+        photon_limiter: A rate limiter that is shared with other importers (photon_rate is ignored then)
+        photon_workers: The maximum number of concurrent Photon requests
+        rail_index: If given, it is used instead of the Overpass API for the rail data
+        single_rail_query: Fetch the rail data for the whole route at once and assign it to the segments locally
+        checkpoint_directory: If given, the results of the stages of an import are saved there (see import_data)"""
         self.stations = station_data
         self.name_to_station = {normalize_name(station.name): station
                                 for station in station_data}
@@ -66,273 +97,409 @@ class BrouterImporterNew:
         self.raw = raw
         self.prefix_raw = prefix_raw
         self.check_country = check_country
+        self.station_match_radius = station_match_radius
+        if station_index is None and station_match_radius is not None:
+            station_index = SpatialIndex.from_stations(station_data)
+        self.station_index = station_index
+        self.photon_rate = photon_rate
+        self.photon_limiter = photon_limiter if photon_limiter is not None else TokenBucket(rate=photon_rate)
+        self.photon_workers = photon_workers
+        self.rail_index = rail_index
+        self.single_rail_query = single_rail_query
+        self.checkpoint_directory = checkpoint_directory
+        self.checkpoints = None
+        self.raw_stations = 1
 
     def import_data(self, file_name: str) -> Tuple[List[Station], List[TcPath]]:
-        with open(file_name, encoding='utf-8') as input_file:
-            gpx = gpxpy.parse(input_file)
-
-        # Step 1: Find the OSM railway stations for all waypoints
-        geolocator = PhotonAdvancedReverse()
-        reverse = RateLimiter(geolocator.reverse, min_delay_seconds=0.5, max_retries=3)
-
-        max_distance_waypoint_to_track = 0.08
-
-        if not gpx.waypoints:
-            gpx.waypoints = self.collect_waypoints_from_trackpoints(gpx.tracks[0].segments[0].points,
-                                                                    8)
-            max_distance_waypoint_to_track = self.path_tolerance
-            sleep(10)
-
-        waypoint_location_to_station_location = self.collect_waypoint_stations(gpx.waypoints, reverse)
-
-        path_segments, stops = self.collect_path_segments(gpx.tracks[0].segments[0].points,
-                                                          waypoint_location_to_station_location,
-                                                          max_distance_waypoint_to_track)
-
-        if self.use_overpass:
+        """If checkpoint_directory is set, the result of every stage is saved,
+        so another run with the same file and parameters continues after the last completed stage."""
+        self.checkpoints = Checkpoints.for_file(file_name, self.checkpoint_parameters(), self.checkpoint_directory)
+        # The file is only read if one of the stages needs it
+        gpx: Callable[[], GpxData] = lru_cache(maxsize=None)(lambda: read_gpx(file_name))
+
+        # Step 1: Use the waypoints or find the stations along the track
+        waypoints, max_distance_waypoint_to_track = self.checkpoints.run(
+            'waypoints', lambda: self._collect_waypoints(gpx()))
+
+        # Step 2: Find the OSM railway stations for all waypoints
+        resolved: List[bool] = []
+
+        def resolve_waypoint_stations() -> Tuple[Dict[Location, Station], List[Station]]:
+            resolved.append(True)
+            return self._resolve_waypoint_stations(waypoints)
+
+        waypoint_location_to_station_location, new_stations = self.checkpoints.run('stations',
+                                                                                   resolve_waypoint_stations)
+        if not resolved:
+            # The stations have been loaded, so they still need to be added to the data set
+            self.stations.extend(new_stations)
+
+        # Step 3: Split the track at the stops
+        path_segments, stops = self.checkpoints.run(
+            'segments', lambda: self.collect_path_segments(gpx().points,
+                                                           waypoint_location_to_station_location,
+                                                           max_distance_waypoint_to_track))
+
+        # Step 4: Get the rail data for the segments
+        overpass_responses = self.checkpoints.run('rail', lambda: self._query_rail_data(path_segments))
+
+        # Step 5: Create the paths
+        paths = self.checkpoints.run('paths', lambda: [
+            tc_path_from_gpx(start, segment, end, overpass_response=overpass_response)
+            for (start, segment, end), overpass_response in zip(path_segments, overpass_responses)
+        ])
+        return stops, paths
+
+    def checkpoint_parameters(self) -> Dict[str, Any]:
+        """All parameters that change the results of the stages"""
+        return {
+            'language': self.language,
+            'fallback_town': self.fallback_town,
+            'fail_on_unknown': self.fail_on_unknown,
+            'path_tolerance': self.path_tolerance,
+            'use_overpass': self.use_overpass,
+            'get_platform_data': self.get_platform_data,
+            'use_waypoint_locations': self.use_waypoint_locations,
+            'raw': self.raw,
+            'prefix_raw': self.prefix_raw,
+            'check_country': self.check_country,
+            'station_match_radius': self.station_match_radius,
+            'rail_index': self.rail_index.fingerprint if self.rail_index is not None else None,
+            'single_rail_query': self.single_rail_query
+        }
+
+    def _collect_waypoints(self, gpx: GpxData) -> Tuple[TrackPoints, float]:
+        """returns: The waypoints and how far the track may be from them"""
+        if len(gpx.waypoints):
+            return gpx.waypoints, 0.08
+        return self.collect_waypoints_from_trackpoints(gpx.points), self.path_tolerance
+
+    def _resolve_waypoint_stations(self, waypoints: TrackPoints) -> Tuple[Dict[Location, Station], List[Station]]:
+        """returns: The stations for the waypoints and the stations that have been added to the data set"""
+        # The geocoder itself limits the rate of requests, so cached responses are returned immediately
+        geolocator = PhotonAdvancedReverse(rate_limiter=self.photon_limiter, timeout=10)
+        reverse = RateLimiter(geolocator.reverse, min_delay_seconds=0, max_retries=3)
+        geocode = RateLimiter(geolocator.geocode, min_delay_seconds=0, max_retries=3)
+
+        number_of_stations = len(self.stations)
+        waypoint_location_to_station_location = self.collect_waypoint_stations(waypoints, reverse, geocode)
+        return waypoint_location_to_station_location, self.stations[number_of_stations:]
+
+    def _query_rail_data(self, path_segments: List[Tuple[Station, TrackPoints, Station]]) \
+            -> List[List[Dict[str, Any]] | None]:
+        rail_index = self.rail_index
+        if rail_index is None and self.use_overpass and self.single_rail_query:
+            route = TrackPoints.concatenate(segment for _, segment, _ in path_segments)
+            rail_index = query_rail_index_around_gpx(min(0.001, self.path_tolerance - 0.02), route)
+
+        if rail_index is not None:
+            return [rail_index.query_around_gpx(min(0.001, self.path_tolerance - 0.02), segment)
+                    for _, segment, _ in path_segments]
+        elif self.use_overpass:
             overpass_queries = [query_rail_around_gpx(min(0.001, self.path_tolerance - 0.02), segment)
                                 for _, segment, _ in path_segments]
-            overpass_responses = overpass.query_multiple(overpass_queries)
+            return overpass.query_multiple(overpass_queries)
         else:
-            overpass_responses = itertools.repeat(None)
-
-        return stops, [tc_path_from_gpx(start, segment, end, overpass_response=overpass_response)
-                       for (start, segment, end), overpass_response in zip(path_segments, overpass_responses)]
+            return [None] * len(path_segments)
 
     @staticmethod
-    def collect_path_segments(points: List[GPXTrackPoint],
+    def collect_path_segments(points: TrackPoints,
                               waypoint_location_to_station_location: Dict[Location, Station],
                               max_distance: float = 0.08) \
-            -> Tuple[List[Tuple[Station, List[GPXTrackPoint], Station]], List[Station]]:
-        # Now we go through the trackpoints and add stations and segments
-        path_segments: List[Tuple[Station, List[GPXTrackPoint], Station]] = []
+            -> Tuple[List[Tuple[Station, TrackPoints, Station]], List[Station]]:
+        waypoint_locations = list(waypoint_location_to_station_location.keys())
+        # For every waypoint, the trackpoints (in track order) that are close enough to be its stop
+        track_index = SpatialIndex(range(len(points)), points.latitudes, points.longitudes, cell_size=max_distance)
+        close_trackpoints: List[List[int]] = []
+        for waypoint_location in waypoint_locations:
+            close_indices, distances = track_index.within_indices(waypoint_location.latitude,
+                                                                  waypoint_location.longitude,
+                                                                  max_distance)
+            close_trackpoints.append(np.sort(close_indices[distances < max_distance]).tolist())
+
+        # Now we go through the stops and add stations and segments
+        path_segments: List[Tuple[Station, TrackPoints, Station]] = []
         # Collect the visited stations here
         stops: List[Station] = []
         # The index in the track segment where the last stop was located
         last_stop_index: int = 0
         last_stop: Station | None = None
-        for index, trackpoint in enumerate(points):
-            location = Location(
-                latitude=trackpoint.latitude,
-                longitude=trackpoint.longitude
-            )
-            # Check if this trackpoint is a stop
-            for waypoint_location, stop in waypoint_location_to_station_location.items():
-                if waypoint_location.distance_float(location) < max_distance:
-                    # We have a stop here, add it to the list
-                    path_segments.append((last_stop, points[last_stop_index:index], stop))
-                    last_stop_index = index
-                    last_stop = stop
-                    stops.append(stop)
-                    # We don't want to match the stop multiple times
-                    waypoint_location_to_station_location.pop(waypoint_location)
-                    break
+        for index, waypoint_number in first_close_trackpoints(close_trackpoints):
+            stop = waypoint_location_to_station_location[waypoint_locations[waypoint_number]]
+            path_segments.append((last_stop, points[last_stop_index:index], stop))
+            last_stop_index = index
+            last_stop = stop
+            stops.append(stop)
         # The first entry is garbage
         path_segments.pop(0)
         assert path_segments
 
         return path_segments, stops
 
-    def collect_waypoints_from_trackpoints(self, points: List[GPXTrackPoint],
-                                           min_distance_between_station: float = 2.0) -> List[GPXWaypoint]:
+    def collect_waypoints_from_trackpoints(self, points: TrackPoints,
+                                           min_distance_between_station: float = 2.0) -> TrackPoints:
         query = query_stations_around_gpx(self.path_tolerance, points)
         query = create_query(query, out="skel")
         logging.debug(f"Stations query: {query}")
-        response = request_overpass(query)
-        waypoints = []
-        for node in response:
-            latitude = node["lat"]
-            longitude = node["lon"]
-            waypoints.append(GPXWaypoint(latitude=latitude, longitude=longitude))
+        # The next Overpass request has to wait a bit longer after this one
+        response = request_overpass(query, sleep_time=10)
+        waypoints = TrackPoints(np.array([node["lat"] for node in response], dtype=float),
+                                np.array([node["lon"] for node in response], dtype=float))
         logging.info(f"Found {len(waypoints)} stations")
-        # TODO: Use the min_distance_between_stations for cleanup
+        # Large stations often consist of multiple nodes, which would all be looked up separately
+        station_index = SpatialIndex(range(len(waypoints)), waypoints.latitudes, waypoints.longitudes,
+                                     cell_size=min_distance_between_station)
+        waypoints = waypoints[station_index.thin_out(min_distance_between_station)]
+        logging.info(f"Removed {len(station_index) - len(waypoints)} stations closer than "
+                     f"{min_distance_between_station} km to another one, {len(waypoints)} Photon lookups remaining")
         return waypoints
 
-    def collect_waypoint_stations(self, waypoints: List[GPXWaypoint],
-                                  geocode_reverse) -> Dict[Location, Station]:
+    def collect_waypoint_stations(self, waypoints: TrackPoints,
+                                  geocode_reverse,
+                                  geocode=None) -> Dict[Location, Station]:
+        """The Photon requests are sent concurrently (the geocoder has to do the rate limiting),
+        but the results are matched in the order of the waypoints, so the result is deterministic."""
         # It may be possible that the waypoint has a different location to its station
         waypoint_location_to_station_location = {}
 
-        raw_stations = 1
-        for waypoint in waypoints:
-            # Find stations close to the given waypoint location
-            possible_stations: List[geopy.location.Location] | None = geocode_reverse(
-                geopy.Point(latitude=waypoint.latitude, longitude=waypoint.longitude),
-                exactly_one=False,
-                limit=6,
-                query_string_filter='+'.join(["osm_value:stop", "osm_value:station", "osm_value:halt"]),
-                language=self.language,
-                timeout=10
-            )
-            if possible_stations is None:
-                if self.fallback_town:
-                    logging_fn = logging.info
-                else:
-                    logging_fn = logging.error
-
-                logging_fn(f"No station found for location (lat={waypoint.latitude}, lon={waypoint.longitude})")
-                logging.debug("On G/M: https://maps.google.com/maps/@{},{},17z/data=!3m1!1e3".format(
-                    waypoint.latitude,
-                    waypoint.longitude
-                ))
-                logging.debug("On OSM: https://openstreetmap.org/#map=17/{}/{}&layers=T".format(
-                    waypoint.latitude,
-                    waypoint.longitude
-                ))
+        self.raw_stations = 1
+        with ThreadPoolExecutor(max_workers=self.photon_workers) as executor:
+            try:
+                # Waypoints that might be matched to a known station are only looked up when that fails
+                lookups: Dict[int, Future] = {
+                    index: executor.submit(self.lookup_possible_stations, waypoint, geocode_reverse)
+                    for index, waypoint in enumerate(waypoints) if not self.may_have_known_station(waypoint)
+                }
+                waypoint_stations: List[Tuple[TrackPoint, Future]] = []
+                for index, waypoint in enumerate(waypoints):
+                    station = self.find_known_station(waypoint)
+                    if station is None:
+                        if index not in lookups:
+                            lookups[index] = executor.submit(self.lookup_possible_stations, waypoint, geocode_reverse)
+                        possible_stations = lookups.pop(index).result()
+                        if possible_stations is None:
+                            continue
+                        station = self.station_from_possible_stations(waypoint, possible_stations)
 
-                if self.fallback_town:
-                    # Now we will try to look for a nearby town/city/village instead
-                    possible_stations = geocode_reverse(
-                        geopy.Point(latitude=waypoint.latitude, longitude=waypoint.longitude),
-                        exactly_one=False,
-                        limit=6,
-                        query_string_filter='+'.join(["osm_value:city", "osm_value:town", "osm_value:borough",
-                                                      "osm_value:hamlet", "osm_value:village",
-                                                      "osm_value:municipality"]),
-                        language=self.language,
-                        timeout=10
-                    )
-                    if possible_stations is None:
-                        logging.error(
-                            f"No station or town found for location (lat={waypoint.latitude}, lon={waypoint.longitude})")
-                        logging.info("On G/M: https://maps.google.com/maps/@{},{},17z/data=!3m1!1e3".format(
-                            waypoint.latitude,
-                            waypoint.longitude
-                        ))
-                        logging.info("On OSM: https://openstreetmap.org/#map=17/{}/{}&layers=T".format(
-                            waypoint.latitude,
-                            waypoint.longitude
-                        ))
-                        if self.fail_on_unknown:
-                            raise ValueError("Unknown station")
-                        else:
-                            logging.error("Ignoring station")
-                        continue
-                else:
-                    if self.raw:
-                        possible_stations = [
-                            geopy.Location(
-                                address="",
-                                point=geopy.Point(
-                                    latitude=waypoint.latitude,
-                                    longitude=waypoint.longitude
-                                ),
-                                raw={
-                                    "properties": {
-                                        "name": "Unbekannte Haltestelle",
-                                        "osm_value": "NOTHING",
-                                        "countrycode": "UN",
-                                        "osm_id": random.randint(0, 1_000_000_000)
-                                    }
-                                }
-                            )
-                        ]
+                    # The platform data is requested while the next waypoints are matched
+                    if station.platform_length == 0 and self.get_platform_data and not station.country.iso_3166 == "UN":
+                        station_future = executor.submit(with_osm_platform_data, station, geocode)
                     else:
-                        if self.fail_on_unknown:
-                            raise ValueError("Unknown station")
-                        else:
-                            logging.error("Ignoring station")
-                        continue
+                        station_future = Future()
+                        station_future.set_result(station)
+                    waypoint_stations.append((waypoint, station_future))
+
+                for waypoint, station_future in waypoint_stations:
+                    station = station_future.result()
+                    # Add to the data set (it should propagate to the original data set as well)
+                    self.stations.append(station)
+                    # We do not want to add it to the lookup table to ensure that we only have unique stations
+
+                    waypoint_location_to_station_location[Location(longitude=waypoint.longitude,
+                                                                   latitude=waypoint.latitude)] = station
+            except BaseException:
+                # E.g., an unknown station with fail_on_unknown: Don't wait for all queued (rate limited) lookups
+                executor.shutdown(wait=False, cancel_futures=True)
+                raise
+        return waypoint_location_to_station_location
 
-            for possible_station in possible_stations:
-                if 'name' not in possible_station.raw['properties']:
-                    logging.info("Station ohne Namen: {}".format(possible_station.raw))
-
-            possible_station_names = ((normalize_name(station.raw['properties']['name']),
-                                       station)
-                                      for station in possible_stations if 'name' in station.raw['properties'])
-            possible_station_groups = [group_from_photon_response(station.raw['properties']) for station in
-                                       possible_stations]
-            # Is one of these names in our data set?
-            for name, possible_station in possible_station_names:
-                if name in self.name_to_station:
-                    station = self.name_to_station[name]
-                    countrycode = possible_station.raw["properties"].get("countrycode", None)
-                    state = possible_station.raw["properties"].get("state", None)
-                    # We might want to assert that the station we are associating here actually is in the right country
-                    if countrycode is not None and self.check_country:
-                        country = station.country
-                        if countrycode.upper() != country.iso_3166:
-                            # Wrong country
-                            continue
-                    if state is not None:
-                        if len(state) != 2:
-                            logging.warning(f"Ausgeschriebener Sub-Staat: {state}")
-                        elif station.state and state.upper() != station.state.upper():
-                            # Wrong state (if applicable
-                            continue
-                    # Check that the station is not too far from the waypoint
-                    if station.location is not None:
-                        if geopy.distance.geodesic(station.point, possible_station.point).km > 2.0:
-                            continue
-                    # Remove it from the lookup table to prevent having the same station twice
-                    self.name_to_station.pop(name)
-                    # Add this location if necessary
-                    if station.location is None or station.group == -1 or self.use_waypoint_locations:
-                        station_dict = station.__dict__
-                        station_dict.pop("country", None)
-                        station_dict.pop("point", None)
-                        station_dict.pop("platform_length", None)
-                        station_dict.pop("platform_count", None)
-                        if station.location is None or self.use_waypoint_locations:
-                            station_dict["location"] = Location(
+    def may_have_known_station(self, waypoint: TrackPoint) -> bool:
+        if self.station_match_radius is None:
+            return False
+        close_stations, _ = self.station_index.within_indices(waypoint.latitude, waypoint.longitude,
+                                                              self.station_match_radius)
+        return close_stations.size > 0
+
+    def find_known_station(self, waypoint: TrackPoint) -> Station | None:
+        """Looks for a station from the data set close to the waypoint, without asking Photon."""
+        if self.station_match_radius is None:
+            return None
+        waypoint_location = Location(latitude=waypoint.latitude, longitude=waypoint.longitude)
+        for station in self.station_index.within(waypoint_location, self.station_match_radius):
+            name = normalize_name(station.name)
+            # Only use stations that have not been used yet
+            if self.name_to_station.get(name) is not station:
+                continue
+            self.name_to_station.pop(name)
+            if self.use_waypoint_locations:
+                station = dataclasses.replace(station, location=waypoint_location)
+            logging.debug(f"Bekannte Station in der Nähe: {station.name}")
+            return station
+        return None
+
+    def lookup_possible_stations(self, waypoint: TrackPoint,
+                                 geocode_reverse) -> List[geopy.location.Location] | None:
+        """Asks Photon for the stations (or towns) close to the waypoint. This is safe to be called concurrently.
+        returns: The possible stations or None if the waypoint should be ignored"""
+        # Find stations close to the given waypoint location
+        possible_stations: List[geopy.location.Location] | None = geocode_reverse(
+            geopy.Point(latitude=waypoint.latitude, longitude=waypoint.longitude),
+            exactly_one=False,
+            limit=6,
+            query_string_filter='+'.join(["osm_value:stop", "osm_value:station", "osm_value:halt"]),
+            language=self.language,
+            timeout=10
+        )
+        if possible_stations is None:
+            if self.fallback_town:
+                logging_fn = logging.info
+            else:
+                logging_fn = logging.error
+
+            logging_fn(f"No station found for location (lat={waypoint.latitude}, lon={waypoint.longitude})")
+            logging.debug("On G/M: https://maps.google.com/maps/@{},{},17z/data=!3m1!1e3".format(
+                waypoint.latitude,
+                waypoint.longitude
+            ))
+            logging.debug("On OSM: https://openstreetmap.org/#map=17/{}/{}&layers=T".format(
+                waypoint.latitude,
+                waypoint.longitude
+            ))
+
+            if self.fallback_town:
+                # Now we will try to look for a nearby town/city/village instead
+                possible_stations = geocode_reverse(
+                    geopy.Point(latitude=waypoint.latitude, longitude=waypoint.longitude),
+                    exactly_one=False,
+                    limit=6,
+                    query_string_filter='+'.join(["osm_value:city", "osm_value:town", "osm_value:borough",
+                                                  "osm_value:hamlet", "osm_value:village",
+                                                  "osm_value:municipality"]),
+                    language=self.language,
+                    timeout=10
+                )
+                if possible_stations is None:
+                    logging.error(
+                        f"No station or town found for location (lat={waypoint.latitude}, lon={waypoint.longitude})")
+                    logging.info("On G/M: https://maps.google.com/maps/@{},{},17z/data=!3m1!1e3".format(
+                        waypoint.latitude,
+                        waypoint.longitude
+                    ))
+                    logging.info("On OSM: https://openstreetmap.org/#map=17/{}/{}&layers=T".format(
+                        waypoint.latitude,
+                        waypoint.longitude
+                    ))
+                    if self.fail_on_unknown:
+                        raise ValueError("Unknown station")
+                    else:
+                        logging.error("Ignoring station")
+                    return None
+            else:
+                if self.raw:
+                    possible_stations = [
+                        geopy.Location(
+                            address="",
+                            point=geopy.Point(
                                 latitude=waypoint.latitude,
                                 longitude=waypoint.longitude
-                            )
-                        if station.group == -1:
-                            station_dict["_group"] = largest_group(possible_station_groups)
-                        station = Station(**station_dict)
-                    break
-            else:
-                logging.info("Couldn't find any of these stations: {}. Creating new one.".format(
-                    [station.raw['properties']['name'] for station in possible_stations if
-                     'name' in station.raw['properties']]
-                ))
-                # We create a new station because we can't find an existing one
-                new_station = possible_stations[0]
-                new_station_properties = possible_stations[0].raw['properties']
-
-                country = countries[new_station_properties['countrycode']]
-                # The new codes use the osm_id - Flag + O (for OpenStreetMaps) + osm_id
-                # We (ab)use the United Nations as a placeholder for completely made up stations
-                if country.iso_3166 != "UN":
-                    code = f"{country.flag}O{new_station_properties['osm_id']}"
+                            ),
+                            raw={
+                                "properties": {
+                                    "name": "Unbekannte Haltestelle",
+                                    "osm_value": "NOTHING",
+                                    "countrycode": "UN",
+                                    "osm_id": random.randint(0, 1_000_000_000)
+                                }
+                            }
+                        )
+                    ]
                 else:
-                    code = f"{country.flag}{self.prefix_raw}{raw_stations}"
-                    raw_stations += 1
-                # It might be longer than the limit...
-                assert len(bytes(code, "utf-8")) <= 20
-
-                # Assemble the station with all data we have
-                station = Station(
-                    name=new_station_properties['name'],
-                    codes=CodeTuple(code),
-                    # 69 is not a UIC country code
-                    number=int("69" + str(new_station_properties['osm_id'])),
-                    location=geo.Location(
-                        latitude=new_station.latitude,
-                        longitude=new_station.longitude
-                    ),
-                    _group=largest_group(possible_station_groups)
-                )
-
-                logging.debug(f"New station: {station}")
-
-            if station.platform_length == 0 and self.get_platform_data and not station.country.iso_3166 == "UN":
-                station = with_osm_platform_data(station)
-
-            # Add to the data set (it should propagate to the original data set as well)
-            self.stations.append(station)
-            # We do not want to add it to the lookup table to ensure that we only have unique stations
+                    if self.fail_on_unknown:
+                        raise ValueError("Unknown station")
+                    else:
+                        logging.error("Ignoring station")
+                    return None
+        return possible_stations
+
+    def station_from_possible_stations(self, waypoint: TrackPoint,
+                                       possible_stations: List[geopy.location.Location]) -> Station:
+        """Finds the station from the data set for the Photon results or creates a new one"""
+        for possible_station in possible_stations:
+            if 'name' not in possible_station.raw['properties']:
+                logging.info("Station ohne Namen: {}".format(possible_station.raw))
+
+        possible_station_names = ((normalize_name(station.raw['properties']['name']),
+                                   station)
+                                  for station in possible_stations if 'name' in station.raw['properties'])
+        possible_station_groups = [group_from_photon_response(station.raw['properties']) for station in
+                                   possible_stations]
+        # Is one of these names in our data set?
+        for name, possible_station in possible_station_names:
+            if name in self.name_to_station:
+                station = self.name_to_station[name]
+                countrycode = possible_station.raw["properties"].get("countrycode", None)
+                state = possible_station.raw["properties"].get("state", None)
+                # We might want to assert that the station we are associating here actually is in the right country
+                if countrycode is not None and self.check_country:
+                    country = station.country
+                    if countrycode.upper() != country.iso_3166:
+                        # Wrong country
+                        continue
+                if state is not None:
+                    if len(state) != 2:
+                        logging.warning(f"Ausgeschriebener Sub-Staat: {state}")
+                    elif station.state and state.upper() != station.state.upper():
+                        # Wrong state (if applicable
+                        continue
+                # Check that the station is not too far from the waypoint
+                if station.location is not None:
+                    if geopy.distance.geodesic(station.point, possible_station.point).km > 2.0:
+                        continue
+                # Remove it from the lookup table to prevent having the same station twice
+                self.name_to_station.pop(name)
+                # Add this location if necessary
+                if station.location is None or station.group == -1 or self.use_waypoint_locations:
+                    changes = {}
+                    if station.location is None or self.use_waypoint_locations:
+                        changes["location"] = Location(
+                            latitude=waypoint.latitude,
+                            longitude=waypoint.longitude
+                        )
+                    if station.group == -1:
+                        changes["_group"] = largest_group(possible_station_groups)
+                    # The station is shared with the data set (and the other routes), so it is copied
+                    station = dataclasses.replace(station, **changes)
+                break
+        else:
+            logging.info("Couldn't find any of these stations: {}. Creating new one.".format(
+                [station.raw['properties']['name'] for station in possible_stations if
+                 'name' in station.raw['properties']]
+            ))
+            # We create a new station because we can't find an existing one
+            new_station = possible_stations[0]
+            new_station_properties = possible_stations[0].raw['properties']
+
+            country = countries[new_station_properties['countrycode']]
+            # The new codes use the osm_id - Flag + O (for OpenStreetMaps) + osm_id
+            # We (ab)use the United Nations as a placeholder for completely made up stations
+            if country.iso_3166 != "UN":
+                code = f"{country.flag}O{new_station_properties['osm_id']}"
+            else:
+                code = f"{country.flag}{self.prefix_raw}{self.raw_stations}"
+                self.raw_stations += 1
+            # It might be longer than the limit...
+            assert len(bytes(code, "utf-8")) <= 20
+
+            # Assemble the station with all data we have
+            station = Station(
+                name=new_station_properties['name'],
+                codes=CodeTuple(code),
+                # 69 is not a UIC country code
+                number=int("69" + str(new_station_properties['osm_id'])),
+                location=geo.Location(
+                    latitude=new_station.latitude,
+                    longitude=new_station.longitude
+                ),
+                _group=largest_group(possible_station_groups)
+            )
 
-            waypoint_location_to_station_location[Location(longitude=waypoint.longitude,
-                                                           latitude=waypoint.latitude)] = station
-        return waypoint_location_to_station_location
+            logging.debug(f"New station: {station}")
+        return station
 
 
-def with_osm_platform_data(station: Station) -> Station:
-    geolocator = geopy.Photon(timeout=10)
-    geocode = RateLimiter(geolocator.geocode, min_delay_seconds=0.5, max_retries=3)
+def with_osm_platform_data(station: Station, geocode=None) -> Station:
+    if geocode is None:
+        geocode = RateLimiter(shared_photon().geocode, min_delay_seconds=0, max_retries=3)
     station_location = geopy.Point(latitude=station.location.latitude,
                                    longitude=station.location.longitude)
     platforms: List[geopy.Location] | None = geocode(station.name, location_bias=station_location,
@@ -340,48 +507,23 @@ def with_osm_platform_data(station: Station) -> Station:
                                                      exactly_one=False, limit=20)
     station_platforms = []
     if platforms:
-        for platform in platforms:
-            if geopy.distance.geodesic(platform.point, station_location).kilometers > 0.8:
+        platform_distances = distances_to(station.location.latitude, station.location.longitude,
+                                          *lat_lon_arrays(platforms))
+        for platform, platform_distance in zip(platforms, platform_distances):
+            if platform_distance > 0.8:
                 continue
             platform = platform.raw["properties"]
             if "extent" in platform and len(platform["extent"]) in (4, 8):
                 if len(platform["extent"]) == 4:
                     # We have a platform with a line shape
                     longitude_a, latitude_a, longitude_b, latitude_b = platform["extent"]
-                    point_a = geopy.Point(
-                        latitude=latitude_a,
-                        longitude=longitude_a
-                    )
-                    point_b = geopy.Point(
-                        latitude=latitude_b,
-                        longitude=longitude_b
-                    )
-                    length = geopy.distance.geodesic(point_a, point_b).meters
+                    length = float(distance(latitude_a, longitude_a, latitude_b, longitude_b)) * 1000
                 elif len(platform["extent"]) == 8:
-                    # It's a rectangle (or similar)
-                    lon_a, lat_a, lon_b, lat_b, lon_c, lat_c, lon_d, lat_d = platform["extent"]
-                    point_a = geopy.Point(
-                        latitude=lat_a,
-                        longitude=lon_a
-                    )
-                    point_b = geopy.Point(
-                        latitude=lat_b,
-                        longitude=lon_b
-                    )
-                    point_c = geopy.Point(
-                        latitude=lat_c,
-                        longitude=lon_c
-                    )
-                    point_d = geopy.Point(
-                        latitude=lat_d,
-                        longitude=lon_d
-                    )
-                    length = max(geopy.distance.geodesic(point_start, point_end) for point_start, point_end in (
-                        (point_a, point_b),
-                        (point_b, point_c),
-                        (point_c, point_d),
-                        (point_d, point_a)
-                    )).meters
+                    # It's a rectangle (or similar), so we take its longest side
+                    longitudes = np.array(platform["extent"][0::2], dtype=float)
+                    latitudes = np.array(platform["extent"][1::2], dtype=float)
+                    length = float(distance(latitudes, longitudes,
+                                            np.roll(latitudes, -1), np.roll(longitudes, -1)).max()) * 1000
                 else:
                     raise ValueError("But that is unpossible!")
                 if station_platforms:
@@ -397,17 +539,11 @@ def with_osm_platform_data(station: Station) -> Station:
             else:
                 logging.debug("Bahnsteig ohne Größe gefunden bei {}".format(station))
         if station_platforms:
-            station_dict = station.__dict__
-            station_dict.pop("platform_length", 0)
-            station_dict.pop("platform_count", 0)
-            station_dict.pop("group", 0)
-            station_dict.pop("country", None)
-            station_dict.pop("point", None)
-            if not station_dict["platforms"]:
-                station_dict["platforms"] = station_platforms
-            else:
-                station_dict["_platform_length"] = max((platform.length for platform in station_platforms))
-            return Station(**station_dict)
+            # The station may be shared with the data set, so it is copied
+            if not station.platforms:
+                return dataclasses.replace(station, platforms=station_platforms)
+            return dataclasses.replace(station,
+                                       _platform_length=max((platform.length for platform in station_platforms)))
     logging.debug("Keine Bahnsteige gefunden für {}".format(station))
     return station
 
@@ -464,11 +600,33 @@ def get_group_from_overpass(overpass_tags: Dict[str, Any]) -> int | None:
         return 0
 
 
-def tc_path_from_gpx(start: Station, segment: List[GPXTrackPoint], end: Station,
+def first_close_trackpoints(close_trackpoints: List[List[int]]) -> List[Tuple[int, int]]:
+    """Assigns every waypoint to the first trackpoint that is close to it.
+    A trackpoint can only be the stop of one waypoint. If it is close to multiple waypoints,
+    the first one of them gets it and the others have to use one of their later trackpoints.
+    close_trackpoints: The sorted indices of the close trackpoints for every waypoint
+    returns: (trackpoint index, waypoint number) in track order"""
+    heap = [(indices[0], waypoint_number, 0)
+            for waypoint_number, indices in enumerate(close_trackpoints) if indices]
+    heapq.heapify(heap)
+    stops = []
+    last_trackpoint = -1
+    while heap:
+        trackpoint, waypoint_number, position = heapq.heappop(heap)
+        if trackpoint == last_trackpoint:
+            # This trackpoint is already taken, so we try the next close one
+            position += 1
+            if position < len(close_trackpoints[waypoint_number]):
+                heapq.heappush(heap, (close_trackpoints[waypoint_number][position], waypoint_number, position))
+            continue
+        stops.append((trackpoint, waypoint_number))
+        last_trackpoint = trackpoint
+    return stops
+
+
+def tc_path_from_gpx(start: Station, segment: TrackPoints, end: Station,
                      overpass_response: List[Dict[str, Any]] | None = None) -> TcPath:
-    length = sum((geopy.distance.geodesic(
-        (last_trackpoint.latitude, last_trackpoint.longitude),
-        (trackpoint.latitude, trackpoint.longitude)).km for last_trackpoint, trackpoint in pairwise(segment)))
+    length = path_length(*lat_lon_arrays(segment))
 
     if overpass_response is None:
         overpass_response = []
@@ -531,25 +689,9 @@ def tc_path_from_gpx(start: Station, segment: List[GPXTrackPoint], end: Station,
     )
 
 
-def simplify_path_with_stops(path: List[Tuple[Station, List[GPXTrackPoint], Station]], max_radius: float):
+def simplify_path_with_stops(path: List[Tuple[Station, TrackPoints, Station]], max_radius: float):
     for index, (start, segment, end) in enumerate(path):
-        path[index] = (start, list(douglas_peucker(segment, max_radius)), end)
-
-
-delimiters = re.compile(r"[- _]", flags=re.IGNORECASE)
-omitted_tokens = re.compile(r"[.']", flags=re.IGNORECASE)
-more_than_one_space = re.compile(r"\s\s+")
-
-
-@lru_cache
-def normalize_name(name: str) -> str:
-    name = name.lower()
-    name = unidecode.unidecode(name)
-    name = delimiters.sub(" ", name)
-    name = omitted_tokens.sub("", name)
-    name = more_than_one_space.sub(" ", name)
-    name = name.replace("saint", "st")
-    return name
+        path[index] = (start, douglas_peucker(segment, max_radius), end)
 
 
 def group_from_photon_response(response: Dict[str, Any]) -> int | None:
@@ -0,0 +1,83 @@
+"""Checkpoints for long-running imports.
+Every stage of an import stores its result in a pickle file, so a failed run (e.g., because the Overpass API
+refused a request) can be resumed without repeating the stages that have already been completed."""
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import pickle
+import shutil
+from typing import Any, Callable, Dict, Optional, TypeVar
+
+from tc_utils import profiling
+
+default_checkpoint_directory = os.path.join(os.path.expanduser('~'), '.cache', 'traincompany-tools', 'checkpoints')
+
+T = TypeVar('T')
+
+
+class Checkpoints:
+    """The results of the stages of one import. If directory is None, nothing is stored"""
+    directory: Optional[str]
+
+    def __init__(self, directory: Optional[str]):
+        self.directory = directory
+
+    @staticmethod
+    def for_file(file_name: str, parameters: Dict[str, Any],
+                 base_directory: Optional[str] = default_checkpoint_directory) -> Checkpoints:
+        """The checkpoints are specific to the content of the file and the parameters of the import"""
+        if base_directory is None:
+            return Checkpoints(None)
+        return Checkpoints(os.path.join(base_directory, checkpoint_key(file_name, parameters)))
+
+    def _path(self, stage: str) -> str:
+        return os.path.join(self.directory, f"{stage}.pickle")
+
+    def has(self, stage: str) -> bool:
+        return self.directory is not None and os.path.isfile(self._path(stage))
+
+    def load(self, stage: str) -> Any:
+        with open(self._path(stage), 'rb') as checkpoint_file:
+            return pickle.load(checkpoint_file)
+
+    def save(self, stage: str, value: Any):
+        if self.directory is None:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        # Write to a temporary file first, so an interrupted run can't leave a broken checkpoint
+        temporary_path = self._path(stage) + '.tmp'
+        with open(temporary_path, 'wb') as checkpoint_file:
+            pickle.dump(value, checkpoint_file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary_path, self._path(stage))
+
+    def run(self, stage: str, function: Callable[[], T]) -> T:
+        """Loads the result of the stage if it has been completed before, otherwise runs and saves it"""
+        if self.has(stage):
+            try:
+                with profiling.span(f"checkpoint.load({stage})", 'import'):
+                    value = self.load(stage)
+                logging.info(f"Zwischenstand für {stage} geladen ({self.directory})")
+                return value
+            except (OSError, pickle.UnpicklingError, EOFError, AttributeError) as e:
+                logging.warning(f"Konnte den Zwischenstand für {stage} nicht laden: {e}")
+        with profiling.span(f"import.{stage}", 'import'):
+            value = function()
+        self.save(stage, value)
+        return value
+
+    def clear(self):
+        if self.directory is not None:
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def checkpoint_key(file_name: str, parameters: Dict[str, Any]) -> str:
+    file_hash = hashlib.sha256()
+    with open(file_name, 'rb') as input_file:
+        for chunk in iter(lambda: input_file.read(1 << 20), b''):
+            file_hash.update(chunk)
+    parameters_hash = hashlib.sha256(json.dumps(parameters, sort_keys=True, default=str).encode('utf-8'))
+    name = os.path.splitext(os.path.basename(file_name))[0]
+    return f"{name}-{file_hash.hexdigest()[:16]}-{parameters_hash.hexdigest()[:8]}"
@@ -2,11 +2,12 @@ import re
 from typing import List, Tuple, Optional
 
 from importer import CsvImporter
-from structures.route import Track, TrackKind
-from structures.station import StreckenKilometer
+from structures.route import TrackKind
+from structures.track_store import TrackRow, km_from_str
 
 
-class DbStreckenImporter(CsvImporter[Track]):
+class DbStreckenImporter(CsvImporter[TrackRow]):
+    """Imports the tracks as rows for TrackStore, so no objects are created for the (many) tracks"""
     def __init__(self):
         super().__init__(
             delimiter=',',
@@ -14,19 +15,22 @@ class DbStreckenImporter(CsvImporter[Track]):
             skip_first_line=False
         )
 
-    def deserialize(self, entry: List[str]) -> Optional[Track]:
+    def deserialize(self, entry: List[str]) -> Optional[TrackRow]:
+        # Don't add Gegengleis
+        if int(entry[2]) == 2:
+            return None
         v_max = convert_min_max_speed(entry[10])[1]
-        track = Track(
-            route_number=int(entry[1]),
-            length=float(entry[3]),
-            electrified=entry[8] != 'nicht elektrifiziert',
-            kind=TrackKind.from_speed_category(v_max, entry[13]),
-            # Make we can sort the tracks later on
-            from_km=min(StreckenKilometer.from_str(entry[6]), StreckenKilometer.from_str(entry[7])),
-            to_km=max(StreckenKilometer.from_str(entry[7]), StreckenKilometer.from_str(entry[7]))
+        # Make we can sort the tracks later on
+        from_km = min(km_from_str(entry[6]), km_from_str(entry[7]))
+        to_km = km_from_str(entry[7])
+        return (
+            int(entry[1]),
+            *from_km,
+            *to_km,
+            entry[8] != 'nicht elektrifiziert',
+            TrackKind.from_speed_category(v_max, entry[13]).value,
+            float(entry[3])
         )
-        # Don't add Gegengleis
-        return track if int(entry[2]) != 2 else None
 
 
 speed_re = re.compile(r"(ab (\d+) )?bis (\d+) km/h")
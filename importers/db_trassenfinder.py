@@ -1,7 +1,6 @@
 from __future__ import annotations
 
 import logging
-import statistics
 
 from typing import List, Optional, Dict
 
@@ -9,6 +8,7 @@ from importer import CsvImporter
 from structures import Station
 from structures.route import CodeWaypoint, Route, Track, TrackKind, Path
 from structures.station import iter_stations_by_codes_reverse, StreckenKilometer
+from structures.track_index import TrackIndex, RouteTrackIndex
 
 
 class DbTrassenfinderImporter(CsvImporter[CodeWaypoint]):
@@ -42,7 +42,7 @@ def invalid_track(route_number: int) -> Track:
 def track_from_path(route_number: int,
                     last_known_segment: Optional[Track],
                     to_km: Optional[StreckenKilometer],
-                    path_data: Dict[int, Path],
+                    track_index: TrackIndex,
                     code_start: Optional[str] = None,
                     code_end: Optional[str] = None) -> Track:
     warning = []
@@ -55,13 +55,13 @@ def track_from_path(route_number: int,
         warning.append("    Übernehme Daten zu Elektrifizierung, Streckenklasse vom letzten Segment"
                        .format(code_start, code_end))
     # Generate a median segment for the route number
-    if not last_known_segment and route_number in path_data or last_known_segment.route_number != route_number:
+    if not last_known_segment and route_number in track_index or last_known_segment.route_number != route_number:
         warning.append("    Kein letztes Streckensegment bekannt. Verwende Median der Gesamtstrecke")
         last_known_segment = Track(
             route_number=route_number,
-            electrified=statistics.median_high((track.electrified for track in path_data[route_number].tracks)),
+            electrified=track_index[route_number].median_electrified,
             length=0,
-            kind=statistics.median_high((track.kind for track in path_data[route_number].tracks)),
+            kind=track_index[route_number].median_kind,
             from_km=None,
             to_km=None
         )
@@ -76,12 +76,23 @@ def track_from_path(route_number: int,
     )
 
 
+def route_km(station: Station, route_number: int) -> Optional[StreckenKilometer]:
+    """returns: The kilometer of the station on the route, if known"""
+    return next((location.lfd_km for location in station.locations_path if location.route_number == route_number),
+                None)
+
+
 def convert_waypoints_to_route(waypoints: List[CodeWaypoint],
                                station_data: List[Station],
-                               path_data: List[Path]) -> Route:
+                               path_data: List[Path],
+                               track_index: Optional[TrackIndex] = None,
+                               codes_to_station: Optional[Dict[str, Station]] = None) -> Route:
+    """track_index, codes_to_station: Can be passed from the DataSet, so they don't need to be created again"""
     from structures.station import CodeTuple
-    codes_to_station = {code: station for code, station in iter_stations_by_codes_reverse(station_data)}
-    route_number_to_path = {path.route_numer: path for path in path_data}
+    if codes_to_station is None:
+        codes_to_station = {code: station for code, station in iter_stations_by_codes_reverse(station_data)}
+    if track_index is None:
+        track_index = TrackIndex(path_data)
     tracks_used = []
     for (waypoint, next_waypoint) in zip(waypoints, waypoints[1:]):
         tracks_between_waypoints = []
@@ -99,31 +110,24 @@ def convert_waypoints_to_route(waypoints: List[CodeWaypoint],
             next_station = Station(
                 codes=CodeTuple(next_waypoint.code)
             )
-        if waypoint.next_route_number and waypoint.next_route_number in route_number_to_path:
+        if waypoint.next_route_number and waypoint.next_route_number in track_index:
             if station.locations_path and next_station.locations_path:
-                path_used: Path = route_number_to_path[waypoint.next_route_number]
+                route_tracks: RouteTrackIndex = track_index[waypoint.next_route_number]
                 # Now we need to get the segments, i.e. we need to figure out what tracks/segments are used
-                station_km = [location.lfd_km for location in station.locations_path
-                              if location.route_number == waypoint.next_route_number]
-                next_station_km = [location.lfd_km for location in next_station.locations_path
-                                   if location.route_number == waypoint.next_route_number]
-                if station_km and next_station_km:
-                    station_km = station_km[0]
-                    next_station_km = next_station_km[0]
+                station_km = route_km(station, waypoint.next_route_number)
+                next_station_km = route_km(next_station, waypoint.next_route_number)
+                if station_km is not None and next_station_km is not None:
                     km_start = min(station_km, next_station_km)
                     km_end = max(station_km, next_station_km)
-                    for track in path_used.tracks:
-                        if track.from_km <= km_start <= track.to_km or track.from_km <= km_end <= track.to_km:
-                            tracks_between_waypoints.append(track)
+                    tracks_between_waypoints.extend(route_tracks.tracks_at_either(km_start, km_end))
                     assert tracks_between_waypoints
                 else:
-                    next_station_km = next_station_km[0] if next_station_km else None
                     last_known_segment = tracks_between_waypoints[-1] if tracks_between_waypoints else None
                     tracks_between_waypoints.append(track_from_path(
                         waypoint.next_route_number,
                         last_known_segment,
                         next_station_km,
-                        route_number_to_path,
+                        track_index,
                         code_start=waypoint.code,
                         code_end=next_waypoint.code
                     ))
@@ -134,7 +138,7 @@ def convert_waypoints_to_route(waypoints: List[CodeWaypoint],
                     waypoint.next_route_number,
                     last_known_segment,
                     None,
-                    route_number_to_path,
+                    track_index,
                     code_start=waypoint.code,
                     code_end=next_waypoint.code
                 ))
@@ -6,19 +6,16 @@ import argparse
 import itertools
 from typing import List, Tuple, Dict, Any, Optional
 
-import matplotlib.pyplot as plt
 import json
 import os
 
 from cli_utils import add_default_cli_args, process_station_input, add_station_cli_args, parse_station_args, \
     use_default_cli_args
 from geo import default_projection_version
-from project_coordinates import project_coordinate_for_station
+from project_coordinates import project_coordinates_for_stations
 from structures import DataSet
 from structures.country import split_country, CountryRepresentation
 from tc_utils import TcFile
-from validation import get_shortest_path
-from validation.graph import graph_from_files
 
 
 def get_routes_plot_data(station_data: List[dict], path_data: List[dict],
@@ -81,10 +78,12 @@ def plot_map(tc_directory: os.PathLike | str = '..',
              data_directory: Optional[os.PathLike | str] = None,
              add_text: bool = True,
              add_paths: bool = True):
+    # matplotlib takes long to import, so only when a map is actually plotted
+    import matplotlib.pyplot as plt
+
     station_json = TcFile('Station', tc_directory)
     path_json = TcFile('Path', tc_directory)
-    for station in station_json.data:
-        project_coordinate_for_station(station, new_projection=projection_version)
+    project_coordinates_for_stations(station_json.data, new_projection=projection_version)
 
     if highlight_path is not None:
         assert data_directory is not None
@@ -125,6 +124,8 @@ def plot_map(tc_directory: os.PathLike | str = '..',
     plt.rcParams['figure.figsize'] = (6.4 * scale_x, 4.8 * scale_y)
 
     if highlight_path is not None:
+        from validation import get_shortest_path
+        from validation.graph import graph_from_files
         graph = graph_from_files(station_json, path_json)
         highlight_path = get_shortest_path(graph, highlight_path)
 
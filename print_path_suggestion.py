@@ -3,8 +3,12 @@
 from __future__ import annotations
 
 import argparse
+import json
+import sys
+import time
+from argparse import Namespace
 from os import PathLike
-from typing import List, Optional, Set
+from typing import Any, Dict, Generator, Iterable, List, Optional, Set
 
 import networkx as nx
 
@@ -12,7 +16,7 @@ from cli_utils import process_station_input, add_default_cli_args, add_station_c
     use_default_cli_args
 from structures import DataSet
 from tc_utils import TcFile
-from validation.graph import graph_from_files, get_path_suggestion, PathSuggestionConfig
+from validation.graph import load_graph, get_path_suggestion, PathSuggestionConfig, RouteMemo
 
 
 def print_path_suggestion(station_codes: List[str],
@@ -20,21 +24,69 @@ def print_path_suggestion(station_codes: List[str],
                           data_directory: PathLike | str = 'data',
                           config: PathSuggestionConfig = PathSuggestionConfig,
                           graph: Optional[nx.Graph] = None,
-                          case_sensitive: bool = False
+                          case_sensitive: bool = False,
+                          station_groups: Optional[Dict[str, Optional[int]]] = None
                           ):
-    station_json = TcFile("Station", tc_directory)
-    path_json = TcFile("Path", tc_directory)
-
     if not graph:
-        graph = graph_from_files(station_json, path_json, case_sensitive=case_sensitive)
+        graph = load_graph(tc_directory, case_sensitive=case_sensitive)
 
-    station_groups = {station['ril100']: station.get('group') for station in station_json.data}
+    if station_groups is None:
+        station_groups = load_station_groups(tc_directory)
 
     path_suggestion = get_path_suggestion(graph, station_codes, config=config,
                                           station_to_group=station_groups)
     print(", ".join(("\"{}\"".format(code) for code in path_suggestion)))
 
 
+def load_station_groups(tc_directory: PathLike | str = '..') -> Dict[str, Optional[int]]:
+    station_json = TcFile("Station", tc_directory)
+    return {station['ril100']: station.get('group') for station in station_json.data}
+
+
+def path_suggestion_queries(queries: Iterable[str],
+                            graph: nx.Graph,
+                            station_groups: Dict[str, Optional[int]],
+                            data_set: DataSet,
+                            defaults: Optional[Namespace] = None,
+                            case_sensitive: bool = False
+                            ) -> Generator[Dict[str, Any], None, None]:
+    """Computes the pathSuggestions for JSON lines like
+    {"id": 1, "stations": ["AH", "HH"], "config": {"avoid_sfs": true}} (id and config are optional)
+    or simply ["AH", "HH"].
+    config: The same options as the CLI arguments (see PathSuggestionConfig.from_options), defaults are the CLI arguments
+    returns: One result per query, with the pathSuggestion or an error and the time it took"""
+    route_memo = RouteMemo(graph)
+    for line in queries:
+        if not line.strip():
+            continue
+        start = time.perf_counter()
+        result: Dict[str, Any] = {}
+        try:
+            query = json.loads(line)
+            if isinstance(query, list):
+                query = {'stations': query}
+            if not isinstance(query, dict):
+                raise TypeError(f"Die Anfrage muss ein Objekt oder eine Liste sein, nicht {type(query).__name__}")
+            if 'id' in query:
+                result['id'] = query['id']
+            stations = query['stations']
+            if not isinstance(stations, list) or not all(isinstance(station, str) for station in stations):
+                raise TypeError("stations muss eine Liste von Kürzeln sein")
+            options = query.get('config') or {}
+            if not isinstance(options, dict):
+                raise TypeError(f"config muss ein Objekt sein, nicht {type(options).__name__}")
+            station_codes = process_station_input(stations, dataset=data_set, case_sensitive=case_sensitive)
+            config = PathSuggestionConfig.from_options(options, defaults)
+            result['stations'] = station_codes
+            result['pathSuggestion'] = get_path_suggestion(graph, station_codes, config=config,
+                                                           station_to_group=station_groups, route_memo=route_memo)
+        except Exception as e:
+            # A single bad query must not end the whole batch
+            result['error'] = f"{type(e).__name__}: {e}"
+        result['time_ms'] = round((time.perf_counter() - start) * 1000, 3)
+        yield result
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Berechne die pathSuggestion')
     add_default_cli_args(parser)
@@ -44,21 +96,34 @@ if __name__ == '__main__':
                          allow_unordered=False,
                          allow_multiple_stations=True)
     PathSuggestionConfig.add_cli_args(parser)
+    parser.add_argument('--batch', type=str, nargs='?', const='-', metavar='DATEI',
+                        help="Liest Anfragen als JSON-Zeilen (z.B. {\"stations\": [\"AH\", \"HH\"]}) aus der Datei "
+                             "oder der Standardeingabe und gibt für jede eine JSON-Zeile mit der pathSuggestion aus")
 
     args = parser.parse_args()
     use_default_cli_args(args)
-    stations = parse_station_args(args, required=True)
-    config = PathSuggestionConfig.from_cli_args(args)
-
-    station_json = TcFile("Station", args.tc_directory)
-    path_json = TcFile("Path", args.tc_directory)
-    graph = graph_from_files(station_json, path_json, case_sensitive=args.case_sensitive)
-
-    for path in stations:
-        print_path_suggestion(
-            station_codes=path,
-            tc_directory=args.tc_directory,
-            data_directory=args.data_directory,
-            config=config,
-            case_sensitive=args.case_sensitive
-        )
+
+    graph = load_graph(args.tc_directory, case_sensitive=args.case_sensitive)
+    station_groups = load_station_groups(args.tc_directory)
+
+    if args.batch:
+        data_set = DataSet.load_data(args.data_directory)
+        queries = sys.stdin if args.batch == '-' else open(args.batch, encoding='utf-8')
+        with queries:
+            for result in path_suggestion_queries(queries, graph, station_groups, data_set,
+                                                  defaults=args, case_sensitive=args.case_sensitive):
+                print(json.dumps(result, ensure_ascii=False), flush=True)
+    else:
+        stations = parse_station_args(args, required=True)
+        config = PathSuggestionConfig.from_cli_args(args)
+
+        for path in stations:
+            print_path_suggestion(
+                station_codes=path,
+                tc_directory=args.tc_directory,
+                data_directory=args.data_directory,
+                config=config,
+                graph=graph,
+                case_sensitive=args.case_sensitive,
+                station_groups=station_groups
+            )
@@ -4,28 +4,51 @@ from __future__ import annotations
 
 import argparse
 from os import PathLike
-from typing import Dict, Any
+from typing import Dict, Any, List
 
 from cli_utils import add_default_cli_args, use_default_cli_args
-from geo import Location, default_projection_version
+from geo import Location, default_projection_version, project_many, unproject_many
 from tc_utils import TcFile
 
 
 def project_coordinates(tc_directory: PathLike | str = '..', projection_version: int = 1) -> TcFile:
     station_json = TcFile('Station', tc_directory)
-    for station in station_json.data:
-        project_coordinate_for_station(station, new_projection=projection_version)
+    project_coordinates_for_stations(station_json.data, new_projection=projection_version)
     return station_json
 
 
+def project_coordinates_for_stations(stations: List[Dict[str, Any]],
+                                     new_projection: int = default_projection_version):
+    """Same as project_coordinate_for_station, but projects all stations of one projection in one go"""
+    stations_by_projection: Dict[int, List[Dict[str, Any]]] = {}
+    for station in stations:
+        current_projection = _current_projection(station)
+        if current_projection == 0 and isinstance(station['x'], float) and isinstance(station['y'], float):
+            # Location.from_tc treats these as WGS84, so we don't want to do that in bulk
+            project_coordinate_for_station(station, new_projection=new_projection)
+            continue
+        stations_by_projection.setdefault(current_projection, []).append(station)
+
+    for current_projection, stations_to_project in stations_by_projection.items():
+        if current_projection != new_projection:
+            import numpy as np
+            x = np.fromiter((station['x'] for station in stations_to_project), dtype=float,
+                            count=len(stations_to_project))
+            y = np.fromiter((station['y'] for station in stations_to_project), dtype=float,
+                            count=len(stations_to_project))
+            latitude, longitude = unproject_many(x, y, version=current_projection)
+            x, y = project_many(latitude, longitude, version=new_projection)
+            for station, station_x, station_y in zip(stations_to_project, x.tolist(), y.tolist()):
+                station['x'], station['y'] = station_x, station_y
+        for station in stations_to_project:
+            if new_projection != 0:
+                station['proj'] = new_projection
+            else:
+                station.pop('proj', 0)
+
+
 def project_coordinate_for_station(station: Dict[str, Any], new_projection: int = default_projection_version):
-    if 'laea' not in station and 'proj' not in station:
-        current_projection = 0
-    else:
-        if 'proj' in station:
-            current_projection = station['proj']
-        else:
-            current_projection = station.pop('laea')
+    current_projection = _current_projection(station)
     if current_projection != new_projection:
         location = Location.from_projection(station['x'], station['y'], version=current_projection)
         station['x'], station['y'] = location.to_projection(new_projection)
@@ -35,6 +58,16 @@ def project_coordinate_for_station(station: Dict[str, Any], new_projection: int
         station.pop('proj', 0)
 
 
+def _current_projection(station: Dict[str, Any]) -> int:
+    if 'laea' not in station and 'proj' not in station:
+        return 0
+    else:
+        if 'proj' in station:
+            return station['proj']
+        else:
+            return station.pop('laea')
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Rechne die Koordinaten auf eine andere Projektion um')
     add_default_cli_args(parser, data_directory=False)
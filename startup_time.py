@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+"""Measures how long the tools take to start (python -X importtime <tool> --help).
+
+    python startup_time.py                       # All tools, fails if one of them exceeds its budget
+    python startup_time.py cleanup.py --details 10
+
+Only the standard library is used, so the measurement itself doesn't import anything of the tools.
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+from typing import Dict, List, Set, Tuple
+
+tools_directory = os.path.dirname(os.path.realpath(__file__))
+
+# tool -> The maximum time (ms) for the imports of the tool (without the interpreter's own imports).
+# Heavy modules (pyproj, NumPy, matplotlib, ...) are only imported when they are used, so most tools start quickly.
+# The tools that always need networkx, geopy or requests have a larger budget.
+budgets: Dict[str, int] = {
+    'build_rail_index.py': 400,
+    'cleanup.py': 100,
+    'compact_json.py': 40,
+    # Projects the coordinates, so it needs pyproj
+    'convert_coordinates.py': 200,
+    'create_tasks.py': 300,
+    'daemon.py': 40,
+    'export_station_list.py': 100,
+    'import_brouter.py': 400,
+    'import_stations.py': 300,
+    'import_trassenfinder.py': 400,
+    'plot.py': 100,
+    'print_path_suggestion.py': 300,
+    'project_coordinates.py': 100,
+    'tc_statistics.py': 100,
+    'transliterate.py': 100,
+    'update_path_suggestions.py': 300,
+    'validate_files.py': 300,
+}
+# The arguments to start the tools with (default: --help)
+tool_arguments: Dict[str, List[str]] = {
+    # Has no --help, but projects the given coordinates
+    'convert_coordinates.py': ['50.94', '6.96'],
+}
+
+_import_time_line = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|( *)(\S+)')
+
+
+def parse_import_times(output: str) -> List[Tuple[str, int, int, int]]:
+    """returns: (module, level, self time (µs), cumulative time (µs)) for every import"""
+    imports = []
+    for line in output.splitlines():
+        match = _import_time_line.match(line)
+        if match is not None:
+            self_time, cumulative, indentation, module = match.groups()
+            imports.append((module, (len(indentation) - 1) // 2, int(self_time), int(cumulative)))
+    return imports
+
+
+def interpreter_modules() -> Set[str]:
+    """The modules the interpreter imports anyway (site, encodings, ...)"""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'pass'],
+                            capture_output=True, text=True)
+    return {module for module, _, _, _ in parse_import_times(result.stderr)}
+
+
+def measure(tool: str, ignored_modules: Set[str]) -> Tuple[float, float, List[Tuple[str, int, int, int]]]:
+    """returns: The time for the imports (ms), the wall time (ms) and all imports"""
+    arguments = tool_arguments.get(tool, ['--help'])
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, '-X', 'importtime', os.path.join(tools_directory, tool), *arguments],
+                            capture_output=True, text=True, cwd=tools_directory)
+    wall_time = (time.perf_counter() - start) * 1000
+    if result.returncode != 0:
+        raise RuntimeError(f"{tool} {' '.join(arguments)} ist fehlgeschlagen:\n{result.stderr[-2000:]}")
+    imports = parse_import_times(result.stderr)
+    import_time = sum(cumulative for module, level, _, cumulative in imports
+                      if level == 0 and module not in ignored_modules) / 1000
+    return import_time, wall_time, imports
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Misst die Startzeit der Werkzeuge und vergleicht sie mit ihrem Budget')
+    parser.add_argument('tools', nargs='*', default=sorted(budgets),
+                        help="Die Werkzeuge, standardmäßig alle mit einem Budget")
+    parser.add_argument('--runs', type=int, default=5, help="Wie oft jedes Werkzeug gestartet wird (Median)")
+    parser.add_argument('--details', type=int, default=0, metavar='N',
+                        help="Gibt die N langsamsten Module (kumulativ) für jedes Werkzeug aus")
+    args = parser.parse_args()
+
+    ignored_modules = interpreter_modules()
+    over_budget = []
+    print(f"{'Werkzeug':<28} {'Importe (ms)':>12} {'Budget':>7} {'Gesamt (ms)':>11}")
+    for tool in args.tools:
+        tool = os.path.basename(tool)
+        measurements = [measure(tool, ignored_modules) for _ in range(args.runs)]
+        import_time = statistics.median(import_time for import_time, _, _ in measurements)
+        wall_time = statistics.median(wall_time for _, wall_time, _ in measurements)
+        budget = budgets.get(tool)
+        exceeded = budget is not None and import_time > budget
+        if exceeded:
+            over_budget.append(tool)
+        print(f"{tool:<28} {import_time:>12.0f} {budget if budget is not None else '-':>7} {wall_time:>11.0f}"
+              f"{'  zu langsam' if exceeded else ''}")
+        if args.details:
+            imports = measurements[-1][2]
+            slowest = sorted((entry for entry in imports if entry[0] not in ignored_modules),
+                             key=lambda entry: entry[3], reverse=True)
+            for module, level, self_time, cumulative in slowest[:args.details]:
+                print(f"    {module:<40} {cumulative / 1000:>8.1f} ms (selbst {self_time / 1000:.1f} ms)")
+
+    if over_budget:
+        print(f"Über dem Budget: {', '.join(over_budget)}", file=sys.stderr)
+        sys.exit(1)
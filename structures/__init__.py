@@ -1,45 +1,96 @@
 from __future__ import annotations
 import code
+import copy
 import logging
 
 import os.path
 from dataclasses import dataclass
 from functools import cached_property
-from typing import List, Tuple, Optional, Set, Iterable
+from typing import TYPE_CHECKING, List, Tuple, Optional, Set, Iterable
 
 from structures.country import Country, countries
 from structures.route import Track, Path, merge_tracks
 from structures.station import Station, merge_stations, assert_unique_first_code, merge_stations_on_first_code, \
-    CodeTuple, iter_stations_by_codes_reverse, _merge_station_dicts_inplace
+    CodeTuple, iter_stations_by_codes_reverse, station_fields, _merge_station_dicts_inplace
 from geo import Location
+from tc_utils import profiling, warm_cache
+
+if TYPE_CHECKING:
+    # The indices need NumPy, which most tools don't need otherwise
+    from geo.gazetteer import Gazetteer
+    from geo.spatial_index import SpatialIndex
+    from structures.track_index import TrackIndex
 
 
 @dataclass
 class DataSet:
     station_data: List[Station]
     path_data: List[Path]
+    data_directory: Optional[str] = None
 
     @cached_property
     def codes_to_stations(self):
         return {code: station for code, station in iter_stations_by_codes_reverse(self.station_data)}
 
+    @cached_property
+    @profiling.profiled(category='data')
+    def station_index(self) -> SpatialIndex[Station]:
+        from geo.spatial_index import SpatialIndex
+        return SpatialIndex.from_stations(self.station_data)
+
+    @cached_property
+    @profiling.profiled(category='data')
+    def track_index(self) -> TrackIndex:
+        from structures.track_index import TrackIndex
+        return TrackIndex(self.path_data)
+
+    @cached_property
+    @profiling.profiled(category='data')
+    def gazetteer(self) -> Gazetteer:
+        from geo.gazetteer import Gazetteer
+        if self.data_directory is not None:
+            return Gazetteer.load(self.station_data, self.data_directory)
+        return Gazetteer.from_stations(self.station_data)
+
+    def copy(self) -> DataSet:
+        """A copy with its own list of stations (e.g., for merge_station), everything else is shared"""
+        data_set = copy.copy(self)
+        data_set.station_data = list(self.station_data)
+        return data_set
+
     @staticmethod
+    @profiling.profiled(category='data')
     def load_data(
             data_directory: str = 'data',
             case_sensitive: bool = False
+    ) -> DataSet:
+        # In the daemon, the DataSet is only loaded again if the data files have changed
+        return warm_cache.cached(('DataSet', os.path.abspath(data_directory), case_sensitive),
+                                 lambda: warm_cache.directory_files(data_directory),
+                                 lambda: DataSet._load_data(data_directory, case_sensitive),
+                                 copy=DataSet.copy)
+
+    @staticmethod
+    def _load_data(
+            data_directory: str = 'data',
+            case_sensitive: bool = False
     ) -> DataSet:
         from importers.db_strecken import DbStreckenImporter
+        from structures.track_store import TrackStore
 
         stations = DataSet.load_station_data(data_directory)
-        tracks = DbStreckenImporter().import_data(os.path.join(data_directory, "strecken.csv"))
-        paths = merge_tracks(tracks)
+        track_rows = DbStreckenImporter().import_data(os.path.join(data_directory, "strecken.csv"))
+        with profiling.span('TrackStore.from_rows', 'data'):
+            paths = TrackStore.from_rows(track_rows).paths()
 
         return DataSet(
             stations,
-            paths
+            paths,
+            data_directory
         )
 
     @staticmethod
+    @profiling.profiled(category='data')
     def load_station_data_de(data_directory: str = 'data') -> List[Station]:
         from importers.db_betriebsstellenverzeichnis import DbBetriebsstellenverzeichnisImporter
         from importers.db_bahnhoefe import DbBahnhoefeImporter
@@ -69,6 +120,7 @@ class DataSet:
         return stations
 
     @staticmethod
+    @profiling.profiled(category='data')
     def load_station_data_ch(data_directory: str = 'data') -> List[Station]:
         from importers.db_bahnsteige import add_platforms_to_stations
         from importers.ch_betriebsstellen import ChBetriebsstellenImporter
@@ -82,6 +134,7 @@ class DataSet:
         return stations_ch
 
     @staticmethod
+    @profiling.profiled(category='data')
     def load_station_data_fr(data_directory: str = 'data') -> List[Station]:
         from importers.db_bahnsteige import add_platforms_to_stations
         from importers.fr_platforms import FrPlatformsImporter
@@ -167,6 +220,7 @@ class DataSet:
         return stations_fr
 
     @staticmethod
+    @profiling.profiled(category='data')
     def load_station_data_uk(data_directory: str = 'data') -> List[Station]:
         from importers.db_bahnsteige import add_platforms_to_stations
         from importers.uk_platforms import UkPlatformImporter
@@ -185,6 +239,7 @@ class DataSet:
         return stations_uk
 
     @staticmethod
+    @profiling.profiled(category='data')
     def load_station_data_us(data_directory: str = 'data') -> List[Station]:
         from importers.us_stations import UsStationImporter
         stations_us = UsStationImporter().import_data(os.path.join(data_directory, "us_stations.wiki"))
@@ -192,6 +247,7 @@ class DataSet:
         return stations_us
 
     @staticmethod
+    @profiling.profiled(category='data')
     def load_station_data_ds100(country: Country, ort_file: str, data_directory: str = 'data') -> List[Station]:
         from importers.ds_100_bot import Ds100Importer
         stations_ds100 = Ds100Importer(country).import_data(os.path.join(
@@ -199,6 +255,7 @@ class DataSet:
         return stations_ds100
 
     @staticmethod
+    @profiling.profiled(category='data')
     def load_station_data_trainline(data_directory: str = 'data') -> Optional[List[Station]]:
         from importers.trainline import TrainlineImporter
 
@@ -211,6 +268,7 @@ class DataSet:
             return None
 
     @staticmethod
+    @profiling.profiled(category='data')
     def load_station_data(data_directory: str = 'data') -> List[Station]:
         stations = DataSet.load_station_data_de(data_directory)
         stations_ch = DataSet.load_station_data_ch(data_directory)
@@ -242,9 +300,9 @@ class DataSet:
                     self.station_data.remove(station)
                 except ValueError:
                     logging.warning("Station nicht im Datensatz: {}".format(station.codes[0]))
-            station_dict = stations_to_merge.pop(0).__dict__.copy()
+            station_dict = station_fields(stations_to_merge.pop(0))
             for other_station in stations_to_merge:
-                _merge_station_dicts_inplace(station_dict, other_station.__dict__, '')
+                _merge_station_dicts_inplace(station_dict, station_fields(other_station), '')
             merged_station = Station(**station_dict)
             self.station_data.append(merged_station)
 
@@ -6,12 +6,15 @@ from abc import ABCMeta
 from dataclasses import dataclass, field
 from enum import Enum
 from functools import cached_property
-from typing import List, Optional, Dict, Any, Tuple, Set
+from typing import List, Optional, Dict, Any, Tuple, Set, Iterable, TYPE_CHECKING
 
 from structures.country import germany, country_for_code
 from structures.station import Station, iter_stations_by_codes_reverse, CodeTuple, StreckenKilometer
 from geo import Location
 
+if TYPE_CHECKING:
+    from structures.track_store import TrackStore
+
 
 @dataclass(frozen=True)
 class Route:
@@ -19,31 +22,34 @@ class Route:
     tracks: List[Tuple[Track, ...]]
 
 
-@dataclass(frozen=True)
 class Path:
+    """The tracks of one route number (Streckennummer).
+    If the path belongs to a TrackStore, the Track objects are only created when they are needed."""
     route_numer: int
-    tracks: Tuple[Track]
-
-
-def merge_tracks(tracks: List[Track]) -> List[Path]:
-    route_number_to_tracks: Dict[int, Set[Track]] = {}
-    for track in tracks:
-        if track.route_number not in route_number_to_tracks:
-            route_number_to_tracks[track.route_number] = set()
-        route_number_to_tracks[track.route_number].add(track)
-    # Sorting the segments makes it easier later on
-    for tracks in route_number_to_tracks.values():
-        tracks = list(tracks)
-        tracks.sort(key=lambda track: track.from_km)
-        # Check for duplicates
-        for (track, next_track) in zip(tracks, tracks[1:]):
-            assert track.from_km != next_track.from_km, (track, next_track)
-    return [
-        Path(
-            route_numer=route_number,
-            tracks=tuple(tracks)
-        ) for route_number, tracks in route_number_to_tracks.items()
-    ]
+    store: Optional[TrackStore]
+    _tracks: Optional[Tuple[Track, ...]]
+
+    def __init__(self, route_numer: int, tracks: Optional[Iterable[Track]] = None,
+                 store: Optional[TrackStore] = None):
+        assert tracks is not None or store is not None
+        self.route_numer = route_numer
+        self.store = store
+        self._tracks = tuple(tracks) if tracks is not None else None
+
+    @property
+    def tracks(self) -> Tuple[Track, ...]:
+        if self._tracks is None:
+            self._tracks = self.store.tracks(self.route_numer)
+        return self._tracks
+
+    def __repr__(self) -> str:
+        return f"Path(route_numer={self.route_numer})"
+
+
+def merge_tracks(tracks: Iterable[Track]) -> List[Path]:
+    """Groups the tracks by their route number. The tracks of each path are sorted by from_km."""
+    from structures.track_store import TrackStore
+    return TrackStore.from_tracks(tracks).paths()
 
 
 def invalid_station(code: str) -> Station:
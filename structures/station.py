@@ -1,16 +1,18 @@
 from __future__ import annotations
 
 import re
-from dataclasses import dataclass, field
+from dataclasses import dataclass, field, fields
 from functools import cached_property
-from typing import Optional, List, Iterable, Generator, Tuple, Set, Any, Dict, FrozenSet
-
-import geopy
+from typing import TYPE_CHECKING, Optional, List, Iterable, Generator, Tuple, Set, Any, Dict, FrozenSet
 
 from geo import Location, default_projection_version
+from tc_utils import profiling
 from structures.country import Country, country_for_station, country_for_code, split_country, CountryRepresentation, \
     strip_country
 
+if TYPE_CHECKING:
+    import geopy
+
 # It will add all of them in that order if one is added
 special_codes: Tuple[Tuple[str, ...], ...] = (
     ("EMSTP", "EMST"),
@@ -74,6 +76,10 @@ class CodeTuple(Tuple[str]):
         codes.sort(key=cls._rank_for_code)
         return tuple.__new__(cls, codes)
 
+    def __reduce__(self):
+        # The codes are already expanded and sorted
+        return tuple.__new__, (CodeTuple, tuple(self))
+
     @classmethod
     def _rank_for_code(cls, code: str) -> int:
         _, country_representation = country_for_code(code)
@@ -188,17 +194,28 @@ class Station:
 
     @cached_property
     def point(self) -> geopy.Point:
+        import geopy
         return geopy.Point(
             latitude=self.location.latitude,
             longitude=self.location.longitude
         )
 
     def merge(self, new_station: Station, on: str) -> Station:
-        result: Dict[str, Any] = self.__dict__.copy()
-        _merge_station_dicts_inplace(result, new_station.__dict__.copy(), on)
+        result: Dict[str, Any] = station_fields(self)
+        _merge_station_dicts_inplace(result, station_fields(new_station), on)
         return Station(**result)
 
 
+_station_field_names = tuple(station_field.name for station_field in fields(Station))
+
+
+def station_fields(station: Station) -> Dict[str, Any]:
+    """The fields of the station (a new dict), without the cached properties that are stored in its __dict__ as well.
+    The stations may be shared (e.g., in the daemon), so their __dict__ must not be modified"""
+    station_dict = station.__dict__
+    return {name: station_dict[name] for name in _station_field_names}
+
+
 def merge_stations_on_first_code(stations: List[Station]) -> List[Station]:
     merged_stations: Dict[str, Station] = {}
     for station in stations:
@@ -228,6 +245,7 @@ def normalize(value: str, merge_key: str) -> str:
         return value
 
 
+@profiling.profiled(category='merge')
 def merge_stations(onto: List[Station],
                    new_data: List[Station],
                    on: str,
@@ -247,10 +265,10 @@ def merge_stations(onto: List[Station],
                 # Move the station into the WIP state
                 station = id_to_station.pop(key)
                 remaining_stations.remove(station)
-                id_to_wip[key] = station.__dict__.copy()
+                id_to_wip[key] = station_fields(station)
             if key in id_to_wip:
                 # ...but only the next time.
-                _merge_station_dicts_inplace(id_to_wip[key], new_station.__dict__.copy(), on)
+                _merge_station_dicts_inplace(id_to_wip[key], station_fields(new_station), on)
             else:
                 # New station
                 merged_stations.append(new_station)
@@ -265,12 +283,12 @@ def merge_stations(onto: List[Station],
                     station = id_to_station.pop(code)
                     if station in remaining_stations:
                         remaining_stations.remove(station)
-                        id_to_wip[code] = station.__dict__.copy()
+                        id_to_wip[code] = station_fields(station)
                 if code in id_to_wip:
                     # We won't have an else-branch here, because we only want the first code to be added in case
                     # the station is not existing at all
                     code_in_stations = True
-                    _merge_station_dicts_inplace(id_to_wip[code], new_station.__dict__.copy(), on)
+                    _merge_station_dicts_inplace(id_to_wip[code], station_fields(new_station), on)
             if not code_in_stations:
                 # It's completely new, add it to the list
                 merged_stations.append(new_station)
@@ -344,6 +362,10 @@ class PathLocation:
     route_number: int
     lfd_km: StreckenKilometer
 
+    def __reduce__(self):
+        # Frozen dataclasses with __slots__ can't be unpickled with the default protocol
+        return PathLocation, (self.route_number, self.lfd_km)
+
 
 @dataclass(frozen=True)
 class Platform:
@@ -352,6 +374,10 @@ class Platform:
     # The station could be a station code, or a station number
     station: str | int
 
+    def __reduce__(self):
+        # Frozen dataclasses with __slots__ can't be unpickled with the default protocol
+        return Platform, (self.length, self.station)
+
 
 @dataclass(frozen=True)
 class StreckenKilometer:
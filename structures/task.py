@@ -2,12 +2,13 @@ from __future__ import annotations
 
 from dataclasses import dataclass, field, InitVar
 from enum import Enum
-from typing import List, Dict, Any, Optional, Set
+from typing import List, Dict, Any, Optional, Set, Tuple
 
 import networkx as nx
 
 from structures.pronouns import Pronouns, ErIhmPronouns, SieIhrPronouns
-from validation.graph import get_path_suggestion, PathSuggestionConfig
+from tc_utils import profiling
+from validation.graph import PathSuggestionConfig, RouteMemo
 from validation.shortest_paths import without_trivial_nodes, get_shortest_path
 
 
@@ -34,18 +35,27 @@ class Task:
     service: int = field(default=4)
     graph: InitVar[Optional[nx.Graph]] = None
     path_suggestion_config: InitVar[PathSuggestionConfig] = None
+    # Can be shared between many tasks, so the same routes are only computed once
+    route_memo: InitVar[Optional[RouteMemo]] = None
 
     pathSuggestion: Optional[List[str]] = field(default=None, repr=False, hash=False, init=False)
+    # The complete path that has been used for the pathSuggestion (it is not exported)
+    _full_path: Optional[List[str]] = field(default=None, repr=False, hash=False, compare=False, init=False)
 
-    def __post_init__(self, graph: Optional[nx.Graph], path_suggestion_config: PathSuggestionConfig):
+    def __post_init__(self, graph: Optional[nx.Graph], path_suggestion_config: PathSuggestionConfig,
+                      route_memo: Optional[RouteMemo]):
         if not path_suggestion_config:
             path_suggestion_config = PathSuggestionConfig()
         if graph:
-            object.__setattr__(self, 'pathSuggestion', get_path_suggestion(graph, self.stations,
-                                                                           config=path_suggestion_config))
+            if route_memo is None or route_memo.graph is not graph:
+                route_memo = RouteMemo(graph)
+            object.__setattr__(self, '_full_path', route_memo.full_path(self.stations, path_suggestion_config))
+            object.__setattr__(self, 'pathSuggestion', route_memo.path_suggestion(self.stations,
+                                                                                  path_suggestion_config))
 
     def to_dict(self, add_suggestion: bool = False) -> Dict[str, Any]:
         task = self.__dict__
+        task.pop('_full_path', None)
         task['neededCapacity'] = [
             {name: value for name, value in needed_capacity.__dict__.items() if value} for needed_capacity in
             self.neededCapacity
@@ -55,7 +65,10 @@ class Task:
         return task
 
     def uses_sfs(self, graph: nx.Graph) -> bool:
-        stations = get_shortest_path(graph, self.stations)
+        # Use the same path as the pathSuggestion if it has already been computed
+        stations = self._full_path if self._full_path is not None else get_shortest_path(graph, self.stations)
+        if not stations:
+            return False
         for station_from, station_to in zip(stations, stations[1:]):
             edge = graph[station_from][station_to]
             if 'group' not in edge:
@@ -250,8 +263,24 @@ class AmtrakTask(NjTask):
     needed_capacity = NjTask.needed_capacity + [TcNeededCapacity(name="bistroseats")]
 
 
-# Not optimal algorithm to merge multiple tasks into less tasks
+def _hashable(value: Any) -> Any:
+    """A hashable representation of a (JSON) value. Two representations are equal iff the values are equal"""
+    if isinstance(value, list):
+        return list, tuple(map(_hashable, value))
+    if isinstance(value, tuple):
+        return tuple, tuple(map(_hashable, value))
+    if isinstance(value, dict):
+        return dict, frozenset((key, _hashable(item)) for key, item in value.items())
+    if isinstance(value, (set, frozenset)):
+        return frozenset, frozenset(map(_hashable, value))
+    return value
+
+
+@profiling.profiled(category='merge')
 def merge_task_dicts(tasks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Merges tasks into as few tasks as possible, with the differences in "objects".
+    A task is merged into the merged task it shares the most properties with, if group and neededCapacity are equal
+    and name, descriptions or stations are equal (the first one, if there are multiple)."""
     if len(tasks) == 1:
         return tasks
     else:
@@ -259,38 +288,48 @@ def merge_task_dicts(tasks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
             for key in ['group', 'neededCapacity', 'name', 'descriptions', 'stations']:
                 if key not in task:
                     task[key] = None
-        merged_tasks = [tasks[0]]
+        merged_tasks: List[Dict[str, Any]] = []
+        # The hashable representations of the values in merged_tasks (except for objects)
+        merged_values: List[Dict[str, Any]] = []
+        # (group, neededCapacity) -> (key, value) -> indices in merged_tasks
+        mergeable: Dict[Tuple[Any, Any], Dict[Tuple[str, Any], List[int]]] = {}
+
+        def add_merged_task(new_task: Dict[str, Any], values: Dict[str, Any]):
+            lookup = mergeable.setdefault((values['group'], values['neededCapacity']), {})
+            for lookup_key in ['name', 'descriptions', 'stations']:
+                lookup.setdefault((lookup_key, values[lookup_key]), []).append(len(merged_tasks))
+            merged_tasks.append(new_task)
+            merged_values.append(values)
+
+        add_merged_task(tasks[0], {key: _hashable(value) for key, value in tasks[0].items() if key != 'objects'})
         # try to merge the other tasks
         for task in tasks[1:]:
-            overlap = [0 for _ in merged_tasks]
+            task_values = {key: _hashable(value) for key, value in task.items() if key != 'objects'}
             # Merge if at least group, and neededCapacity are equal and if there are no objects in the new task
-            for index, merge_task in enumerate(merged_tasks):
-                if 'objects' not in task \
-                   and task['group'] == merge_task['group'] \
-                   and task['neededCapacity'] == merge_task['neededCapacity']\
-                   and (
-                    task['name'] == merge_task['name']
-                    or task['descriptions'] == merge_task['descriptions']
-                    or task['stations'] == merge_task['stations']
-                   ):
-                    for key, value in task.items():
-                        if merge_task[key] == value:
-                            overlap[index] += 1
-            # Now we have a mapping from task index to overlap (i.e. shared properties)
-            # Merge with the best one
-            if max(overlap) != 0:
-                merge_task = merged_tasks[overlap.index(max(overlap))]
+            lookup = mergeable.get((task_values['group'], task_values['neededCapacity']), {})
+            candidates = set()
+            if 'objects' not in task:
+                for key in ['name', 'descriptions', 'stations']:
+                    candidates.update(lookup.get((key, task_values[key]), ()))
+            # Merge with the one with the largest overlap (i.e. shared properties)
+            best_index, best_overlap = None, 0
+            for index in sorted(candidates):
+                merge_values = merged_values[index]
+                overlap = sum(1 for key, value in task_values.items() if merge_values[key] == value)
+                if overlap > best_overlap:
+                    best_index, best_overlap = index, overlap
+            if best_index is not None:
+                merge_task = merged_tasks[best_index]
                 if 'objects' not in merge_task:
                     merge_task['objects'] = []
-                sub_task: Dict[str, Any] = {}
-                for key, value in task.items():
-                    if merge_task[key] != value:
-                        # Add to the sub_task, because we can't reuse it
-                        sub_task[key] = value
+                # Add everything that differs to the sub_task, because we can't reuse it
+                merge_values = merged_values[best_index]
+                sub_task: Dict[str, Any] = {key: task[key] for key, value in task_values.items()
+                                            if merge_values[key] != value}
                 merge_task['objects'].append(sub_task)
             else:
                 # No mergeable task found
-                merged_tasks.append(task)
+                add_merged_task(task, task_values)
         for task in merged_tasks:
             cleanup_task(task)
     return merged_tasks
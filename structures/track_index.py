@@ -0,0 +1,102 @@
+from __future__ import annotations
+
+import statistics
+from bisect import bisect_right
+from functools import cached_property
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from structures.route import Path, Track, TrackKind
+from structures.station import StreckenKilometer
+from structures.track_store import TrackStore, track_from_row
+
+
+def _km_key(km: StreckenKilometer) -> Tuple[float, float]:
+    # The same order as StreckenKilometer.__lt__, but much faster to compare
+    return km.lfd_km, km.correction
+
+
+def _km_keys(metres: np.ndarray, corrections: np.ndarray) -> List[Tuple[float, float]]:
+    # The same values as _km_key of the materialized StreckenKilometer
+    return list(zip((metres / 1000).tolist(), corrections.tolist()))
+
+
+class RouteTrackIndex:
+    """An interval index over the tracks of one route number (Streckennummer).
+    It only uses the rows of the TrackStore, so the Track objects are only created for the tracks that are found"""
+    route_number: int
+    # The rows of the route, sorted by from_km
+    _rows: np.ndarray
+    _from_keys: List[Tuple[float, float]]
+    _to_keys: List[Tuple[float, float]]
+    # The largest to_km of all tracks up to (and including) this one
+    _max_to_keys: List[Tuple[float, float]]
+    _tracks: Dict[int, Track]
+
+    def __init__(self, route_number: int, rows: np.ndarray):
+        self.route_number = route_number
+        self._rows = rows
+        self._from_keys = _km_keys(rows['from_m'], rows['from_correction'])
+        self._to_keys = _km_keys(rows['to_m'], rows['to_correction'])
+        self._max_to_keys = []
+        for to_key in self._to_keys:
+            self._max_to_keys.append(max(to_key, self._max_to_keys[-1]) if self._max_to_keys else to_key)
+        self._tracks = {}
+
+    @staticmethod
+    def from_path(path: Path) -> RouteTrackIndex:
+        store = path.store if path.store is not None else TrackStore.from_tracks(
+            # Tracks without kilometers can't be found by their kilometers anyway
+            track for track in path.tracks if track.from_km is not None and track.to_km is not None
+        )
+        return RouteTrackIndex(path.route_numer, store.route(path.route_numer))
+
+    def _track(self, position: int) -> Track:
+        if position not in self._tracks:
+            self._tracks[position] = track_from_row(self._rows[position])
+        return self._tracks[position]
+
+    def _positions_at(self, km: StreckenKilometer) -> List[int]:
+        """returns: The positions of all tracks with from_km <= km <= to_km"""
+        key = _km_key(km)
+        positions = []
+        # All tracks that start before km are candidates, but we can stop as soon as none of them reaches km
+        index = bisect_right(self._from_keys, key) - 1
+        while index >= 0 and self._max_to_keys[index] >= key:
+            if self._to_keys[index] >= key:
+                positions.append(index)
+            index -= 1
+        return positions
+
+    def tracks_at(self, km: StreckenKilometer) -> List[Track]:
+        """returns: All tracks that contain km (sorted by from_km)"""
+        return [self._track(position) for position in sorted(self._positions_at(km))]
+
+    def tracks_at_either(self, km_start: StreckenKilometer, km_end: StreckenKilometer) -> List[Track]:
+        """returns: All tracks that contain km_start or km_end (sorted by from_km)"""
+        positions = set(self._positions_at(km_start))
+        positions.update(self._positions_at(km_end))
+        return [self._track(position) for position in sorted(positions)]
+
+    @cached_property
+    def median_electrified(self) -> bool:
+        return statistics.median_high(self._rows['electrified'].tolist())
+
+    @cached_property
+    def median_kind(self) -> TrackKind:
+        return statistics.median_high(map(TrackKind, self._rows['kind'].tolist()))
+
+
+class TrackIndex:
+    """The tracks of all route numbers, see RouteTrackIndex"""
+    routes: Dict[int, RouteTrackIndex]
+
+    def __init__(self, paths: Iterable[Path]):
+        self.routes = {path.route_numer: RouteTrackIndex.from_path(path) for path in paths}
+
+    def __contains__(self, route_number: Optional[int]) -> bool:
+        return route_number in self.routes
+
+    def __getitem__(self, route_number: int) -> RouteTrackIndex:
+        return self.routes[route_number]
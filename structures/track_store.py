@@ -0,0 +1,103 @@
+from __future__ import annotations
+
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+
+from structures.route import Path, Track, TrackKind
+from structures.station import StreckenKilometer
+
+track_dtype = np.dtype([
+    ('route_number', np.int32),
+    # The kilometers in (integer) metres, plus the correction (Überlänge)
+    ('from_m', np.int64),
+    ('from_correction', np.float64),
+    ('to_m', np.int64),
+    ('to_correction', np.float64),
+    ('electrified', np.bool_),
+    ('kind', np.int8),
+    ('length', np.float64),
+])
+
+# (route_number, from_m, from_correction, to_m, to_correction, electrified, kind (TrackKind.value), length)
+TrackRow = Tuple[int, int, float, int, float, bool, int, float]
+
+
+class TrackStore:
+    """All tracks (e.g., from strecken.csv) in one structured array, sorted by route number and from_km.
+    Track objects are only created when the tracks of a route are requested."""
+    data: np.ndarray
+    # route number -> (start, end) in data
+    _routes: Dict[int, Tuple[int, int]]
+
+    def __init__(self, data: np.ndarray):
+        """data has to be sorted (see from_rows)"""
+        self.data = data
+        route_numbers, starts = np.unique(data['route_number'], return_index=True)
+        ends = np.append(starts[1:], len(data))
+        self._routes = {route_number: (start, end)
+                        for route_number, start, end in zip(route_numbers.tolist(), starts.tolist(), ends.tolist())}
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    @staticmethod
+    def from_rows(rows: Iterable[TrackRow]) -> TrackStore:
+        """Identical tracks are only stored once"""
+        data = np.array(list(rows), dtype=track_dtype)
+        # np.unique sorts by all fields in order, i.e. by route number and from_km first
+        data = np.unique(data)
+        # Check for duplicates
+        same_start = ((data['route_number'][1:] == data['route_number'][:-1]) &
+                      (data['from_m'][1:] == data['from_m'][:-1]) &
+                      (data['from_correction'][1:] == data['from_correction'][:-1]))
+        assert not np.any(same_start), data[1:][same_start]
+        return TrackStore(data)
+
+    @staticmethod
+    def from_tracks(tracks: Iterable[Track]) -> TrackStore:
+        return TrackStore.from_rows((track.route_number, *km_to_metres(track.from_km), *km_to_metres(track.to_km),
+                                     track.electrified, track.kind.value, track.length) for track in tracks)
+
+    @property
+    def route_numbers(self) -> List[int]:
+        return list(self._routes.keys())
+
+    def __contains__(self, route_number: int) -> bool:
+        return route_number in self._routes
+
+    def route(self, route_number: int) -> np.ndarray:
+        """returns: The (sorted) rows of the route number (a view)"""
+        start, end = self._routes.get(route_number, (0, 0))
+        return self.data[start:end]
+
+    def tracks(self, route_number: int) -> Tuple[Track, ...]:
+        return tuple(map(track_from_row, self.route(route_number)))
+
+    def paths(self) -> List[Path]:
+        return [Path(route_numer=route_number, store=self) for route_number in self._routes]
+
+
+def track_from_row(row: np.void) -> Track:
+    return Track(
+        route_number=int(row['route_number']),
+        electrified=bool(row['electrified']),
+        kind=TrackKind(int(row['kind'])),
+        length=float(row['length']),
+        from_km=StreckenKilometer(lfd_km=int(row['from_m']) / 1000, correction=float(row['from_correction'])),
+        to_km=StreckenKilometer(lfd_km=int(row['to_m']) / 1000, correction=float(row['to_correction']))
+    )
+
+
+def km_to_metres(km: StreckenKilometer) -> Tuple[int, float]:
+    """returns: The kilometer in metres and the correction, i.e. the from_m/from_correction fields"""
+    return round(km.lfd_km * 1000), km.correction
+
+
+def km_from_str(km_str: str) -> Tuple[int, float]:
+    """Like StreckenKilometer.from_str, but returns the fields for TrackStore instead"""
+    if '+' in km_str:
+        lfd_km, correction = km_str.split(' + ')
+        return round(float(lfd_km.replace(',', '.')) * 1000), float(correction.replace(',', '.'))
+    else:
+        return round(float(km_str.replace(',', '.')) * 1000), 0.0
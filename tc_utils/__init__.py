@@ -1,10 +1,13 @@
 from __future__ import annotations
 
+import functools
 import json
 import os.path
+import pickle
 from os import PathLike
 from typing import List, Any, Dict, Generator
 
+from tc_utils import profiling, warm_cache
 from tc_utils.formatting import format_json
 
 
@@ -17,16 +20,25 @@ class TcFile:
     def __init__(self, name: str, directory: PathLike | str = '..'):
         self.name = name
         self.path = os.path.join(directory, name) + '.json'
+        # In the daemon, the parsed file is kept in memory (as a pickle, so every TcFile gets its own copy)
+        with profiling.span(f'TcFile.load({name})', 'tc_file'):
+            self.content = warm_cache.cached(('TcFile', os.path.abspath(self.path)), lambda: [self.path], self._load,
+                                             copy=pickle.loads,
+                                             store=functools.partial(pickle.dumps, protocol=pickle.HIGHEST_PROTOCOL))
+        self.data = self.content['data']
+
+    def _load(self) -> Dict:
         with open(self.path, encoding='utf-8') as data_file:
-            self.content = json.load(data_file)
-            self.data = self.content['data']
+            return json.load(data_file)
 
     def save(self):
-        with open(self.path, 'w', encoding='utf-8', newline='\n') as output_file:
+        with profiling.span(f'TcFile.save({self.name})', 'tc_file'), \
+                open(self.path, 'w', encoding='utf-8', newline='\n') as output_file:
             json.dump(self.content, output_file, ensure_ascii=False, indent='\t')
 
     def save_formatted(self):
-        with open(self.path, 'w', encoding='utf-8', newline='\n') as output_file:
+        with profiling.span(f'TcFile.save({self.name})', 'tc_file'), \
+                open(self.path, 'w', encoding='utf-8', newline='\n') as output_file:
             output_file.write(format_json(self.content))
 
 
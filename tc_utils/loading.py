@@ -0,0 +1,186 @@
+"""Loads the DataSet and the TC files concurrently.
+The TC files are parsed in threads, the DataSet is built in a separate process if there is a CPU core for it
+(parsing the OpenData files is CPU-bound, so a thread would have to wait for the GIL).
+Each value is only waited for when it is first used."""
+from __future__ import annotations
+
+import gc
+import logging
+import os
+import pickle
+import threading
+from contextlib import contextmanager
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from os import PathLike
+from typing import TYPE_CHECKING, Dict, Iterable, Iterator, Optional
+
+from tc_utils import TcFile, profiling, warm_cache
+
+if TYPE_CHECKING:
+    from structures import DataSet
+
+
+_gc_lock = threading.Lock()
+_gc_pauses = 0
+_gc_was_enabled = False
+
+
+@contextmanager
+def paused_gc() -> Iterator[None]:
+    """Creating many small objects (the stations of the DataSet) triggers the garbage collector over and over,
+    although none of them can be garbage yet. Without it, the DataSet is built about a quarter faster."""
+    global _gc_pauses, _gc_was_enabled
+    with _gc_lock:
+        if _gc_pauses == 0:
+            _gc_was_enabled = gc.isenabled()
+            gc.disable()
+        _gc_pauses += 1
+    try:
+        yield
+    finally:
+        with _gc_lock:
+            _gc_pauses -= 1
+            if _gc_pauses == 0 and _gc_was_enabled:
+                gc.enable()
+
+
+def available_cpus() -> int:
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def _load_data_set(data_directory: str, case_sensitive: bool) -> DataSet:
+    from structures import DataSet
+    with paused_gc():
+        return DataSet.load_data(data_directory, case_sensitive)
+
+
+def _load_data_set_pickled(data_directory: str, case_sensitive: bool) -> bytes:
+    """Runs in the separate process. The DataSet is returned pickled, so it can be unpickled with paused_gc,
+    which is about four times faster for the many small objects"""
+    return pickle.dumps(_load_data_set(data_directory, case_sensitive), protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def _done(value) -> Future:
+    future = Future()
+    future.set_result(value)
+    return future
+
+
+def _unpickle(data: bytes):
+    with paused_gc():
+        return pickle.loads(data)
+
+
+class Loader:
+    """Starts loading the DataSet and the given TC files on creation:
+
+        loader = Loader(tc_directory, ('Station', 'Path'), data_directory)
+        ...
+        station_json = loader.tc_file('Station')  # Waits until Station.json has been loaded
+        data_set = loader.data_set
+
+    The DataSet is loaded in a thread as well if there is only one CPU core (the process would only add the time
+    to transfer the DataSet), in the daemon, where it is usually already in the warm cache, and while profiling
+    (the stages in the process would be missing from the profile).
+    concurrent: If False, everything is loaded one after another when it is first used"""
+    tc_directory: PathLike | str
+    data_directory: Optional[PathLike | str]
+    case_sensitive: bool
+    concurrent: bool
+    _tc_files: Dict[str, Future]
+    _data_set: Optional[Future]
+
+    def __init__(self,
+                 tc_directory: PathLike | str = '..',
+                 tc_files: Iterable[str] = (),
+                 data_directory: Optional[PathLike | str] = None,
+                 case_sensitive: bool = False,
+                 concurrent: bool = True):
+        self.tc_directory = tc_directory
+        self.data_directory = data_directory
+        self.case_sensitive = case_sensitive
+        self.concurrent = concurrent
+        self._tc_files = {}
+        self._data_set = None
+        self._threads = None
+        self._process = None
+        if not concurrent:
+            return
+        tc_files = list(dict.fromkeys(tc_files))
+        self._threads = ThreadPoolExecutor(max_workers=max(1, len(tc_files)) + 1,
+                                           thread_name_prefix='Loader')
+        # The process is started before the threads, so it isn't forked while they are running
+        if data_directory is not None:
+            self._data_set = self._submit_data_set()
+        for name in tc_files:
+            self._tc_files[name] = self._threads.submit(TcFile, name, tc_directory)
+
+    def _submit_data_set(self) -> Future:
+        if not warm_cache.is_enabled() and not profiling.is_enabled() and available_cpus() > 1:
+            try:
+                self._process = ProcessPoolExecutor(max_workers=1)
+                return self._process.submit(_load_data_set_pickled, str(self.data_directory), self.case_sensitive)
+            except (OSError, NotImplementedError, BrokenProcessPool) as e:
+                logging.info(f"Konnte keinen Prozess für den DataSet starten: {e}")
+        return self._threads.submit(self._load_data_set)
+
+    def _load_data_set(self) -> DataSet:
+        return _load_data_set(str(self.data_directory), self.case_sensitive)
+
+    @property
+    def data_set(self) -> DataSet:
+        if self.data_directory is None:
+            raise ValueError("Es wurde kein Datenverzeichnis angegeben")
+        if self._data_set is None:
+            # Not concurrent
+            self._data_set = _done(self._load_data_set())
+        try:
+            with profiling.span('Loader.wait(DataSet)', 'data'):
+                data_set = self._data_set.result()
+        except BrokenProcessPool as e:
+            # E.g., if the process has been killed
+            logging.warning(f"Der Prozess für den DataSet ist abgebrochen, lade ihn neu: {e}")
+            self._data_set = self._threads.submit(self._load_data_set)
+            data_set = self._data_set.result()
+        if isinstance(data_set, bytes):
+            with profiling.span('Loader.unpickle(DataSet)', 'data'):
+                data_set = _unpickle(data_set)
+            self._data_set = _done(data_set)
+            self._shutdown_process()
+        return data_set
+
+    def tc_file(self, name: str) -> TcFile:
+        if name not in self._tc_files:
+            if self.concurrent:
+                self._tc_files[name] = self._threads.submit(TcFile, name, self.tc_directory)
+            else:
+                self._tc_files[name] = _done(TcFile(name, self.tc_directory))
+        with profiling.span(f'Loader.wait({name})', 'tc_file'):
+            return self._tc_files[name].result()
+
+    def __getitem__(self, name: str) -> TcFile:
+        return self.tc_file(name)
+
+    def _shutdown_process(self):
+        if self._process is not None:
+            self._process.shutdown(wait=False)
+            self._process = None
+
+    def close(self):
+        """Stops loading everything that hasn't been used yet"""
+        for future in self._tc_files.values():
+            future.cancel()
+        if self._data_set is not None:
+            self._data_set.cancel()
+        self._shutdown_process()
+        if self._threads is not None:
+            self._threads.shutdown(wait=False, cancel_futures=True)
+
+    def __enter__(self) -> Loader:
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,221 @@
+"""Measures how long the stages of a tool take and how much memory they need (see --profile and --trace).
+The stages are marked with span() or @profiled. Unless profiling has been enabled, span() returns a shared object
+that does nothing and @profiled only checks a global, so the instrumentation costs next to nothing.
+
+The memory peak of a span is the largest amount of memory (tracemalloc, only with --profile) that has been
+allocated in addition to the memory at its start. It includes the other threads, e.g., the TC files that are
+loaded at the same time (see tc_utils.loading)."""
+from __future__ import annotations
+
+import functools
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, TextIO, TypeVar
+
+F = TypeVar('F', bound=Callable)
+
+_enabled = False
+_trace_memory = False
+_print_summary = True
+_trace_file: Optional[str] = None
+_lock = threading.Lock()
+_start_time = 0.0
+_records: List[SpanRecord] = []
+# The spans that have not ended yet, they all get the memory peaks that are measured in the meantime
+_open_spans: Dict[int, _Span] = {}
+
+
+@dataclass
+class SpanRecord:
+    name: str
+    category: str
+    # In seconds since enable()
+    start: float
+    duration: float
+    thread_id: int
+    thread_name: str
+    # In bytes, only if the memory is traced
+    memory_peak: Optional[int]
+
+
+def _fold_memory() -> int:
+    """Passes the peak since the last call on to the open spans (with _lock held).
+    returns: The current memory"""
+    current, peak = tracemalloc.get_traced_memory()
+    for open_span in _open_spans.values():
+        if peak > open_span.memory_max:
+            open_span.memory_max = peak
+    tracemalloc.reset_peak()
+    return current
+
+
+class _Span:
+    __slots__ = 'name', 'category', 'start', 'memory_start', 'memory_max'
+
+    def __init__(self, name: str, category: str):
+        self.name = name
+        self.category = category
+
+    def __enter__(self) -> _Span:
+        if _trace_memory:
+            with _lock:
+                self.memory_start = self.memory_max = _fold_memory()
+                _open_spans[id(self)] = self
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> bool:
+        end = time.perf_counter()
+        thread = threading.current_thread()
+        with _lock:
+            memory_peak = None
+            if _trace_memory and id(self) in _open_spans:
+                _fold_memory()
+                del _open_spans[id(self)]
+                memory_peak = self.memory_max - self.memory_start
+            if _enabled:
+                _records.append(SpanRecord(self.name, self.category, self.start - _start_time, end - self.start,
+                                           thread.ident, thread.name, memory_peak))
+        return False
+
+
+class _NoSpan:
+    __slots__ = ()
+
+    def __enter__(self) -> _NoSpan:
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> bool:
+        return False
+
+
+_no_span = _NoSpan()
+
+
+def span(name: str, category: str = '') -> _Span | _NoSpan:
+    """with span('DataSet.load_data', 'data'): ..."""
+    if not _enabled:
+        return _no_span
+    return _Span(name, category)
+
+
+def profiled(name: Optional[str] = None, category: str = '') -> Callable[[F], F]:
+    """Marks every call of the function as a span (by default named like the function)"""
+
+    def decorator(function: F) -> F:
+        span_name = name or function.__qualname__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return function(*args, **kwargs)
+            with _Span(span_name, category):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def enable(print_summary: bool = True, trace_file: Optional[str] = None, trace_memory: bool = True):
+    """print_summary, trace_file: What finish() does"""
+    global _enabled, _trace_memory, _print_summary, _trace_file, _start_time
+    with _lock:
+        _print_summary = print_summary
+        _trace_file = trace_file
+        _records.clear()
+        _open_spans.clear()
+        _trace_memory = trace_memory
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        _start_time = time.perf_counter()
+        _enabled = True
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def disable() -> List[SpanRecord]:
+    """returns: All recorded spans"""
+    global _enabled, _trace_memory
+    with _lock:
+        _enabled = False
+        if _trace_memory:
+            tracemalloc.stop()
+        _trace_memory = False
+        _open_spans.clear()
+        records = list(_records)
+        _records.clear()
+    return records
+
+
+def summary(records: List[SpanRecord], total_time: Optional[float] = None) -> str:
+    """A table of all spans with the same name, sorted by their total time.
+    The spans can be nested, so their times add up to more than the total time"""
+    groups: Dict[tuple, List[SpanRecord]] = {}
+    for record in records:
+        groups.setdefault((record.category, record.name), []).append(record)
+    rows = []
+    for (category, name), group in groups.items():
+        durations = [record.duration for record in group]
+        peaks = [record.memory_peak for record in group if record.memory_peak is not None]
+        rows.append((sum(durations), f"{category}: {name}" if category else name, len(group),
+                     sum(durations) / len(group), max(durations), max(peaks) if peaks else None))
+    rows.sort(key=lambda row: row[0], reverse=True)
+
+    width = max([len(row[1]) for row in rows] + [len('Abschnitt')])
+    lines = [f"{'Abschnitt':<{width}} {'Aufrufe':>8} {'Gesamt (s)':>11} {'Mittel (ms)':>12} {'Max (ms)':>10}"
+             f" {'Speicher (MB)':>14}"]
+    for total, label, calls, mean, maximum, memory_peak in rows:
+        memory = f"{memory_peak / 1e6:>14.1f}" if memory_peak is not None else f"{'-':>14}"
+        lines.append(f"{label:<{width}} {calls:>8} {total:>11.3f} {mean * 1000:>12.1f} {maximum * 1000:>10.1f}"
+                     f" {memory}")
+    if total_time is not None:
+        lines.append(f"Laufzeit insgesamt: {total_time:.3f} s")
+    return '\n'.join(lines)
+
+
+def chrome_trace(records: List[SpanRecord]) -> Dict[str, Any]:
+    """The spans in the Trace Event Format (chrome://tracing, https://ui.perfetto.dev)"""
+    pid = os.getpid()
+    events = []
+    thread_names = {}
+    for record in records:
+        thread_names[record.thread_id] = record.thread_name
+        event = {
+            'name': record.name,
+            'cat': record.category or 'default',
+            'ph': 'X',
+            'ts': record.start * 1e6,
+            'dur': record.duration * 1e6,
+            'pid': pid,
+            'tid': record.thread_id,
+        }
+        if record.memory_peak is not None:
+            event['args'] = {'memory_peak_bytes': record.memory_peak}
+        events.append(event)
+    for thread_id, thread_name in thread_names.items():
+        events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': thread_id,
+                       'args': {'name': thread_name}})
+    return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+
+def finish(output: Optional[TextIO] = None):
+    """Stops profiling, prints the summary (to stderr by default) and writes the trace (see enable).
+    Does nothing if profiling is not enabled"""
+    if not _enabled:
+        return
+    total_time = time.perf_counter() - _start_time
+    print_summary, trace_file = _print_summary, _trace_file
+    records = disable()
+    if print_summary:
+        print(summary(records, total_time), file=output if output is not None else sys.stderr)
+    if trace_file is not None:
+        with open(trace_file, 'w', encoding='utf-8') as output_file:
+            json.dump(chrome_trace(records), output_file)
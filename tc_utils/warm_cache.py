@@ -0,0 +1,76 @@
+"""Keeps loaded data (DataSet, TC files, graphs) in memory between commands.
+This is only enabled in the daemon (see daemon.py); otherwise everything is loaded as usual.
+An entry is reloaded as soon as one of the files it has been loaded from changes."""
+from __future__ import annotations
+
+import logging
+import os
+import threading
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple, TypeVar
+
+T = TypeVar('T')
+
+_enabled = False
+_lock = threading.RLock()
+# key -> (state of the files, value)
+_entries: Dict[Tuple, Tuple[Tuple, Any]] = {}
+
+
+def enable():
+    global _enabled
+    _enabled = True
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def clear():
+    with _lock:
+        _entries.clear()
+
+
+def file_state(paths: Iterable[str]) -> Tuple:
+    """The modification time and size of all files (None for missing files)"""
+    state = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            state.append((path, stat.st_mtime_ns, stat.st_size))
+        except OSError:
+            state.append((path, None))
+    return tuple(state)
+
+
+def directory_files(directory: str) -> Iterable[str]:
+    """All files in the directory and its subdirectories"""
+    return sorted(os.path.join(root, file_name) for root, _, file_names in os.walk(directory)
+                  for file_name in file_names)
+
+
+def cached(key: Tuple,
+           paths: Callable[[], Iterable[str]],
+           load: Callable[[], T],
+           copy: Optional[Callable[[Any], T]] = None,
+           store: Optional[Callable[[T], Any]] = None) -> T:
+    """Returns the cached value for key if none of the files has changed since it has been loaded.
+    paths: Returns the files the value is loaded from
+    copy: Creates the value that is returned from the stored value (e.g., if the callers may modify it)
+    store: Converts the loaded value to the value that is stored (the inverse of copy)"""
+    if not _enabled:
+        return load()
+    with _lock:
+        state = file_state(paths())
+        entry = _entries.get(key)
+        if entry is not None and entry[0] == state:
+            stored = entry[1]
+        else:
+            if entry is not None:
+                logging.info(f"Lade {key[0]} neu, weil sich Dateien geändert haben")
+            value = load()
+            stored = store(value) if store is not None else value
+            _entries[key] = (state, stored)
+            if store is not None:
+                # The stored value doesn't share anything with the loaded one
+                return value
+        return copy(stored) if copy is not None else stored
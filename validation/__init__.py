@@ -8,11 +8,11 @@ import networkx as nx
 from networkx import is_connected
 
 from geo import Location
-from project_coordinates import project_coordinate_for_station
 import tc_utils
-from structures import DataSet, Station
+from structures import Station
 from structures.station import iter_stations_by_codes_reverse
 from tc_utils import TcFile
+from tc_utils.loading import Loader
 from validation.graph import build_tc_graph
 from structures.country import country_for_code, countries, germany
 from validation.shortest_paths import get_shortest_path
@@ -38,14 +38,16 @@ def validate(tc_directory: PathLike | str = '..',
              ) -> int:
     enforce_experimental = experimental == "enforce"
     enable_experimental = experimental != "false"
-    data_set = DataSet.load_data(data_directory)
+    with Loader(tc_directory, ('Path', 'Station', 'Train', 'TrainEquipment', 'TaskModel'),
+                data_directory) as loader:
+        path_json = loader.tc_file('Path')
+        station_json = loader.tc_file('Station')
+        train_json = loader.tc_file('Train')
+        train_equipment_json = loader.tc_file('TrainEquipment')
+        task_model_json = loader.tc_file('TaskModel')
+        data_set = loader.data_set
     stations: Dict[str, Station] = {code: station
                                     for code, station in iter_stations_by_codes_reverse(data_set.station_data)}
-    path_json = TcFile('Path', tc_directory)
-    station_json = TcFile('Station', tc_directory)
-    train_json = TcFile('Train', tc_directory)
-    train_equipment_json = TcFile('TrainEquipment', tc_directory)
-    task_model_json = TcFile('TaskModel', tc_directory)
 
     issues = 0
 
@@ -57,8 +59,10 @@ def validate(tc_directory: PathLike | str = '..',
 
     known_countries = (countries['CH'], germany)
 
+    from project_coordinates import project_coordinates_for_stations
+    project_coordinates_for_stations(station_json.data)
+
     for station, station_obj in selected_stations:
-        project_coordinate_for_station(station)
         if station_obj is None:
             country = country_for_code(station['ril100'])
             if country in known_countries:
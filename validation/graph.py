@@ -1,17 +1,20 @@
 from __future__ import annotations
 
+import os
 from argparse import ArgumentParser, Namespace
 from dataclasses import dataclass, field
 from enum import Enum
 from functools import cached_property
+from os import PathLike
 
 import networkx as nx
-from typing import List, Tuple, Any, Dict, Optional, Set, ClassVar
+from typing import List, Tuple, Any, Dict, Optional, Set, ClassVar, Callable
 
-from tc_utils import TcFile, expand_objects, flatten_objects
+from tc_utils import TcFile, expand_objects, flatten_objects, profiling, warm_cache
 from validation.shortest_paths import get_shortest_path, without_trivial_nodes, has_direct_path
 
 
+@profiling.profiled(category='graph')
 def build_tc_graph(stations: List[str], paths: List[Tuple[str, str] | Tuple[str, str, Dict[str, Any]]]) -> nx.Graph:
     graph = nx.Graph()
     graph.add_nodes_from(stations)
@@ -19,17 +22,47 @@ def build_tc_graph(stations: List[str], paths: List[Tuple[str, str] | Tuple[str,
     return graph
 
 
+@profiling.profiled(category='graph')
 def graph_from_files(station_json: TcFile, path_json: TcFile, case_sensitive: bool = False) -> nx.Graph:
     maybe_upper = str.upper if not case_sensitive else lambda s: s
 
     station_codes = [maybe_upper(station['ril100']) for station in flatten_objects(station_json.data)]
+    station_codes_set = set(station_codes)
     path_edges = [(maybe_upper(path['start']), maybe_upper(path['end']), path) for path in
                   flatten_objects(path_json.data)
-                  if maybe_upper(path['start']) in station_codes and maybe_upper(path['end']) in station_codes]
+                  if maybe_upper(path['start']) in station_codes_set and maybe_upper(path['end']) in station_codes_set]
 
     return build_tc_graph(station_codes, path_edges)
 
 
+def load_graph(tc_directory: PathLike | str = '..', case_sensitive: bool = False) -> nx.Graph:
+    """The graph of Station.json and Path.json. In the daemon, it is only built again if one of them has changed.
+    The graph may be shared, so it must not be modified"""
+    files = [os.path.join(tc_directory, name) + '.json' for name in ('Station', 'Path')]
+    return warm_cache.cached(('graph', os.path.abspath(tc_directory), case_sensitive), lambda: files,
+                             lambda: graph_from_files(TcFile('Station', tc_directory), TcFile('Path', tc_directory),
+                                                      case_sensitive=case_sensitive))
+
+
+def _parse_bool(value: Any) -> bool:
+    if isinstance(value, str):
+        return value.lower() in ('1', 'true', 'ja', 'yes', 'x')
+    return bool(value)
+
+
+# The options of PathSuggestionConfig.add_cli_args (as in the parsed arguments),
+# with a conversion for values from files (e.g., JSON or CSV)
+path_suggestion_options: Dict[str, Callable[[Any], Any]] = {
+    'avoid_sfs': _parse_bool,
+    'electrified': _parse_bool,
+    'full_path': _parse_bool,
+    'distance': _parse_bool,
+    'avoid_equipments': lambda value: value.split() if isinstance(value, str) else list(value),
+    'max_speed': int,
+    'path_suggestion_service': int,
+}
+
+
 @dataclass
 class PathSuggestionConfig:
     use_sfs: bool = field(default=True)
@@ -85,6 +118,21 @@ class PathSuggestionConfig:
             base_suggestion = path_suggestion_configs.get(args.path_suggestion_service, PathSuggestionConfigs.SPECIAL)
             return base_suggestion
 
+    @classmethod
+    def from_options(cls, options: Dict[str, Any], defaults: Optional[Namespace] = None) -> PathSuggestionConfig:
+        """Like from_cli_args, but the options (e.g., {"avoid_sfs": true, "max_speed": 160}) override the arguments.
+        defaults: The parsed CLI arguments (see add_cli_args)"""
+        arguments = {'avoid_sfs': False, 'electrified': False, 'full_path': False, 'avoid_equipments': None,
+                     'distance': False, 'max_speed': 5000, 'path_suggestion_service': None}
+        if defaults is not None:
+            arguments.update(vars(defaults))
+        for option, value in options.items():
+            option = option.replace('-', '_')
+            if option not in path_suggestion_options:
+                raise ValueError(f"Unbekannte Option: {option}")
+            arguments[option] = path_suggestion_options[option](value)
+        return cls.from_cli_args(Namespace(**arguments))
+
 
 class PathSuggestionConfigs(Enum):
     HGV = PathSuggestionConfig(
@@ -126,13 +174,24 @@ path_suggestion_configs: Dict[int, PathSuggestionConfig] = {
 }
 
 
+@profiling.profiled(category='routing')
 def get_path_suggestion(graph: nx.Graph, stations: List[str],
                         config: PathSuggestionConfig = PathSuggestionConfig(),
                         station_to_group: Optional[Dict[str, int]] = None,
-                        existing_path_suggestion: List[str] | None = None) -> List[str] | None:
-    path_complete = get_shortest_path(graph,
-                                      stations=existing_path_suggestion if existing_path_suggestion else stations,
-                                      config=config)
+                        existing_path_suggestion: List[str] | None = None,
+                        route_memo: Optional[RouteMemo] = None) -> List[str] | None:
+    route_stations = existing_path_suggestion if existing_path_suggestion else stations
+    if route_memo is not None:
+        path_complete = route_memo.full_path(route_stations, config)
+    else:
+        path_complete = get_shortest_path(graph, stations=route_stations, config=config)
+    return reduce_path_suggestion(graph, stations, path_complete, config, station_to_group)
+
+
+def reduce_path_suggestion(graph: nx.Graph, stations: List[str], path_complete: Optional[List[str]],
+                           config: PathSuggestionConfig = PathSuggestionConfig(),
+                           station_to_group: Optional[Dict[str, int]] = None) -> List[str] | None:
+    """Creates the pathSuggestion from the complete path (see get_shortest_path)"""
     if not path_complete:
         # For single stations, we can't compute a pathSuggestion
         return None
@@ -141,7 +200,48 @@ def get_path_suggestion(graph: nx.Graph, stations: List[str],
         path_without_trivial_nodes = without_trivial_nodes(graph, stations, path_complete, station_to_group)
         return path_without_trivial_nodes
     else:
-        return path_complete
+        return list(path_complete)
+
+
+class RouteMemo:
+    """Remembers the complete paths (and pathSuggestions) that have been computed in one graph,
+    so e.g. the pathSuggestion and the SFS check of a task (or many tasks with the same stations)
+    only need one routing pass"""
+    graph: nx.Graph
+    # (stations, routing settings) -> path
+    _full_paths: Dict[Tuple, Optional[List[str]]]
+    _path_suggestions: Dict[Tuple, Optional[List[str]]]
+
+    def __init__(self, graph: nx.Graph):
+        self.graph = graph
+        self._full_paths = {}
+        self._path_suggestions = {}
+
+    @staticmethod
+    def _key(stations: List[str], config: PathSuggestionConfig) -> Tuple[Tuple[str, ...], Tuple]:
+        # Only the settings that are used by get_shortest_path
+        return tuple(stations), (config.train['speed'], config.use_sfs, config.non_electrified,
+                                 frozenset(config.avoid_equipments or ()))
+
+    def full_path(self, stations: List[str], config: PathSuggestionConfig = PathSuggestionConfig()) \
+            -> Optional[List[str]]:
+        key = self._key(stations, config)
+        if key not in self._full_paths:
+            self._full_paths[key] = get_shortest_path(self.graph, stations=stations, config=config)
+        path = self._full_paths[key]
+        return list(path) if path is not None else None
+
+    def path_suggestion(self, stations: List[str], config: PathSuggestionConfig = PathSuggestionConfig()) \
+            -> Optional[List[str]]:
+        key = self._key(stations, config) + (config.full_path,)
+        if key not in self._path_suggestions:
+            self._path_suggestions[key] = reduce_path_suggestion(self.graph, stations,
+                                                                 self.full_path(stations, config), config)
+        path = self._path_suggestions[key]
+        return list(path) if path is not None else None
+
+    def __len__(self) -> int:
+        return len(self._full_paths)
 
 
 def fixed_path_suggestion(graph: nx.Graph, stations: List[str],
@@ -5,11 +5,13 @@ from typing import Dict, Any, List, Optional, Generator, Set, TYPE_CHECKING, Tup
 import networkx as nx
 
 from cli_utils import format_list_double_quotes
+from tc_utils import profiling
 
 if TYPE_CHECKING:
     from validation.graph import PathSuggestionConfig
 
 
+@profiling.profiled(category='routing')
 def get_shortest_path(graph: nx.Graph,
                       stations: List[str],
                       train: Optional[Dict[str, Any]] = None,
@@ -69,7 +71,9 @@ def get_shortest_path(graph: nx.Graph,
                 # We will need to try to find an alternative path
                 if log:
                     logging.error("Konnte keinen Pfad finden für {}".format(format_list_double_quotes(stations)))
-                    logging.debug("Pfad bisher: {}".format(format_list_double_quotes(merge_shortest_paths(shortest_paths))))
+                    if shortest_paths:
+                        logging.debug("Pfad bisher: {}".format(
+                            format_list_double_quotes(merge_shortest_paths(shortest_paths))))
                 raise e
             shortest_paths.append(path)
             visited_stations.update(path)